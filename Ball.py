@@ -1,10 +1,15 @@
-from collections import deque
+from collections import namedtuple
 import cv2
 import numpy as np
-from Setup import display, CAP_RESOLUTION, NET_HIT_BUFFER, NET_VIEW_BUFFER
-from typing import Union, Tuple
+from Setup import display, CAP_RESOLUTION, DEFAULT_GEOMETRY, SceneGeometry
+from typing import List, Sequence, Union, Tuple, Optional
+from time import perf_counter
 import math
-import imutils
+from Profiling import PROFILER
+from Prediction import KalmanPredictor, Prediction, decodePoint, encodePoint
+from ColorClassifier import ColorClassifier
+from Motion import ChangeDetector, FrameDifference
+from Candidates import Candidate, findCandidates
 
 
 LEFT = 0
@@ -16,6 +21,12 @@ DOWN = 3
 HORIZONTAL = 0
 VERTICAL = 1
 
+# Snapshot of everything GameState reads from a Ball after a processed frame
+BallObservation = namedtuple('BallObservation', ['pos', 'lastPos', 'netSide', 'bounceSide', 'hitDirection',
+                                                 'ballCrossedTo', 'framesOnSide', 'hasHitNet', 'currentDir',
+                                                 'timeSinceBounce'])
+
+
 # Convert HSV values between formats
 class Convert:
 
@@ -39,11 +50,103 @@ class Convert:
         return Hue, Sat, Val
 
 
+# Preallocated workspace for the per-frame masks, so the steady-state loop allocates no image memory
+class FrameBuffers:
+
+    GRAY_BUFFERS = ('gray', 'motion', 'color', 'mask', 'morph')
+    COLOR_BUFFERS = ('diff',)
+    WORD_BUFFERS = ('colorWords',)  # A uint32 per pixel
+    INDEX_BUFFERS = ('colorIndex',)  # An np.intp per pixel
+    LABEL_BUFFERS = ('labels',)  # An int32 per pixel
+
+    def __init__(self, res: tuple, frames: int=1):
+        width, height = res
+        self.res = res
+        self.frames = frames  # Frames each buffer holds, for batches of frames
+        size = frames * height * width
+        self._storage = {name: np.empty(size, dtype=np.uint8) for name in self.GRAY_BUFFERS}
+        self._storage.update({name: np.empty(size * 3, dtype=np.uint8) for name in self.COLOR_BUFFERS})
+        self._storage.update({name: np.empty(size, dtype=np.uint32) for name in self.WORD_BUFFERS})
+        self._storage.update({name: np.empty(size, dtype=np.intp) for name in self.INDEX_BUFFERS})
+        self._storage.update({name: np.empty(size, dtype=np.int32) for name in self.LABEL_BUFFERS})
+
+    def get(self, name: str, shape: tuple) -> np.ndarray:
+        """A contiguous view of the named buffer with the given ([frames,] height, width[, 3]) shape."""
+        size = int(np.prod(shape))
+        storage = self._storage[name]
+        if size > storage.size:
+            raise ValueError('Frames of shape %s do not fit the %d %dx%d frame buffers.' %
+                             (shape, self.frames, *self.res))
+        return storage[:size].reshape(shape)
+
+
+def pyramidLevelsFor(res: tuple, maxWidth: int=CAP_RESOLUTION[0]) -> int:
+    """How many times frames of this resolution are halved to be searched at no more than maxWidth."""
+    levels = 0
+    while (res[0] >> levels) > maxWidth:
+        levels += 1
+    return levels
+
+
+# Fixed-capacity history of (x, y) points. Every point is written twice, capacity apart, so the most recent
+# points are always one contiguous view of the buffer and reading them never copies.
+class PointHistory:
+
+    MISSING = -1  # Coordinate stored for frames where the ball was not found
+
+    __slots__ = ('capacity', 'data', 'next', 'length')
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.data = np.full((2 * capacity, 2), self.MISSING, dtype=np.int32)
+        self.next = 0  # Slot the next point is written to
+        self.length = 0
+
+    def append(self, point: Optional[Tuple[int, int]]) -> None:
+        if point is None:
+            point = (self.MISSING, self.MISSING)
+        i = self.next
+        self.data[i] = point
+        self.data[i + self.capacity] = point
+        self.next = i + 1 if i + 1 < self.capacity else 0
+        if self.length < self.capacity:
+            self.length += 1
+
+    def last(self, n: int) -> np.ndarray:
+        """View of the n most recent points (fewer if there are not that many yet), oldest first."""
+        n = min(n, self.length)
+        end = self.next + self.capacity
+        return self.data[end - n:end]
+
+    def toTuples(self, n: Optional[int]=None) -> tuple:
+        return tuple(None if x == self.MISSING else (x, y)
+                     for x, y in self.last(self.length if n is None else n).tolist())
+
+    def __len__(self) -> int:
+        return self.length
+
+    @staticmethod
+    def recordDtype(capacity: int) -> np.dtype:
+        return np.dtype([('data', '<i4', (2 * capacity, 2)), ('next', '<i4'), ('length', '<i4')])
+
+    def snapshot(self, record: np.void) -> None:
+        """Writes the history into a record of recordDtype(capacity) - a copy of its fixed size storage."""
+        record['data'] = self.data
+        record['next'] = self.next
+        record['length'] = self.length
+
+    def restore(self, record: np.void) -> None:
+        self.data[:] = record['data']
+        self.next = int(record['next'])
+        self.length = int(record['length'])
+
+
 # Low level image processing / ball tracking
 class Ball:
 
     YELLOW_LOWER = Convert.blenderToCV2(.09, .17, .24)
     YELLOW_HIGHER = Convert.blenderToCV2(.30, .75, 1.0)
+    COLORS = ColorClassifier({'ball': [(YELLOW_LOWER, YELLOW_HIGHER)]})
 
     STATE_PRE_SERVE = 0
     STATE_ACTIVE_SERVE = 1
@@ -56,18 +159,56 @@ class Ball:
         STATE_EXPECTING_RETURN: "ER"
     }
 
-    N_POINTS = 5
-
-    def __init__(self, netX, servingSide=None):
+    N_POINTS = 5  # Most points any detector looks at
+    HISTORY_CAPACITY = 64  # Points kept around for longer detection windows
+
+    # Morphology kernels applied to the combined mask
+    DILATE_KERNEL = np.ones((3,1), dtype=np.uint8)
+    OPEN_KERNEL = np.ones((5,5), dtype=np.uint8)
+    # How far the morphology passes reach outside a pixel (1 for the dilate and 2 + 2 for the open)
+    ROI_PADDING = 5
+    # Pixels around a detection on a downscaled frame (at the search level) refined at full resolution
+    REFINE_RADIUS = 12
+    # Idle frames with nothing moving near the table are only searched this often
+    IDLE_INTERVAL = 10
+
+    __slots__ = ('netX', 'geometry', 'pyramidLevels', 'pyramidScale', 'predictor', 'motionModel', 'changes',
+                 'idleFrames', 'buffers', 'batchBuffers', 'searchFrames', 'searchSource', 'pos', 'lastPos',
+                 'lastDisp', 'netSide', 'points', 'motionPoints', 'bounceSide', 'timeSinceBounce', 'hitDirection',
+                 'ballCrossedTo', 'currentDir', 'hasHitNet', 'framesOnSide', 'framesProcessed')
+    # The per-process workspace, which isn't shipped between processes or part of a snapshot
+    WORKSPACE = ('buffers', 'batchBuffers', 'searchFrames', 'searchSource')
+    # Optional sides in snapshot records, -1 for None
+    SIDE_FIELDS = ('netSide', 'bounceSide', 'hitDirection', 'ballCrossedTo', 'currentDir')
+
+    def __init__(self, netX, servingSide=None, buffers: Optional[FrameBuffers]=None, predictor=None,
+                 geometry: Optional[SceneGeometry]=None, pyramidLevels: int=0, motionModel=None):
         # Constants
         self.netX = netX
+        # Pixel sizes at the resolution of the frames, from the buffers if not given
+        if geometry is None:
+            geometry = SceneGeometry(buffers.res) if buffers is not None else DEFAULT_GEOMETRY
+        self.geometry = geometry
+        # Frames are halved this many times before searching them, and detections refined at full resolution
+        self.pyramidLevels = pyramidLevels
+        self.pyramidScale = 1 << pyramidLevels
+        # Predicts where to search for the ball next - a KalmanPredictor unless given e.g. a DisplacementPredictor
+        self.predictor = predictor if predictor is not None else KalmanPredictor(geometry.scale)
+        # What counts as motion - the difference from the previous frame unless given e.g. a RunningBackground
+        self.motionModel = motionModel if motionModel is not None else FrameDifference()
+        self.changes = ChangeDetector(geometry.scale)  # Skips unchanged frames before the motion mask
+        self.idleFrames = 0  # Idle frames so far, every IDLE_INTERVAL-th one is searched
+        self.buffers = buffers  # Created from the first frame if not given
+        self.batchBuffers = None  # Sized to the largest batch given to processFrames
+        self.searchFrames = None  # The two downscaled frames of the pyramid, current first
+        self.searchSource = None  # The frame the current downscaled frame was made from
         # Simple data
         self.pos = None
         self.lastPos = None
         self.lastDisp = None
         self.netSide = servingSide
-        self.points = deque(maxlen=self.N_POINTS)  # Stores all the data we have on the ball - even if None
-        self.motionPoints = deque(maxlen=self.N_POINTS)  # Stores only the motions we know about the ball
+        self.points = PointHistory(self.HISTORY_CAPACITY)  # Stores all the data we have on the ball - even if None
+        self.motionPoints = PointHistory(self.HISTORY_CAPACITY)  # Stores only the motions we know about the ball
         # Processed data from most recent frame
         self.bounceSide = None  # Either None (no bounce), Left, or Right side
         self.timeSinceBounce = 0
@@ -81,7 +222,12 @@ class Ball:
         self.framesProcessed = 0
 
     def updatePosFromFrame(self, prevFrame, currentFrame, showProcessedFrame=True, showMaskFrame=True, output=False,
-                           debugWrite=False) -> bool:
+                           debugWrite=False, idle=False) -> bool:
+        """
+        Searches the current frame for the ball, returns False for frames that are skipped.
+        idle is for stretches where the ball isn't in play, e.g. before a serve - while the ball is lost, frames
+        where nothing moved near the table are taken as not having the ball without being searched.
+        """
         self.framesProcessed += 1
         infoFrame = None
 
@@ -94,60 +240,150 @@ class Ball:
         # Apply color threshold
         if prevFrame is None:
             return False
+        if self.buffers is None:
+            self.buffers = FrameBuffers((currentFrame.shape[1], currentFrame.shape[0]))
+        prof = PROFILER if PROFILER.enabled else None
 
-        # Get motion mask
-        diffFrame = cv2.absdiff(currentFrame, prevFrame)
-        grayDiffFrame = cv2.cvtColor(diffFrame, cv2.COLOR_BGR2GRAY)
-        if cv2.countNonZero(grayDiffFrame) == 0:  # If there is a duplicate frame or an unnecessary one
+        # Unchanged frames, e.g. a webcam repeating one, are skipped before any full frame work
+        if prof: t = perf_counter()
+        if not self.changes.changed(prevFrame, currentFrame):
             return False
-        ret, motionMask = cv2.threshold(grayDiffFrame, 15, 255, cv2.THRESH_BINARY)
+        if prof: t = prof.lap('changes', t)
 
-        # Get color mask
-        hsv = cv2.cvtColor(currentFrame, cv2.COLOR_BGR2HSV)
-        colorMask = cv2.inRange(hsv, self.YELLOW_LOWER, self.YELLOW_HIGHER)
-        if debugWrite:
-            cv2.imwrite('debug/frame_%d_color-mask.jpg' % self.framesProcessed, colorMask)
+        # If we know the motion of the ball, we can assume where it will be headed and only search there
+        prediction, window = self._predictWindow(currentFrame.shape, output)
+        if prof: prof.lap('window', t)
+        if idle and window is None and self._idleSkip(currentFrame.shape):
+            return True
+        if window is not None and showProcessedFrame:
+            cv2.rectangle(infoFrame, window[:2], window[2:], (255, 0, 0), 2)
+            self.predictor.draw(infoFrame, prediction)
+
+        # With the pyramid on, everything up to the refinement happens on downscaled frames
+        searchShape = self._searchShape(currentFrame.shape)
+        prediction, window = self._toSearchLevel(prediction, window, searchShape)
+
+        if window is None:
+            # Ball is lost - search the full frame
+            searchPrev, searchFrame = self._searchFrames(prevFrame, currentFrame)
+            maskTotal = self._computeMask(searchPrev, searchFrame, debugWrite)
+            if maskTotal is None:  # If there is a duplicate frame or an unnecessary one
+                return False
+            if prof: t = perf_counter()
+            self._cropNetSide(maskTotal, 0)
+            searchMask, searchOffset = maskTotal, (0, 0)
+        else:
+            x0, y0, x1, y1 = window
+            # Pad the window so the morphology passes see the same neighbourhood as they would on the full frame
+            height, width = searchShape
+            px0, py0 = max(x0 - self.ROI_PADDING, 0), max(y0 - self.ROI_PADDING, 0)
+            px1, py1 = min(x1 + self.ROI_PADDING, width), min(y1 + self.ROI_PADDING, height)
+            searchPrev, searchRegion = self._searchRegions(prevFrame, currentFrame, (px0, py0, px1, py1))
+            maskTotal = self._computeMask(searchPrev, searchRegion, debugWrite, (px0, py0, px1, py1), searchShape)
+            if prof: t = perf_counter()
+            if maskTotal is None:
+                # Nothing moved in the window, which only means a duplicate frame if nothing moved anywhere
+                if self._isDuplicateFrame(*self._searchFrames(prevFrame, currentFrame)):
+                    return False
+                maskTotal = self.buffers.get('morph', (py1 - py0, px1 - px0))
+                maskTotal.fill(0)
+            self._cropNetSide(maskTotal, px0)
+            searchMask, searchOffset = maskTotal[y0-py0:y1-py0, x0-px0:x1-px0], (x0, y0)
 
-        # Combine masks and crop them to exclude moving players on other side
-        maskTotal = cv2.bitwise_and(motionMask, colorMask)
-        if debugWrite:
-            cv2.imwrite('debug/frame_%d_total-mask.jpg' % self.framesProcessed, maskTotal)
+        # Refer to identification function
+        center = self._identifySearchCenter(searchMask, searchOffset, prediction, output)
+        if center is not None and self.pyramidLevels:
+            if prof: t = perf_counter()
+            center = self._refineCenter(prevFrame, currentFrame, center)
+            if prof: prof.lap('refine', t)
+        self._trackCenter(center)
 
-        # Morphological operation
-        kernel = np.ones((3,1), dtype=np.uint8)
-        squareKernel = np.ones((5,5), dtype=np.uint8)
-        maskTotal = cv2.morphologyEx(maskTotal, cv2.MORPH_DILATE, kernel)
-        maskTotal = cv2.morphologyEx(maskTotal, cv2.MORPH_OPEN, squareKernel)
-        if debugWrite:
-            cv2.imwrite('debug/frame_%d_morph-mask.jpg' % self.framesProcessed, maskTotal)
+        # Draw pretty lines
+        if showProcessedFrame and len(self.motionPoints) > 1:
+            cv2.polylines(infoFrame, [self.motionPoints.last(self.N_POINTS)], False, (0, 0, 255), 2)
+
+        if showMaskFrame:
+            # Only the search area was processed - lay it out on a full frame for display
+            fullMask = np.zeros(searchShape, dtype=np.uint8)
+            fullMask[searchOffset[1]:searchOffset[1] + searchMask.shape[0],
+                     searchOffset[0]:searchOffset[0] + searchMask.shape[1]] = searchMask
+            if self.pyramidLevels:
+                fullMask = cv2.resize(fullMask, (currentFrame.shape[1], currentFrame.shape[0]),
+                                      interpolation=cv2.INTER_NEAREST)
+            searchMask = fullMask
 
-        # Crop frame to exclude moving players on the other side of the table
-        # This forces the ball to only cross sides through the central view buffer
-        if self.netSide == LEFT:
-            maskTotal[:, self.netX + NET_VIEW_BUFFER:] = 0
-        elif self.netSide == RIGHT:
-            maskTotal[:, :self.netX - NET_VIEW_BUFFER] = 0
-
-        # If we know the motion of the ball, we can assume where it will be headed
-        if self.lastDisp is not None and self.pos is not None:
-            VERTICAL_BUFFER = 2 * abs(self.lastDisp[1]) + 50
-            HORIZONTAL_BUFFER = 2 * abs(self.lastDisp[0]) + 40
-            SHIFT_X = ((CAP_RESOLUTION[0] - 2 * self.lastPos[0]) / (2 * CAP_RESOLUTION[0])) * 2.5
-            if output: print('Shift X: %f' % SHIFT_X)
-            POINT = (int((self.lastPos[0]+self.lastDisp[0])+SHIFT_X*HORIZONTAL_BUFFER), self.lastPos[1]+self.lastDisp[1])
-            top_left = (POINT[0]-HORIZONTAL_BUFFER if POINT[0]-HORIZONTAL_BUFFER > 0 else 0, POINT[1]-VERTICAL_BUFFER)
-            bot_right = (POINT[0]+HORIZONTAL_BUFFER if POINT[0]+HORIZONTAL_BUFFER > 0 else 0, POINT[1]+VERTICAL_BUFFER)
-
-            blank = np.zeros((CAP_RESOLUTION[1], CAP_RESOLUTION[0]), dtype=np.uint8)
-            blank[top_left[1]:bot_right[1], top_left[0]:bot_right[0]] = \
-                maskTotal[top_left[1]:bot_right[1], top_left[0]:bot_right[0]]
-            maskTotal = blank
-            if showProcessedFrame: cv2.rectangle(infoFrame, top_left, bot_right, (255, 0, 0), 2)
+        if showProcessedFrame and showMaskFrame:
+            searchMask = cv2.cvtColor(searchMask, cv2.COLOR_GRAY2BGR)
+            bothImgs = np.hstack((infoFrame, searchMask))
+            cv2.imshow('Both frames', bothImgs)
+        elif showProcessedFrame:
+            # Process GUI
+            cv2.imshow('Processed frame', infoFrame)
+        elif showMaskFrame:
+            cv2.imshow('Total mask frame', searchMask)
 
-        # Refer to identification function
-        center = self._identifyBallCenter(maskTotal, self.lastPos, output=output)
+        return True
 
+    def processFrames(self, prevFrame: Optional[np.ndarray], frames: np.ndarray) -> List[Optional[BallObservation]]:
+        """
+        Batched updatePosFromFrame + updateProcessedData for recorded video, without any display.
+        frames is a (N, H, W, 3) stack of consecutive frames following prevFrame. The masks of the whole stack
+        are computed in a few passes, then the tracking runs over them frame by frame exactly as it would have
+        per frame. Returns each frame's observation, None for the frames updatePosFromFrame would have skipped.
+        Motion models whose masks depend on earlier frames, like a RunningBackground, are run frame by frame.
+        """
+        count, height, width = frames.shape[:3]
+        if count == 0:
+            return []
+        if not self.motionModel.batched:
+            observations = []
+            for frame in frames:
+                observation = None
+                if self.updatePosFromFrame(prevFrame, frame, showProcessedFrame=False, showMaskFrame=False):
+                    self.updateProcessedData()
+                    observation = self.observe()
+                observations.append(observation)
+                prevFrame = frame
+            return observations
+        if self.buffers is None:
+            self.buffers = FrameBuffers((width, height))
+        searchPrev, searchFrames = prevFrame, frames
+        if self.pyramidLevels:
+            searchPrev, searchFrames = self._downscaleStack(prevFrame, frames)
+        masks, changed = self._computeMasks(searchPrev, searchFrames)
+        prof = PROFILER if PROFILER.enabled else None
+
+        observations = []
+        for i in range(count):
+            self.framesProcessed += 1
+            # No previous frame or a duplicate frame - checked the same way updatePosFromFrame does as well
+            if not changed[i] or not self.changes.changed(frames[i - 1] if i else prevFrame, frames[i]):
+                observations.append(None)
+                continue
+            if prof: t = perf_counter()
+
+            # The full frame mask is already there, so searching a window of it only needs a crop
+            mask = masks[i]
+            prediction, window = self._toSearchLevel(*self._predictWindow(frames.shape[1:]), mask.shape)
+            if window is None:
+                searchMask, searchOffset = mask, (0, 0)
+            else:
+                x0, y0, x1, y1 = window
+                searchMask, searchOffset = mask[y0:y1, x0:x1], (x0, y0)
+            self._cropNetSide(searchMask, searchOffset[0])
+            if prof: prof.lap('crop', t)
+
+            center = self._identifySearchCenter(searchMask, searchOffset, prediction)
+            if center is not None and self.pyramidLevels:
+                center = self._refineCenter(frames[i - 1] if i else prevFrame, frames[i], center)
+            self._trackCenter(center)
+            self.updateProcessedData()
+            observations.append(self.observe())
+        return observations
+
+    def _trackCenter(self, center: Optional[Tuple[int, int]]) -> None:
         # Process ball point
+        self.predictor.update(center)
         self.points.append(center)
         self.pos = center
         if center is not None:
@@ -157,25 +393,259 @@ class Ball:
             self.lastPos = center
             self.motionPoints.append(center)
 
-        # Draw pretty lines
-        if showProcessedFrame:
-            for i in range(1, len(self.motionPoints)):
-                infoFrame = cv2.line(infoFrame, tuple(self.motionPoints[i - 1]), tuple(self.motionPoints[i]),
-                                     (0, 0, 255), 2)
+    def _predictWindow(self, frameShape: tuple, output: bool=False) -> tuple:
+        """The predictor's guess for this frame and the (x0, y0, x1, y1) window to search, None for either if unknown."""
+        prediction = self.predictor.predict()
+        if prediction is None:
+            return None, None
+        window = self.predictor.searchWindow(prediction, frameShape, output=output)
+        return (prediction, window) if window is not None else (None, None)
+
+    def _toSearchLevel(self, prediction: Optional[Prediction], window: Optional[tuple], searchShape: tuple) -> tuple:
+        """The prediction and window in the coordinates of the downscaled frames the pyramid searches."""
+        scale = self.pyramidScale
+        if scale == 1 or window is None:
+            return prediction, window
+        height, width = searchShape[:2]
+        x0, y0, x1, y1 = window
+        window = (x0 // scale, y0 // scale, min(-(-x1 // scale), width), min(-(-y1 // scale), height))
+        pos = (prediction.pos[0] // scale, prediction.pos[1] // scale)
+        if prediction.sigma is None:
+            return Prediction(pos, None, None), window
+        return Prediction(pos, (prediction.sigma[0] / scale, prediction.sigma[1] / scale),
+                          (prediction.reach[0] / scale, prediction.reach[1] / scale)), window
+
+    def _identifySearchCenter(self, searchMask: np.ndarray, searchOffset: Tuple[int, int],
+                              prediction: Optional[Prediction], output: bool=False) -> Optional[Tuple[int, int]]:
+        """_identifyBallCenter on the search mask, in search level coordinates."""
+        referencePos = self.predictor.referencePos(self.lastPos)
+        if referencePos is not None and self.pyramidLevels:
+            referencePos = (referencePos[0] // self.pyramidScale, referencePos[1] // self.pyramidScale)
+        return self._identifyBallCenter(searchMask, referencePos, output=output, offset=searchOffset,
+                                        prediction=prediction, scale=self.geometry.scale / self.pyramidScale,
+                                        labels=self.buffers.get('labels', searchMask.shape))
+
+    def _searchShape(self, frameShape: tuple) -> Tuple[int, int]:
+        """(height, width) of frames at the pyramid's search level."""
+        return frameShape[0] >> self.pyramidLevels, frameShape[1] >> self.pyramidLevels
+
+    def _downscale(self, frame: np.ndarray, region: tuple, dst: np.ndarray) -> np.ndarray:
+        """
+        Averages each pyramidScale square of the frame under an (x0, y0, x1, y1) search level region into dst.
+        The blocks line up with the search level pixels, so a region comes out the same as when the whole frame
+        is downscaled. Halves one level at a time - OpenCV's area resize is only fast at a factor of 2.
+        """
+        scale = self.pyramidScale
+        x0, y0, x1, y1 = region
+        frame = frame[y0 * scale:y1 * scale, x0 * scale:x1 * scale]
+        for level in range(self.pyramidLevels - 1, -1, -1):
+            size = ((x1 - x0) << level, (y1 - y0) << level)
+            frame = cv2.resize(frame, size, dst=None if level else dst, interpolation=cv2.INTER_AREA)
+        return frame
+
+    def _searchBuffers(self, shape: Tuple[int, int]) -> List[np.ndarray]:
+        """The [current, previous] search level frame buffers, (re)allocated for frames of the (height, width)."""
+        if self.searchFrames is None or self.searchFrames[0].shape[:2] != shape:
+            self.searchFrames = [np.empty(shape + (3,), dtype=np.uint8) for _ in range(2)]
+            self.searchSource = None
+        return self.searchFrames
+
+    def _searchFrames(self, prevFrame: np.ndarray, currentFrame: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Both whole frames at the search level. The previous one is usually the last call's current one."""
+        if not self.pyramidLevels:
+            return prevFrame, currentFrame
+        height, width = self._searchShape(currentFrame.shape)
+        searchCurrent, searchPrev = self._searchBuffers((height, width))
+        if prevFrame is self.searchSource:
+            searchCurrent, searchPrev = searchPrev, searchCurrent
+        else:
+            self._downscale(prevFrame, (0, 0, width, height), searchPrev)
+        self._downscale(currentFrame, (0, 0, width, height), searchCurrent)
+        self.searchFrames = [searchCurrent, searchPrev]
+        self.searchSource = currentFrame
+        return searchPrev, searchCurrent
+
+    def _searchRegions(self, prevFrame: np.ndarray, currentFrame: np.ndarray,
+                       region: tuple) -> Tuple[np.ndarray, np.ndarray]:
+        """An (x0, y0, x1, y1) region of both frames at the search level - only the region is downscaled."""
+        x0, y0, x1, y1 = region
+        if not self.pyramidLevels:
+            return prevFrame[y0:y1, x0:x1], currentFrame[y0:y1, x0:x1]
+        # The regions are written over the whole frame buffers, which then no longer hold the last frames
+        buffers = self._searchBuffers(self._searchShape(currentFrame.shape))
+        self.searchSource = None
+        shape = (y1 - y0, x1 - x0, 3)
+        size = shape[0] * shape[1] * 3
+        searchCurrent, searchPrev = (frame.reshape(-1)[:size].reshape(shape) for frame in buffers)
+        return self._downscale(prevFrame, region, searchPrev), self._downscale(currentFrame, region, searchCurrent)
+
+    def _downscaleStack(self, prevFrame: Optional[np.ndarray], frames: np.ndarray) -> tuple:
+        """_downscale for processFrames - the previous frame and a stack of the frames at the search level."""
+        height, width = self._searchShape(frames.shape[1:])
+        region = (0, 0, width, height)
+        searchPrev = None
+        if prevFrame is not None:
+            searchPrev = self._downscale(prevFrame, region, None)
+        searchFrames = np.empty((len(frames), height, width, 3), dtype=np.uint8)
+        for frame, searchFrame in zip(frames, searchFrames):
+            self._downscale(frame, region, searchFrame)
+        return searchPrev, searchFrames
+
+    def _refineCenter(self, prevFrame: np.ndarray, currentFrame: np.ndarray,
+                      searchCenter: Tuple[int, int]) -> Tuple[int, int]:
+        """Moves a detection on the downscaled frames to the centroid of the ball's full resolution pixels."""
+        scale = self.pyramidScale
+        radius = self.REFINE_RADIUS * scale
+        x, y = searchCenter[0] * scale + scale // 2, searchCenter[1] * scale + scale // 2
+        height, width = currentFrame.shape[:2]
+        x0, y0 = max(x - radius, 0), max(y - radius, 0)
+        x1, y1 = min(x + radius + 1, width), min(y + radius + 1, height)
+        currentPatch, prevPatch = currentFrame[y0:y1, x0:x1], prevFrame[y0:y1, x0:x1]
+
+        # The same motion and color mask as _computeMask, the patch is too small to need the morphology
+        buffers = self.buffers
+        shape = currentPatch.shape[:2]
+        diffPatch = cv2.absdiff(currentPatch, prevPatch, dst=buffers.get('diff', currentPatch.shape))
+        grayDiffPatch = cv2.cvtColor(diffPatch, cv2.COLOR_BGR2GRAY, dst=buffers.get('gray', shape))
+        ret, motionMask = cv2.threshold(grayDiffPatch, FrameDifference.THRESHOLD, 255, cv2.THRESH_BINARY,
+                                        dst=buffers.get('motion', shape))
+        colorMask = self.COLORS.mask(currentPatch, 'ball', dst=buffers.get('color', shape),
+                                     words=buffers.get('colorWords', shape),
+                                     index=buffers.get('colorIndex', shape))
+        mask = cv2.bitwise_and(motionMask, colorMask, dst=buffers.get('mask', shape))
+
+        moments = cv2.moments(mask, binaryImage=True)
+        if moments['m00'] == 0:
+            return x, y
+        return x0 + int(moments['m10'] / moments['m00']), y0 + int(moments['m01'] / moments['m00'])
+
+    def _computeMask(self, prevFrame, currentFrame, debugWrite: bool=False, region: Optional[tuple]=None,
+                     frameShape: Optional[tuple]=None) -> Union[np.ndarray, None]:
+        """
+        Motion and color mask of a frame (or the (x0, y0, x1, y1) region of one of frameShape),
+        None if nothing changed since the last frame.
+        """
 
-        if showProcessedFrame and showMaskFrame:
-            maskTotal = cv2.cvtColor(maskTotal, cv2.COLOR_GRAY2BGR)
-            bothImgs = np.hstack((infoFrame, maskTotal))
-            cv2.imshow('Both frames', bothImgs)
-        elif showProcessedFrame:
-            # Process GUI
-            cv2.imshow('Processed frame', infoFrame)
-        elif showMaskFrame:
-            cv2.imshow('Total mask frame', maskTotal)
+        buffers = self.buffers
+        shape = currentFrame.shape[:2]
+        if region is None:
+            region, frameShape = (0, 0, shape[1], shape[0]), shape
+        prof = PROFILER if PROFILER.enabled else None
+        if prof: t = perf_counter()
+
+        # Get motion mask
+        motionMask = self.motionModel.mask(prevFrame, currentFrame, region, frameShape, buffers)
+        if motionMask is None:
+            if prof: prof.lap('motion', t)
+            return None
+        if prof: t = prof.lap('motion', t)
+
+        # Get color mask
+        colorMask = self.COLORS.mask(currentFrame, 'ball', dst=buffers.get('color', shape),
+                                     words=buffers.get('colorWords', shape),
+                                     index=buffers.get('colorIndex', shape))
+        if prof: t = prof.lap('color', t)
+        if debugWrite:
+            cv2.imwrite('debug/frame_%d_color-mask.jpg' % self.framesProcessed, colorMask)
+
+        # Combine masks
+        maskTotal = cv2.bitwise_and(motionMask, colorMask, dst=buffers.get('mask', shape))
+        if debugWrite:
+            cv2.imwrite('debug/frame_%d_total-mask.jpg' % self.framesProcessed, maskTotal)
+
+        # Morphological operation
+        maskTotal = cv2.morphologyEx(maskTotal, cv2.MORPH_DILATE, self.DILATE_KERNEL, dst=buffers.get('morph', shape))
+        maskTotal = cv2.morphologyEx(maskTotal, cv2.MORPH_OPEN, self.OPEN_KERNEL, dst=maskTotal)
+        if prof: prof.lap('morphology', t)
+        if debugWrite:
+            cv2.imwrite('debug/frame_%d_morph-mask.jpg' % self.framesProcessed, maskTotal)
+
+        return maskTotal
+
+    def _computeMasks(self, prevFrame: Optional[np.ndarray], frames: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        _computeMask of every frame in a (N, H, W, 3) stack, as a (N, H, W) stack of masks along with whether
+        each frame changed since the one before it.
+        The stack is processed as one tall image, so every per-pixel pass is a single OpenCV call. Morphology
+        looks at neighbouring pixels, so it still runs per frame to keep the frames' borders apart.
+        """
+        count, height, width = frames.shape[:3]
+        if self.batchBuffers is None or self.batchBuffers.frames < count or self.batchBuffers.res != (width, height):
+            self.batchBuffers = FrameBuffers((width, height), count)
+        buffers = self.batchBuffers
+        prof = PROFILER if PROFILER.enabled else None
+        if prof: t = perf_counter()
+
+        tallFrames = np.ascontiguousarray(frames).reshape(count * height, width, 3)
+        tallShape = (count * height, width)
+
+        # Get motion masks - each frame against the one above it in the stack
+        diffFrames = buffers.get('diff', tallFrames.shape)
+        if prevFrame is None:
+            diffFrames[:height] = 0
+        else:
+            cv2.absdiff(tallFrames[:height], prevFrame, dst=diffFrames[:height])
+        if count > 1:
+            cv2.absdiff(tallFrames[height:], tallFrames[:-height], dst=diffFrames[height:])
+        grayDiffFrames = cv2.cvtColor(diffFrames, cv2.COLOR_BGR2GRAY, dst=buffers.get('gray', tallShape))
+        changed = grayDiffFrames.reshape(count, -1).any(axis=1)
+        ret, motionMasks = cv2.threshold(grayDiffFrames, self.motionModel.THRESHOLD, 255, cv2.THRESH_BINARY,
+                                         dst=buffers.get('motion', tallShape))
+        if prof: t = prof.lap('motion', t)
+
+        # Get color masks
+        colorMasks = self.COLORS.mask(tallFrames, 'ball', dst=buffers.get('color', tallShape),
+                                      words=buffers.get('colorWords', tallShape),
+                                      index=buffers.get('colorIndex', tallShape))
+        if prof: t = prof.lap('color', t)
+
+        # Combine masks
+        masks = cv2.bitwise_and(motionMasks, colorMasks, dst=buffers.get('mask', tallShape))
+        masks = masks.reshape(count, height, width)
 
+        # Morphological operation
+        morphMasks = buffers.get('morph', (count, height, width))
+        for mask, morphMask in zip(masks, morphMasks):
+            cv2.morphologyEx(mask, cv2.MORPH_DILATE, self.DILATE_KERNEL, dst=morphMask)
+            cv2.morphologyEx(morphMask, cv2.MORPH_OPEN, self.OPEN_KERNEL, dst=morphMask)
+        if prof: prof.lap('morphology', t)
+
+        return morphMasks, changed
+
+    def _idleSkip(self, frameShape: tuple) -> bool:
+        """
+        Whether an idle frame is taken as not having the ball without searching it. Frames where something moved
+        near the table - below a table end buffer above the lowest net top - are searched, and so is every
+        IDLE_INTERVAL-th frame in case the ball got there unseen.
+        """
+        self.idleFrames += 1
+        top = max(self.geometry.netTop - self.geometry.tableEndBuffer, 0)
+        if self.idleFrames % self.IDLE_INTERVAL == 0 or self.changes.moved(top, frameShape[0]):
+            return False
+        self._trackCenter(None)
         return True
 
+    def _isDuplicateFrame(self, prevFrame, currentFrame) -> bool:
+        diffFrame = cv2.absdiff(currentFrame, prevFrame, dst=self.buffers.get('diff', currentFrame.shape))
+        grayDiffFrame = cv2.cvtColor(diffFrame, cv2.COLOR_BGR2GRAY, dst=self.buffers.get('gray', currentFrame.shape[:2]))
+        return cv2.countNonZero(grayDiffFrame) == 0
+
+    def _cropNetSide(self, mask, maskX: int) -> None:
+        """
+        Crop the mask to exclude moving players on the other side of the table.
+        This forces the ball to only cross sides through the central view buffer.
+        maskX is the frame column of the first column in the mask, at the search level.
+        """
+        scale = self.pyramidScale
+        if self.netSide == LEFT:
+            mask[:, max((self.netX + self.geometry.netViewBuffer) // scale - maskX, 0):] = 0
+        elif self.netSide == RIGHT:
+            mask[:, :max((self.netX - self.geometry.netViewBuffer) // scale - maskX, 0)] = 0
+
     def updateProcessedData(self, output: bool=False) -> None:
+        prof = PROFILER if PROFILER.enabled else None
+        if prof: t = perf_counter()
+
         # Net Side
         if self.pos is None:
             newNetSide = self.netSide
@@ -196,16 +666,21 @@ class Ball:
         self.netSide = newNetSide
 
         # Detect recent bounce or paddle hit
+        # The windows are a few points, so they are scanned as lists
         if len(self.motionPoints) > 2:
-            last3points = list(self.motionPoints)[-3:]
-            self.bounceSide = self._detectTableBounce(last3points, self.netX)
+            lastPoints = self.motionPoints.last(5).tolist()
+            last3points = lastPoints[-3:]
+            last3disps = self._getDisplacements(last3points)
+            self.bounceSide = self._detectTableBounce(last3points, self.netX, last3disps)
             self.timeSinceBounce = -1
-            self.hitDirection = self._detectPaddleHit(last3points)
+            self.hitDirection = self._detectPaddleHit(last3points, last3disps)
+
+            # Detect net hit
+            if len(lastPoints) > 4:
+                self.hasHitNet = self._hasHitNet(lastPoints, self.netX, self.geometry)
         self.timeSinceBounce += 1
 
-        # Detect net hit
-        if len(self.motionPoints) > 4:
-            self.hasHitNet = self._hasHitNet(list(self.motionPoints)[-5:], self.netX)
+        if prof: prof.lap('processing', t)
 
         # Display data
         if output:
@@ -213,129 +688,195 @@ class Ball:
               (display(newNetSide), self.framesOnSide,
                display(self.bounceSide), display(self.hitDirection), str(self.hasHitNet)))
 
+    def __getstate__(self):
+        # The frame buffers are a per-process workspace, don't ship them between processes
+        state = {name: getattr(self, name) for name in self.__slots__}
+        for name in self.WORKSPACE:
+            state[name] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def newRecords(self, count: int) -> np.ndarray:
+        """Preallocated records for count snapshots of this Ball."""
+        history = PointHistory.recordDtype(self.HISTORY_CAPACITY)
+        return np.zeros(count, dtype=[('pos', '<i4', 2), ('lastPos', '<i4', 2), ('lastDisp', '<i4', 2)] +
+                                     [(name, 'i1') for name in self.SIDE_FIELDS] +
+                                     [('hasHitNet', '?'), ('framesOnSide', '<i4'), ('timeSinceBounce', '<i4'),
+                                      ('idleFrames', '<i4'), ('framesProcessed', '<i4'), ('points', history),
+                                      ('motionPoints', history), ('predictor', self.predictor.RECORD_DTYPE)])
+
+    def snapshot(self, records: np.ndarray, index: int) -> None:
+        """
+        Writes the Ball's tracking state into records[index] of newRecords - the same few fields and fixed size
+        histories however long the Ball has run. The motion model's learned background isn't part of it.
+        """
+        record = records[index]
+        record['pos'] = encodePoint(self.pos)
+        record['lastPos'] = encodePoint(self.lastPos)
+        record['lastDisp'] = encodePoint(self.lastDisp)
+        for name in self.SIDE_FIELDS:
+            side = getattr(self, name)
+            record[name] = -1 if side is None else side
+        record['hasHitNet'] = self.hasHitNet
+        record['framesOnSide'] = self.framesOnSide
+        record['timeSinceBounce'] = self.timeSinceBounce
+        record['idleFrames'] = self.idleFrames
+        record['framesProcessed'] = self.framesProcessed
+        self.points.snapshot(record['points'])
+        self.motionPoints.snapshot(record['motionPoints'])
+        self.predictor.snapshot(record['predictor'])
+
+    def restore(self, records: np.ndarray, index: int) -> None:
+        """Puts the Ball back in the tracking state snapshot wrote into records[index]."""
+        record = records[index]
+        self.pos = decodePoint(record['pos'])
+        self.lastPos = decodePoint(record['lastPos'])
+        self.lastDisp = decodePoint(record['lastDisp'])
+        for name in self.SIDE_FIELDS:
+            side = int(record[name])
+            setattr(self, name, None if side == -1 else side)
+        self.hasHitNet = bool(record['hasHitNet'])
+        self.framesOnSide = int(record['framesOnSide'])
+        self.timeSinceBounce = int(record['timeSinceBounce'])
+        self.idleFrames = int(record['idleFrames'])
+        self.framesProcessed = int(record['framesProcessed'])
+        self.points.restore(record['points'])
+        self.motionPoints.restore(record['motionPoints'])
+        self.predictor.restore(record['predictor'])
+
+    def trackingState(self) -> tuple:
+        """
+        Everything that affects how the next frame is processed - equal states track identically from here on.
+        framesOnSide comes last since nothing else depends on it, and the detectors only read N_POINTS of history.
+        """
+        return (self.pos, self.lastPos, self.lastDisp, self.netSide, self.motionPoints.toTuples(self.N_POINTS),
+                self.bounceSide, self.timeSinceBounce, self.hitDirection, self.ballCrossedTo, self.currentDir,
+                self.hasHitNet, self.predictor.state(), self.framesOnSide)
+
+    def observe(self) -> BallObservation:
+        """Freeze the processed data of the most recent frame so it can be handed to another thread."""
+        return BallObservation(self.pos, self.lastPos, self.netSide, self.bounceSide, self.hitDirection,
+                               self.ballCrossedTo, self.framesOnSide, self.hasHitNet, self.currentDir,
+                               self.timeSinceBounce)
+
     @staticmethod
-    def _identifyBallCenter(mask, lastPos: tuple, output: bool=False) -> Union[Tuple[int, int], None]:
-        """Process the contours of a mask and extract the most likely center of the ball."""
-
-        # Find contours in combined mask
-        cnts = cv2.findContours(mask.copy(), cv2.RETR_EXTERNAL,
-                                cv2.CHAIN_APPROX_SIMPLE)
-        cnts = imutils.grab_contours(cnts)
-
-        # Iterate through contours and return the center of the one that is the most likely candidate
-        center = None
-        cntsSortedByArea = sorted(cnts, key=cv2.contourArea, reverse=True)
-        for contour in cntsSortedByArea:  # Run through the biggest contours
-            ((x, y), radius) = cv2.minEnclosingCircle(contour)
-            potentialPos = (int(x), int(y))
-            # infoFrame = cv2.circle(infoFrame, potentialPos, int(radius), (0, 255, 255), 2)
-            if radius > 1:
-                if radius > 20.0:
-                    if output: print('Contour is definitely big enough to be the ball (radius = %f)' % radius)
-                    center = (int(x), int(y))
-                    break
-                if lastPos is not None:
-                    deltaDistance = Ball._distance(Ball._displacement(potentialPos, lastPos))
-                    if output: print('Change in difference: %f' % deltaDistance)
-                    if deltaDistance < 120.0:
-                        if output: print('Within acceptable boundaries')
-                        center = potentialPos
-                        break
-                    else:
-                        if output: print('Too far of a jump')
-                else:
-                    center = potentialPos
-                    break
-
-        return center
+    def _identifyBallCenter(mask, lastPos: tuple, output: bool=False, offset: Tuple[int, int]=(0, 0),
+                            prediction: Optional[Prediction]=None, scale: float=1.0,
+                            labels: Optional[np.ndarray]=None) -> Union[Tuple[int, int], None]:
+        """
+        Extract the most likely center of the ball from the blobs of a mask.
+        The offset is the frame position of the mask's top left corner when the mask is a window of the frame.
+        With a prediction that knows its uncertainty, the blob closest to it by Mahalanobis distance wins.
+        scale is the mask's pixels per pixel at CAP_RESOLUTION, which the size limits were tuned at.
+        """
+        candidates = Ball._ballCandidates(mask, lastPos, offset, prediction, scale, labels)
+        if not candidates:
+            return None
+        best = candidates[0]
+        if output: print('Ball candidate at %s (radius = %f, score = %f) out of %d'
+                         % (str(best.center), best.radius, best.score, len(candidates)))
+        return best.center
+
+    @staticmethod
+    def _ballCandidates(mask, lastPos: tuple, offset: Tuple[int, int]=(0, 0), prediction: Optional[Prediction]=None,
+                        scale: float=1.0, labels: Optional[np.ndarray]=None) -> List[Candidate]:
+        """The best scored blobs of a mask that could be the ball, best first."""
+        prof = PROFILER if PROFILER.enabled else None
+        if prof: t = perf_counter()
+        candidates = findCandidates(mask, lastPos, offset, prediction, scale, labels=labels)
+        if prof: prof.lap('identify', t)
+        return candidates
+
+    # The detectors below take motion points oldest first, and optionally their displacements when the caller
+    # already has them. A list of (x, y) points is scanned in plain Python, which is fastest for the few points
+    # updateProcessedData looks at - NumPy's per call overhead outweighs the work there. An (n, 2) array is
+    # scanned with array operations instead, which pays off from about 30 points on.
 
     @staticmethod
-    def _getDisplacements(motionPts: list) -> list:
+    def _getDisplacements(motionPts: Union[list, np.ndarray]) -> Union[list, np.ndarray]:
         # Compute displacements between motion points
-        displacementPts = []
-        for i in range(len(motionPts) - 1):
-            dispPt = (motionPts[i + 1][0] - motionPts[i][0], motionPts[i + 1][1] - motionPts[i][1])
-            displacementPts.append(dispPt)
-        return displacementPts
+        if isinstance(motionPts, np.ndarray):
+            return motionPts[1:] - motionPts[:-1]
+        return [(x1 - x0, y1 - y0) for (x0, y0), (x1, y1) in zip(motionPts, motionPts[1:])]
 
     @staticmethod
-    def _hasChangedDirection(motionPts: list) -> tuple:
+    def _hasChangedDirection(motionPts: Union[list, np.ndarray], dispPts: Union[list, np.ndarray, None]=None) -> tuple:
         """Looks for changes in direction across many motion points and for both x and y axes."""
-        dispPts = Ball._getDisplacements(motionPts)
-        xDir = yDir = None
+        if dispPts is None:
+            dispPts = Ball._getDisplacements(motionPts)
+        if len(dispPts) < 2:
+            return False, False
+        if isinstance(dispPts, np.ndarray):
+            # Moving right / down, compared against the first displacement
+            dirs = dispPts > 0
+            changes = (dirs[1:] != dirs[0]).any(axis=0)
+            return bool(changes[HORIZONTAL]), bool(changes[VERTICAL])
+        xDir, yDir = dispPts[0][0] > 0, dispPts[0][1] > 0
         xChange = yChange = False
-        for dispPt in dispPts:
-            # Compute differences
-            xDirNow = RIGHT if dispPt[0] > 0 else LEFT
-            yDirNow = DOWN if dispPt[1] > 0 else UP
-            # Look for x changes
-            if xDir is None:
-                xDir = xDirNow
-            elif xDirNow != xDir:
-                xChange = True
-            # Look for y changes
-            if yDir is None:
-                yDir = yDirNow
-            elif yDirNow != yDir:
-                yChange = True
+        for dx, dy in dispPts[1:]:
+            xChange = xChange or (dx > 0) != xDir
+            yChange = yChange or (dy > 0) != yDir
         return xChange, yChange
 
     @staticmethod
-    def _hasChangedAxisDirectionAt(motionPts: list, axis: int) -> tuple or None:
+    def _hasChangedAxisDirectionAt(motionPts: Union[list, np.ndarray], axis: int,
+                                   dispPts: Union[list, np.ndarray, None]=None) -> Optional[Sequence[int]]:
         """
         Looks for changes in direction across many motion points and for a certain axes.
         Returns None if there is no change, else returns the point where the ball changed direction on that axis
         """
-        dispPts = Ball._getDisplacements(motionPts)
-        lastDir = None
-        dirChange = False
-        for i, dispPt in enumerate(dispPts):
-            # Compute difference - 0 and 1 are arbitrary
-            currentDir = 0 if dispPt[axis] > 0 else 1
-            # Look for changes
-            if lastDir is None:
-                lastDir = currentDir
-            elif currentDir != lastDir:
+        if dispPts is None:
+            dispPts = Ball._getDisplacements(motionPts)
+        if len(dispPts) < 2:
+            return None
+        if isinstance(dispPts, np.ndarray):
+            dirs = dispPts[:, axis] > 0
+            changes = dirs[1:] != dirs[0]
+            if not changes.any():
+                return None
+            return motionPts[1 + changes.argmax()]
+        firstDir = dispPts[0][axis] > 0
+        for i in range(1, len(dispPts)):
+            if (dispPts[i][axis] > 0) != firstDir:
                 return motionPts[i]
         return None
 
     @staticmethod
-    def _detectTableBounce(motionPts: list, netX) -> int or None:
+    def _detectTableBounce(motionPts: Union[list, np.ndarray], netX,
+                           dispPts: Union[list, np.ndarray, None]=None) -> int or None:
         if len(motionPts) != 3:
             raise RuntimeError('To detect a bounce, you need 3 motion points.')
+        if dispPts is None:
+            dispPts = Ball._getDisplacements(motionPts)
 
         # If the ball changes horizontal velocity, it has not bounced off of the table
-        if Ball._hasChangedDirection(motionPts)[0]:
+        if Ball._hasChangedDirection(motionPts, dispPts)[0]:
             return None
 
-        dispPts = Ball._getDisplacements(motionPts)
-        lastYangle = None
-        for disp in dispPts:
-            if disp[0] == 0:
-                disp = (1, disp[1])
-
-            if lastYangle is None:
-                lastYangle = disp[1] / abs(disp[0])
-            # If downward trajectory is less than in the previous displacement,
-            # then the ball must have bounced
-            if 0 < lastYangle > disp[1] / abs(disp[0]):
-                # Bounce detected, now we need to compute which side it was on
-                if motionPts[1][0] > netX:
-                    return RIGHT
-                else:
-                    return LEFT
+        # Vertical movement per horizontal pixel, counting no horizontal movement as one pixel
+        firstYangle = dispPts[0][1] / max(abs(dispPts[0][0]), 1)
+        # If downward trajectory is less than in the first displacement, then the ball must have bounced
+        if 0 < firstYangle and any(dy / max(abs(dx), 1) < firstYangle for dx, dy in dispPts[1:]):
+            # Bounce detected, now we need to compute which side it was on
+            return RIGHT if motionPts[1][0] > netX else LEFT
 
         return None
 
     @staticmethod
-    def _detectPaddleHit(motionPts: list) -> int or None:
+    def _detectPaddleHit(motionPts: Union[list, np.ndarray],
+                         dispPts: Union[list, np.ndarray, None]=None) -> int or None:
         if len(motionPts) != 3:
             raise RuntimeError('Need 3 motion points to detect a hit.')
+        if dispPts is None:
+            dispPts = Ball._getDisplacements(motionPts)
 
         # Check for horizontal direction change
-        if Ball._hasChangedDirection(motionPts)[0]:
+        if Ball._hasChangedDirection(motionPts, dispPts)[0]:
             # Figure out what direction the hit was towards
-            lastDisplacement = motionPts[-1][0] - motionPts[-2][0]
+            lastDisplacement = dispPts[-1][0]
             if lastDisplacement > 0:
                 return RIGHT
             else:
@@ -344,43 +885,44 @@ class Ball:
             return None
 
     @staticmethod
-    def _hasCrossedDistance(motionPts: list, xLeft: int, xRight: int):
-        # This can be very much optimized
-        if Ball._hasCrossedLine(motionPts, xLeft) and Ball._hasCrossedLine(motionPts, xRight):
-            return True
+    def _crossedLines(motionPts: Union[list, np.ndarray], xLeft: int, xRight: int) -> Tuple[bool, bool]:
+        """Whether the points are on both sides of each line, from a single pass over the points."""
+        if isinstance(motionPts, np.ndarray):
+            xs = motionPts[:, 0]
+            xMin, xMax = xs.min(), xs.max()
         else:
-            return False
+            xMin = xMax = motionPts[0][0]
+            for x, _ in motionPts:
+                if x < xMin:
+                    xMin = x
+                elif x > xMax:
+                    xMax = x
+        return bool(xMin < xLeft < xMax), bool(xMin < xRight < xMax)
 
     @staticmethod
-    def _hasCrossedLine(motionPts: list, line: int):
-        before = after = False
-        for pt in motionPts:
-            if pt[0] > line:
-                after = True
-            if pt[0] < line:
-                before = True
-        if before and after:
-            return True
-        else:
-            return False
+    def _hasCrossedDistance(motionPts: Union[list, np.ndarray], xLeft: int, xRight: int) -> bool:
+        crossedLeft, crossedRight = Ball._crossedLines(motionPts, xLeft, xRight)
+        return crossedLeft and crossedRight
 
     @staticmethod
-    def _hasEnteredNotCrossed(motionPts: list, xLeft: int, xRight: int):
-        # This can be very much optimized - cross one line but not the other
-        if Ball._hasCrossedLine(motionPts, xLeft) ^ Ball._hasCrossedLine(motionPts, xRight):
-            return True
-        else:
-            return False
+    def _hasCrossedLine(motionPts: Union[list, np.ndarray], line: int) -> bool:
+        return Ball._crossedLines(motionPts, line, line)[0]
+
+    @staticmethod
+    def _hasEnteredNotCrossed(motionPts: Union[list, np.ndarray], xLeft: int, xRight: int) -> bool:
+        # Cross one line but not the other
+        crossedLeft, crossedRight = Ball._crossedLines(motionPts, xLeft, xRight)
+        return crossedLeft != crossedRight
 
     @staticmethod
-    def _hasHitNet(motionPts: list, netX: int) -> bool:
+    def _hasHitNet(motionPts: Union[list, np.ndarray], netX: int, geometry: SceneGeometry=DEFAULT_GEOMETRY) -> bool:
         """Requires about 5 motion points for an accurate response."""
 
         # Need to change horizontal direction
 
         # Changing horizontal direction near the net is a requirement for hitting the net
-        leftSide = netX - NET_VIEW_BUFFER
-        rightSide = netX + NET_VIEW_BUFFER
+        leftSide = netX - geometry.netViewBuffer
+        rightSide = netX + geometry.netViewBuffer
         point = Ball._hasChangedAxisDirectionAt(motionPts, HORIZONTAL)
         # If no direction change at all
         if point is None:
@@ -389,23 +931,23 @@ class Ball:
         if not (leftSide < point[0] < rightSide):
             return False
 
+        crossedLeft, crossedRight = Ball._crossedLines(motionPts, netX - geometry.netHitBuffer,
+                                                       netX + geometry.netHitBuffer)
         # Crossing the net hit boundary disqualifies the motion as a net hit
-        if Ball._hasCrossedDistance(motionPts, netX - NET_HIT_BUFFER, netX + NET_HIT_BUFFER):
+        if crossedLeft and crossedRight:
             print('HN: Has crossed distance')
             return False
 
         # Must enter the boundary
-        if not Ball._hasEnteredNotCrossed(motionPts, netX - NET_HIT_BUFFER, netX + NET_HIT_BUFFER):
+        if crossedLeft == crossedRight:
             # print('HN: Has not entered boundary')
             return False
 
         # A point must be below a certain height - must be under the net's height
-        NET_TOP = CAP_RESOLUTION[1] - (CAP_RESOLUTION[1] // 3)
-        for pt in motionPts:
-            if pt[1] > NET_TOP:
-                return True
-        # print('HN: Too tall')
-        return False
+        # print('HN: Too tall') otherwise
+        if isinstance(motionPts, np.ndarray):
+            return bool((motionPts[:, 1] > geometry.netTop).any())
+        return any(y > geometry.netTop for _, y in motionPts)
 
     @staticmethod
     def _distance(displacementPt) -> float:
@@ -0,0 +1,232 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+import cv2
+import numpy as np
+from Setup import GameViewSource, SceneGeometry, display
+from Ball import Ball, BallObservation, FrameBuffers, pyramidLevelsFor
+from Game import GameState
+from Events import ConsoleSink, EventStream
+from Hypotheses import HypothesisTracker
+from Trajectory import saveTrajectory, toTrajectory
+
+# A chunk's observations: (frame index, ball observation) for every frame the vision stage processed
+Observations = List[Tuple[int, BallObservation]]
+
+# Frames each chunk tracks before its first frame so the Ball has settled by the time it matters
+WARMUP_FRAMES = 60
+
+
+def splitChunks(frameCount: int, chunkFrames: int, keyframeInterval: int=0) -> List[Tuple[int, int]]:
+    """
+    Splits [0, frameCount) into (start, end) chunks.
+    OpenCV does not tell us where the keyframes are, so chunk starts are rounded to multiples of the
+    encoder's keyframe interval when it is known - seeking to a keyframe avoids decoding a partial GOP.
+    """
+    if keyframeInterval > 0:
+        chunkFrames = max(keyframeInterval, keyframeInterval * round(chunkFrames / keyframeInterval))
+    chunkFrames = max(chunkFrames, 1)
+    return [(start, min(start + chunkFrames, frameCount)) for start in range(0, frameCount, chunkFrames)]
+
+
+def _trackFrames(stream: cv2.VideoCapture, ball: Ball, prevFrame: Optional[np.ndarray], first: int, end: int,
+                 recordFrom: int, batchFrames: int=0) -> Tuple[Observations, Optional[tuple]]:
+    """Runs the vision stage over frames [first, end) read from the stream's current position."""
+    if batchFrames > 1:
+        return _trackFrameBatches(stream, ball, prevFrame, first, end, recordFrom, batchFrames)
+    observations = []
+    startState = None
+    for frameIndex in range(first, end):
+        if frameIndex == recordFrom:
+            startState = ball.trackingState()
+        ok, frame = stream.read()
+        if not ok:
+            break
+        if ball.updatePosFromFrame(prevFrame, frame, showProcessedFrame=False, showMaskFrame=False):
+            ball.updateProcessedData(output=False)
+            if frameIndex >= recordFrom:
+                observations.append((frameIndex, ball.observe()))
+        prevFrame = frame
+    return observations, startState
+
+
+def _readFrames(stream: cv2.VideoCapture, stack: np.ndarray, count: int) -> int:
+    """Decodes up to count frames into the stack, returns how many were read."""
+    for i in range(count):
+        ok, frame = stream.read(stack[i])
+        if not ok:
+            return i
+        if not np.shares_memory(frame, stack[i]):
+            stack[i] = frame
+    return count
+
+
+def _trackFrameBatches(stream: cv2.VideoCapture, ball: Ball, prevFrame: Optional[np.ndarray], first: int, end: int,
+                       recordFrom: int, batchFrames: int) -> Tuple[Observations, Optional[tuple]]:
+    """_trackFrames through Ball.processFrames, batchFrames frames at a time."""
+    res = (int(stream.get(cv2.CAP_PROP_FRAME_WIDTH)), int(stream.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    # Two stacks take turns, so the last frame of a batch is still there as the previous frame of the next one
+    stacks = [np.empty((batchFrames, res[1], res[0], 3), dtype=np.uint8) for _ in range(2)]
+    observations = []
+    startState = None
+    frameIndex = first
+    while frameIndex < end:
+        if frameIndex == recordFrom:
+            startState = ball.trackingState()
+        # Batches end at recordFrom so the Ball's state can be taken there
+        count = min(batchFrames, end - frameIndex)
+        if frameIndex < recordFrom:
+            count = min(count, recordFrom - frameIndex)
+        stack = stacks[0]
+        read = _readFrames(stream, stack, count)
+        if read == 0:
+            break
+        for i, ballObservation in enumerate(ball.processFrames(prevFrame, stack[:read])):
+            if ballObservation is not None and frameIndex + i >= recordFrom:
+                observations.append((frameIndex + i, ballObservation))
+        prevFrame = stack[read - 1]
+        stacks.reverse()
+        frameIndex += read
+        if read < count:
+            break
+    return observations, startState
+
+
+def _visionChunk(path: str, netX: int, servingSide: int, start: int, end: int, warmup: int,
+                 batchFrames: int=0, pyramidLevels: Optional[int]=None) -> Tuple[Optional[tuple], Observations, Ball]:
+    """
+    Pool worker - tracks a chunk of the recording starting from a fresh Ball a few frames early.
+    The Ball starts on the serving side, as the live Ball is put there once the game knows who serves.
+    """
+    stream = cv2.VideoCapture(path)
+    first = max(start - max(warmup, 1), 0)
+    if first:
+        stream.set(cv2.CAP_PROP_POS_FRAMES, first)
+    res = (int(stream.get(cv2.CAP_PROP_FRAME_WIDTH)), int(stream.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    if pyramidLevels is None:
+        pyramidLevels = pyramidLevelsFor(res)
+    ball = Ball(netX, servingSide=servingSide, buffers=FrameBuffers(res), geometry=SceneGeometry(res),
+                pyramidLevels=pyramidLevels)
+    observations, startState = _trackFrames(stream, ball, None, first, end, start, batchFrames)
+    stream.release()
+    return startState, observations, ball
+
+
+def _rerunChunk(path: str, ball: Ball, start: int, end: int, batchFrames: int=0) -> Tuple[Observations, Ball]:
+    """Tracks a chunk sequentially, continuing from the Ball the previous chunk ended with."""
+    stream = cv2.VideoCapture(path)
+    stream.set(cv2.CAP_PROP_POS_FRAMES, start - 1)
+    prevFrame = stream.read()[1]
+    observations, _ = _trackFrames(stream, ball, prevFrame, start, end, start, batchFrames)
+    stream.release()
+    return observations, ball
+
+
+def _shiftFramesOnSide(observations: Observations, endBall: Ball, offset: int) -> None:
+    """Adds the frames a chunk missed to framesOnSide up to the first time the ball crosses the net."""
+    for i, (frameIndex, ballObservation) in enumerate(observations):
+        if ballObservation.ballCrossedTo is not None:
+            return
+        observations[i] = (frameIndex, ballObservation._replace(framesOnSide=ballObservation.framesOnSide + offset))
+    endBall.framesOnSide += offset
+
+
+def trackRecording(path: str, netX: int, servingSide: int, workers: Optional[int]=None, chunkSeconds: float=30.0,
+                   keyframeInterval: int=0, warmup: int=WARMUP_FRAMES, batchFrames: int=0,
+                   pyramidLevels: Optional[int]=None) -> Observations:
+    """
+    Runs the Ball vision stage over a whole recording in a process pool.
+    Each chunk starts tracking from scratch, so wherever a chunk's Ball did not settle into the state the
+    previous chunk ended with, the chunk is tracked again from that state. The result is exactly what a
+    single sequential pass would have produced.
+    With batchFrames > 1 the workers use Ball.processFrames on that many frames at a time. It computes full
+    frame masks, so it only pays off over the windowed per-frame search when the ball is rarely tracked or
+    OpenCV has cores to spare. pyramidLevels defaults to searching frames downscaled to about 640 wide.
+    """
+    stream = cv2.VideoCapture(path)
+    frameCount = int(stream.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = stream.get(cv2.CAP_PROP_FPS) or 30
+    stream.release()
+    chunks = splitChunks(frameCount, int(chunkSeconds * fps), keyframeInterval)
+
+    observations = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(_visionChunk, *zip(*[(path, netX, servingSide, start, end, warmup, batchFrames,
+                                                 pyramidLevels) for start, end in chunks]))
+        lastBall = None
+        for (start, end), (startState, chunkObservations, endBall) in zip(chunks, results):
+            if lastBall is not None and lastBall.trackingState() != startState:
+                expectedState = lastBall.trackingState()
+                # framesOnSide only counts up until the ball crosses the net, so it can be corrected afterwards
+                if startState is not None and expectedState[:-1] == startState[:-1]:
+                    _shiftFramesOnSide(chunkObservations, endBall, expectedState[-1] - startState[-1])
+                else:
+                    print('\tChunk at frame %d did not settle during warm-up, tracking it again' % start)
+                    chunkObservations, endBall = _rerunChunk(path, lastBall, start, end, batchFrames)
+            observations.extend(chunkObservations)
+            lastBall = endBall
+    return observations
+
+
+class _ReplayView(GameViewSource):
+    """A view of the recording that is only decoded for the frames GameState looks for a serve signal in."""
+
+    def __init__(self, path: str, netX: int):
+        stream = cv2.VideoCapture(path)
+        res = (int(stream.get(cv2.CAP_PROP_FRAME_WIDTH)), int(stream.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        super().__init__(stream, True, res, netX)
+        self.position = 0  # The frame the replay has reached
+        self.streamPosition = 0
+
+    def read(self) -> np.ndarray:
+        if self.streamPosition != self.position:
+            self.stream.set(cv2.CAP_PROP_POS_FRAMES, self.position)
+        frame = self.stream.read()[1]
+        self.position += 1
+        self.streamPosition = self.position
+        return frame
+
+
+def replayObservations(path: str, observations: Observations, netX: int, servingSide: int,
+                       hypotheses: bool=False) -> GameState:
+    """
+    Feeds the observations through GameState in order, printing the same events as a live run.
+    With hypotheses, ambiguous bounces are resolved by a HypothesisTracker instead of paddle signals.
+    """
+    view = _ReplayView(path, netX)
+    fps = view.fps or 30
+    events = EventStream([ConsoleSink()], clock=lambda: view.position / fps)  # Stamped with video time
+    game = GameState(view, headless=True, events=events)
+    game.begin(netX, servingSide)
+    if hypotheses:
+        game = HypothesisTracker(game)
+
+    for frameIndex, ballObservation in observations:
+        # While waiting for a serve signal the live scorer looks for it in the frames instead
+        if game.state == GameState.STATE_AWAITING_SIGNAL:
+            view.position = frameIndex
+            game.updateSignal(view.read())
+        else:
+            view.position = frameIndex + 1
+            game.updateState(ballObservation, output=False)
+
+    events.close()
+    view.stream.release()
+    return game
+
+
+def scoreFile(path: str, netX: int, servingSide: int, workers: Optional[int]=None, chunkSeconds: float=30.0,
+              keyframeInterval: int=0, trajectoryPath: Optional[str]=None, batchFrames: int=0,
+              pyramidLevels: Optional[int]=None, hypotheses: bool=False) -> GameState:
+    """Headless scoring of a recorded match, optionally saving the ball trajectory for later replays."""
+    startTime = time.time()
+    observations = trackRecording(path, netX, servingSide, workers, chunkSeconds, keyframeInterval,
+                                  batchFrames=batchFrames, pyramidLevels=pyramidLevels)
+    print('Tracked %d frames in %.1fs' % (len(observations), time.time() - startTime))
+    if trajectoryPath:
+        saveTrajectory(trajectoryPath, toTrajectory(observations))
+
+    game = replayObservations(path, observations, netX, servingSide, hypotheses)
+    print('Final score: %s, %s serving, scored in %.1fs' %
+          (str(game.score), display(game.servingSide), time.time() - startTime))
+    return game
@@ -0,0 +1,269 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from typing import Callable, List, Optional
+import cv2
+import numpy as np
+from Setup import LEFT, RIGHT, PADDLE_COLORS, SceneGeometry, getDisplay
+from Ball import Ball, FrameBuffers
+from Game import GameState, LegacyGameState
+from Trajectory import TrajectoryReplay, assumeBounceWasIn, checkConformance, loadTrajectory
+from Motion import MOTION_MODELS
+from Synthetic import syntheticFrames
+
+
+def loadClip(path: str, limit: Optional[int]=None) -> List[np.ndarray]:
+    stream = cv2.VideoCapture(path)
+    frames = []
+    while limit is None or len(frames) < limit:
+        ok, frame = stream.read()
+        if not ok:
+            break
+        frames.append(frame)
+    stream.release()
+    return frames
+
+
+class StageTimings:
+    """Per-call latencies and allocations of one benchmarked stage."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = []
+        self.allocations = []
+
+    def summary(self) -> dict:
+        latencies = np.array(self.latencies)
+        return {
+            'calls': len(latencies),
+            'fps': float(len(latencies) / latencies.sum()) if len(latencies) else 0.0,
+            'p50Ms': float(np.percentile(latencies, 50) * 1000) if len(latencies) else 0.0,
+            'p99Ms': float(np.percentile(latencies, 99) * 1000) if len(latencies) else 0.0,
+            'allocKiBPerCall': float(np.mean(self.allocations) / 1024) if self.allocations else 0.0,
+        }
+
+
+def measure(name: str, calls: List[Callable[[], object]], allocationCalls: int=200) -> StageTimings:
+    """
+    Times every call, then replays the first few under tracemalloc to count the bytes each call allocates.
+    Allocation tracking is done separately because it slows the calls down several times over.
+    """
+    timings = StageTimings(name)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for call in calls:
+            start = time.perf_counter()
+            call()
+            timings.latencies.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        for call in calls[:allocationCalls]:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            call()
+            timings.allocations.append(tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+    return timings
+
+
+def benchmarkVision(frames: List[np.ndarray], netX: int, name: str, pyramidLevels: int=0,
+                    motion: str='difference') -> List[StageTimings]:
+    """Times Ball.updatePosFromFrame + updateProcessedData and _identifyBallCenter on the same frames."""
+    res = (frames[0].shape[1], frames[0].shape[0])
+    if pyramidLevels:
+        name += '/pyramid%d' % pyramidLevels
+    if motion != 'difference':
+        name += '/' + motion
+
+    def newBall() -> Ball:
+        return Ball(netX, servingSide=LEFT, buffers=FrameBuffers(res), pyramidLevels=pyramidLevels,
+                    motionModel=MOTION_MODELS[motion]())
+
+    # Each pass needs a Ball that starts from scratch
+    def visionCalls() -> List[Callable[[], object]]:
+        ball = newBall()
+        calls = []
+        for prevFrame, frame in zip([None] + frames[:-1], frames):
+            def call(prevFrame=prevFrame, frame=frame):
+                if ball.updatePosFromFrame(prevFrame, frame, showProcessedFrame=False, showMaskFrame=False):
+                    ball.updateProcessedData()
+            calls.append(call)
+        return calls
+
+    Ball.COLORS.table  # Built on first use - before the timer, as the vision stage builds it before the first frame
+    vision = measure(name + '/vision', visionCalls())
+    allocations = measure(name + '/vision', visionCalls())
+    vision.allocations = allocations.allocations
+
+    # Ball identification on the full frame masks
+    ball = newBall()
+    masks = []
+    for prevFrame, frame in zip(frames[:-1], frames[1:]):
+        mask = ball._computeMask(prevFrame, frame)
+        if mask is not None:
+            masks.append(mask.copy())
+    labels = np.empty(masks[0].shape, dtype=np.int32) if masks else None
+    identify = measure(name + '/identify', [lambda mask=mask: Ball._identifyBallCenter(mask, None, labels=labels)
+                                            for mask in masks])
+    return [vision, identify]
+
+
+def benchmarkColor(frames: List[np.ndarray], name: str) -> List[StageTimings]:
+    """
+    Times the ball and paddle color masks through the lookup tables against cv2.cvtColor + cv2.inRange,
+    after checking that both give the same masks.
+    """
+    stages = []
+    for classifier, className in ((Ball.COLORS, 'ball'), (PADDLE_COLORS, 'paddle')):
+        mismatches = sum(classifier.mismatches(frame) for frame in frames[::max(len(frames) // 20, 1)])
+        if mismatches:
+            raise AssertionError('The %s lookup table differs from cv2.inRange on %d pixels' % (className, mismatches))
+        height, width = frames[0].shape[:2]
+        hsv = np.empty((height, width, 3), dtype=np.uint8)
+        mask, rangeMask = np.empty((height, width), dtype=np.uint8), np.empty((height, width), dtype=np.uint8)
+        words, index = np.empty((height, width), dtype=np.uint32), np.empty((height, width), dtype=np.intp)
+
+        def inRangeCall(frame):
+            cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst=hsv)
+            mask.fill(0)
+            for lower, higher in classifier.classes[className]:
+                cv2.bitwise_or(mask, cv2.inRange(hsv, lower, higher, dst=rangeMask), dst=mask)
+        stages.append(measure('%s/%s-inRange' % (name, className),
+                              [lambda frame=frame: inRangeCall(frame) for frame in frames]))
+        stages.append(measure('%s/%s-table' % (name, className),
+                              [lambda frame=frame: classifier.mask(frame, className, mask, words, index)
+                               for frame in frames]))
+    return stages
+
+
+def benchmarkState(frames: List[np.ndarray], netX: int, repeat: int=20, gameType: type=GameState,
+                   name: str='state') -> StageTimings:
+    """Times GameState.updateState on the observations the vision stage produced for the frames."""
+    res = (frames[0].shape[1], frames[0].shape[0])
+    ball = Ball(netX, servingSide=LEFT, geometry=SceneGeometry(res))
+    observations = []
+    for prevFrame, frame in zip([None] + frames[:-1], frames):
+        if ball.updatePosFromFrame(prevFrame, frame, showProcessedFrame=False, showMaskFrame=False):
+            ball.updateProcessedData()
+            observations.append(ball.observe())
+
+    game = gameType(None, headless=True, sideSignal=assumeBounceWasIn, geometry=SceneGeometry(res))
+    game.begin(netX, LEFT)
+    return measure(name, [lambda observation=observation: game.updateState(observation)
+                             for observation in observations * repeat])
+
+
+def benchmarkTrajectory(path: str, netX: int, servingSide: int=LEFT, repeat: int=5) -> List[StageTimings]:
+    """
+    Checks the state machine's rules against the legacy one on a recorded trajectory, then times both on it.
+    A recording has far more going on in the game than the synthetic frames do.
+    """
+    trajectory = loadTrajectory(path, mmap=False)
+    mismatch = checkConformance(trajectory, netX, servingSide)
+    if mismatch is not None:
+        print('%s: the state machine disagrees with the legacy one after frame %d' % (path, mismatch))
+    replay = TrajectoryReplay(trajectory, netX, servingSide)
+    stages = []
+    for gameType, suffix in ((GameState, 'state'), (LegacyGameState, 'state-legacy')):
+        game = replay.newGame(gameType)
+        stages.append(measure('%s/%s' % (os.path.basename(path), suffix),
+                              [lambda observation=observation: game.updateState(observation)
+                               for frameIndex, observation in replay.observations * repeat]))
+    return stages
+
+
+def benchmarkDisplay(calls: int=100) -> StageTimings:
+    """Times Setup.getDisplay over a game's worth of scores."""
+    scores = [([i % 12, (i // 2) % 12], (LEFT, RIGHT, None)[i % 3]) for i in range(calls)]
+    return measure('display', [lambda score=score, serving=serving: getDisplay(score, serving)
+                               for score, serving in scores], allocationCalls=20)
+
+
+def _gitCommit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def runBenchmarks(frameCount: int=600, res: tuple=(640, 480), noise: int=0, clips: List[str]=(),
+                  clipFrames: Optional[int]=None, netX: Optional[int]=None, pyramidLevels: int=0,
+                  motion: str='difference', trajectories: List[str]=(), trajectoryNetX: int=320) -> dict:
+    stages = []
+    synthetic = syntheticFrames(frameCount, res, noise)
+    syntheticNetX = res[0] // 2
+    stages += benchmarkVision(synthetic, syntheticNetX, 'synthetic')
+    if pyramidLevels:
+        stages += benchmarkVision(synthetic, syntheticNetX, 'synthetic', pyramidLevels)
+    if motion != 'difference':
+        stages += benchmarkVision(synthetic, syntheticNetX, 'synthetic', motion=motion)
+    stages += benchmarkColor(synthetic, 'synthetic')
+    stages.append(benchmarkState(synthetic, syntheticNetX))
+    stages.append(benchmarkState(synthetic, syntheticNetX, gameType=LegacyGameState, name='state-legacy'))
+    for path in trajectories:
+        stages += benchmarkTrajectory(path, trajectoryNetX)
+    stages.append(benchmarkDisplay())
+    for clip in clips:
+        frames = loadClip(clip, clipFrames)
+        if len(frames) < 2:
+            print('Skipping %s, could not read it' % clip)
+            continue
+        stages += benchmarkVision(frames, netX if netX is not None else frames[0].shape[1] // 2,
+                                  os.path.basename(clip))
+
+    return {
+        'commit': _gitCommit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'machine': platform.machine(),
+        'stages': {stage.name: stage.summary() for stage in stages},
+    }
+
+
+def printResults(results: dict, baseline: Optional[dict]=None):
+    print('%-28s %10s %9s %9s %12s' % ('Stage', 'FPS', 'p50 ms', 'p99 ms', 'KiB/call'))
+    for name, stage in results['stages'].items():
+        line = '%-28s %10.1f %9.3f %9.3f %12.1f' % (name, stage['fps'], stage['p50Ms'], stage['p99Ms'],
+                                                     stage['allocKiBPerCall'])
+        if baseline is not None and name in baseline['stages'] and baseline['stages'][name]['fps']:
+            change = stage['fps'] / baseline['stages'][name]['fps'] - 1
+            line += '   %+6.1f%% fps vs %s' % (100 * change, baseline.get('commit') or 'baseline')
+        print(line)
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Benchmark the vision, state machine and display hot paths")
+    ap.add_argument("-n", "--frames", default=600, type=int, help="Synthetic frames to generate")
+    ap.add_argument("-r", "--resolution", default="640x480", help="Synthetic frame resolution, WxH")
+    ap.add_argument("--noise", default=0, type=int, help="Amplitude of synthetic camera noise")
+    ap.add_argument("-c", "--clip", default=[], action='append', help="Sample video clip to benchmark as well")
+    ap.add_argument("--clipFrames", default=None, type=int, help="Only use this many frames of each clip")
+    ap.add_argument("--netX", default=None, type=int, help="Net position in the clips (default: centered)")
+    ap.add_argument("-o", "--output", default=None, help="Write the results to this JSON file")
+    ap.add_argument("--compare", default=None, help="JSON results of an earlier run to compare against")
+    ap.add_argument("--pyramid", default=0, type=int, help="Also time the vision stage with this many pyramid levels")
+    ap.add_argument("--motion", default='difference', choices=sorted(MOTION_MODELS),
+                    help="Also time the vision stage with this motion model")
+    ap.add_argument("-t", "--trajectory", default=[], action='append',
+                    help="Recorded ball trajectory (.npy) to check and time the state machine on")
+    ap.add_argument("--trajectoryNetX", default=320, type=int, help="Net position in the trajectories")
+    args = ap.parse_args()
+
+    resolution = tuple(int(v) for v in args.resolution.lower().split('x'))
+    results = runBenchmarks(args.frames, resolution, args.noise, args.clip, args.clipFrames, args.netX, args.pyramid,
+                            args.motion, args.trajectory, args.trajectoryNetX)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    printResults(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
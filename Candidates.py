@@ -0,0 +1,71 @@
+from collections import namedtuple
+from typing import List, Optional, Tuple
+import cv2
+import numpy as np
+from Prediction import Prediction
+
+# A blob of a motion mask that could be the ball, in the mask's frame coordinates.
+# Higher scores are better - the area, or minus the squared Mahalanobis distance to a prediction.
+Candidate = namedtuple('Candidate', ['center', 'radius', 'area', 'score'])
+
+# Size limits, in pixels at CAP_RESOLUTION - scaled like the rest of the scene geometry
+MIN_RADIUS = 1.0  # Anything smaller is noise
+BIG_RADIUS = 20.0  # Anything bigger is taken without checking how far it jumped
+MAX_JUMP = 120.0  # Furthest the ball moves from its last position without a prediction to go by
+MAX_ASPECT = 5.0  # Longest side over shortest side of a blob's bounding box - arms and edges are longer
+MAX_CANDIDATES = 4
+
+
+def findCandidates(mask: np.ndarray, lastPos: Optional[tuple]=None, offset: Tuple[int, int]=(0, 0),
+                   prediction: Optional[Prediction]=None, scale: float=1.0, k: int=MAX_CANDIDATES,
+                   labels: Optional[np.ndarray]=None) -> List[Candidate]:
+    """
+    The k best scored blobs of a mask, best first.
+    Blobs are the mask's 8-connected components, which are labelled in one pass over the mask however many
+    there are, then filtered and scored together as arrays - the time is bounded by the mask's size, not by how
+    noisy it is. A blob's radius is half its bounding box's longest side and its center the box's center, which
+    is what the enclosing circle of a round blob comes to.
+    With a prediction that knows its uncertainty, only blobs within its reach are kept and the closest by
+    Mahalanobis distance wins. Otherwise the biggest blob wins, as long as it is big or did not jump too far.
+    labels is an optional int32 buffer the shape of the mask.
+    """
+    # Only label the part of the mask with anything in it, which is usually a small part of it
+    left, top, width, height = cv2.boundingRect(mask)
+    if width == 0:
+        return []
+    # Grana's labelling works on 2x2 blocks and is over twice as slow on odd sizes, so round them up where possible
+    right, bottom = min((left + width + 1) & ~1, mask.shape[1]), min((top + height + 1) & ~1, mask.shape[0])
+    left, top = left & ~1, top & ~1
+    mask = mask[top:bottom, left:right]
+    if labels is not None:
+        labels = labels.reshape(-1)[:mask.size].reshape(mask.shape)
+    # Block based labelling (Grana's) is a few times faster than the default at one thread
+    count, labels, stats, centroids = cv2.connectedComponentsWithStatsWithAlgorithm(mask, 8, cv2.CV_32S,
+                                                                                    cv2.CCL_GRANA, labels=labels)
+    stats = stats[1:].astype(np.float64)  # Label 0 is the background
+    lefts, tops, widths, heights, areas = stats.T
+    longest = np.maximum(widths, heights)
+    radii = (longest - 1) / 2
+    xs = lefts + (widths - 1) / 2 + (offset[0] + left)
+    ys = tops + (heights - 1) / 2 + (offset[1] + top)
+    keep = (radii >= MIN_RADIUS * scale) & (longest <= MAX_ASPECT * np.minimum(widths, heights))
+
+    if prediction is not None and prediction.sigma is not None:
+        (px, py), (sigmaX, sigmaY), (reachX, reachY) = prediction
+        dx, dy = xs - px, ys - py
+        # Only blobs within the predicted reach - the same ellipse the search window was sized from
+        keep &= (dx / reachX) ** 2 + (dy / reachY) ** 2 <= 1
+        scores = -((dx / sigmaX) ** 2 + (dy / sigmaY) ** 2)
+    else:
+        if lastPos is not None:
+            jumps = np.hypot(xs.astype(int) - lastPos[0], ys.astype(int) - lastPos[1])
+            keep &= (radii > BIG_RADIUS * scale) | (jumps < MAX_JUMP * scale)
+        scores = areas
+
+    kept = np.flatnonzero(keep)
+    if len(kept) > k:
+        kept = kept[np.argpartition(-scores[kept], k - 1)[:k]]
+    if len(kept) > 1:
+        # Best first, and the first of equally scored blobs in scan order like a stable sort
+        kept = kept[np.lexsort((kept, -scores[kept]))]
+    return [Candidate((int(xs[i]), int(ys[i])), float(radii[i]), int(areas[i]), float(scores[i])) for i in kept]
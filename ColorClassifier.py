@@ -0,0 +1,91 @@
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+import cv2
+import numpy as np
+
+# Inclusive (lower, higher) HSV bounds, as cv2.inRange takes them
+HSVRange = Tuple[Sequence[float], Sequence[float]]
+
+
+class ColorClassifier:
+    """
+    Classifies BGR pixels by HSV color ranges with a single table lookup per pixel.
+    The table has an entry for every 24 bit BGR color, converted to HSV and checked against the ranges once when
+    it is first used (about a quarter of a second and 16 MB), so the lookup gives exactly what cv2.cvtColor and
+    cv2.inRange would without converting frames to HSV. A class may have several ranges and up to 8 classes
+    share a table - each class is a bit of the entries, or the whole 255 when there is only one class so a
+    lookup is already its mask.
+    """
+
+    TABLE_SIZE = 1 << 24
+
+    def __init__(self, classes: Dict[str, List[HSVRange]]):
+        if not 0 < len(classes) <= 8:
+            raise ValueError('A color classifier takes 1 to 8 classes, not %d.' % len(classes))
+        self.classes = {name: list(ranges) for name, ranges in classes.items()}
+        if len(classes) == 1:
+            self.values = {name: 255 for name in classes}
+        else:
+            self.values = {name: 1 << i for i, name in enumerate(classes)}
+        self._table = None
+        self._lock = threading.Lock()
+
+    @property
+    def table(self) -> np.ndarray:
+        if self._table is None:
+            with self._lock:
+                if self._table is None:
+                    self._table = self._buildTable()
+        return self._table
+
+    def _buildTable(self) -> np.ndarray:
+        # Every color laid out as one image, in the byte order classify indexes the table with
+        colors = np.arange(self.TABLE_SIZE, dtype=np.uint32).view(np.uint8).reshape(4096, 4096, 4)
+        hsv = cv2.cvtColor(np.ascontiguousarray(colors[:, :, :3]), cv2.COLOR_BGR2HSV)
+        table = np.zeros((4096, 4096), dtype=np.uint8)
+        for name, ranges in self.classes.items():
+            value = self.values[name]
+            for lower, higher in ranges:
+                table[cv2.inRange(hsv, lower, higher) > 0] |= value
+        return table.reshape(-1)
+
+    def classify(self, frame: np.ndarray, dst: Optional[np.ndarray]=None, words: Optional[np.ndarray]=None,
+                 index: Optional[np.ndarray]=None) -> np.ndarray:
+        """
+        The table entry of every pixel of a BGR frame (or a window of it).
+        dst, words and index are optional (height, width) uint8, uint32 and np.intp buffers for the result, the
+        pixels as words and their table indices - np.take would allocate the indices otherwise.
+        """
+        height, width = frame.shape[:2]
+        if words is None:
+            words = np.empty((height, width), dtype=np.uint32)
+        if index is None:
+            index = np.empty((height, width), dtype=np.intp)
+        # Each pixel as a little endian BGRA word, then without the alpha that is the color's table index
+        cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA, dst=words.view(np.uint8).reshape(height, width, 4))
+        # Masked in place and then widened - a ufunc casting into index would allocate a buffer for it every call
+        np.bitwise_and(words, self.TABLE_SIZE - 1, out=words)
+        np.copyto(index, words)
+        return np.take(self.table, index, out=dst, mode='clip')
+
+    def mask(self, frame: np.ndarray, name: str, dst: Optional[np.ndarray]=None, words: Optional[np.ndarray]=None,
+             index: Optional[np.ndarray]=None) -> np.ndarray:
+        """255 where the frame's pixels are in the named class, like cv2.inRange."""
+        entries = self.classify(frame, dst, words, index)
+        if len(self.values) == 1:
+            return entries
+        cv2.bitwise_and(entries, self.values[name], dst=entries)
+        return cv2.compare(entries, 0, cv2.CMP_GT, dst=entries)
+
+    def inRangeMask(self, frame: np.ndarray, name: str) -> np.ndarray:
+        """The named class's mask the slow way, through HSV - what mask is checked against."""
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        result = np.zeros(frame.shape[:2], dtype=np.uint8)
+        for lower, higher in self.classes[name]:
+            cv2.bitwise_or(result, cv2.inRange(hsv, lower, higher), dst=result)
+        return result
+
+    def mismatches(self, frame: np.ndarray) -> int:
+        """Pixels of the frame where any class's mask differs from cv2.inRange's - 0 unless something is broken."""
+        return sum(int(np.count_nonzero(self.mask(frame, name) != self.inRangeMask(frame, name)))
+                   for name in self.classes)
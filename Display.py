@@ -0,0 +1,94 @@
+import threading
+import time
+from queue import Queue, Empty
+from typing import Optional
+import cv2
+import numpy as np
+from Setup import Scoreboard, getDisplay
+from Ball import BallObservation
+from Profiling import PROFILER
+
+
+class DisplayThread(threading.Thread):
+    """
+    Owns every window while scoring. The scorer hands over the latest scoreboard and debug frame without
+    waiting, the thread renders and redraws them at a capped refresh rate and sends key presses back through a
+    queue.
+    """
+
+    SCOREBOARD_WINDOW = 'window'
+    DEBUG_WINDOW = 'Debug frame'
+
+    def __init__(self, maxFps: float=30.0, fullscreen: bool=True, showScoreboard: bool=True,
+                 showDebug: bool=False):
+        super().__init__(name='display', daemon=True)
+        self.period = 1.0 / maxFps
+        self.fullscreen = fullscreen
+        self.showScoreboardWindow = showScoreboard
+        self.showDebugWindow = showDebug
+        self.keys = Queue()
+        self.stopEvent = threading.Event()
+        # Latest images, swapped under the lock and drawn at most once each
+        self._lock = threading.Lock()
+        self._scoreboard = None
+        self._debugFrame = None
+        self._debugObservation = None
+
+    def showScoreboard(self, scoreboard: Scoreboard) -> None:
+        with self._lock:
+            self._scoreboard = scoreboard
+
+    def showDebugFrame(self, frame: np.ndarray, ballObservation: Optional[BallObservation]=None) -> None:
+        if not self.showDebugWindow:
+            return
+        with self._lock:
+            self._debugFrame = frame
+            self._debugObservation = ballObservation
+
+    def pollKey(self) -> Optional[int]:
+        """The oldest key pressed in any window since the last poll, None if there is none."""
+        try:
+            return self.keys.get_nowait()
+        except Empty:
+            return None
+
+    def stop(self) -> None:
+        self.stopEvent.set()
+        if self.is_alive() and self is not threading.current_thread():
+            self.join()
+
+    def run(self) -> None:
+        if self.showScoreboardWindow:
+            cv2.namedWindow(self.SCOREBOARD_WINDOW, cv2.WND_PROP_FULLSCREEN)
+            if self.fullscreen:
+                cv2.setWindowProperty(self.SCOREBOARD_WINDOW, cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
+
+        while not self.stopEvent.is_set():
+            startTime = time.perf_counter()
+            with self._lock:
+                scoreboard, self._scoreboard = self._scoreboard, None
+                debugFrame, self._debugFrame = self._debugFrame, None
+                debugObservation = self._debugObservation
+
+            if scoreboard is not None and self.showScoreboardWindow:
+                cv2.imshow(self.SCOREBOARD_WINDOW, getDisplay(scoreboard.score, scoreboard.serving))
+            if debugFrame is not None:
+                cv2.imshow(self.DEBUG_WINDOW, self._drawDebug(debugFrame, debugObservation))
+
+            # waitKey also pumps the GUI events, so it runs even when nothing changed
+            remaining = self.period - (time.perf_counter() - startTime)
+            key = cv2.waitKey(max(1, int(remaining * 1000)))
+            if key != -1:
+                self.keys.put(key & 0xFF)
+
+        cv2.destroyAllWindows()
+
+    @staticmethod
+    def _drawDebug(frame: np.ndarray, ballObservation: Optional[BallObservation]) -> np.ndarray:
+        # The frame still belongs to the scorer, so draw on a copy
+        infoFrame = frame.copy()
+        if ballObservation is not None and ballObservation.pos is not None:
+            cv2.circle(infoFrame, ballObservation.pos, 10, (0, 0, 255), 2)
+        if PROFILER.enabled:
+            PROFILER.drawOverlay(infoFrame)
+        return infoFrame
@@ -0,0 +1,198 @@
+import json
+import struct
+import threading
+import time
+from collections import deque, namedtuple
+from typing import Callable, Iterable, List, Optional
+from Setup import LEFT, display
+
+# What GameState emits as it happens. time comes from the EventStream's clock - wall time live, video time when
+# scoring a recording. Sides are LEFT or RIGHT and states GameState.STATE_* values.
+PointScored = namedtuple('PointScored', ['time', 'side', 'score'])  # score is (left, right) after the point
+# side is whoever the new state is about - the server, the side expected to respond, the free ball's hitter or
+# the side of an ambiguous bounce, and None while waiting for a paddle signal
+StateChanged = namedtuple('StateChanged', ['time', 'fromState', 'toState', 'side'])
+SecondServe = namedtuple('SecondServe', ['time', 'side'])  # side is the server getting a second try
+ServeCrossed = namedtuple('ServeCrossed', ['time', 'side'])  # side the serve crossed the net to
+# An operator corrected a call and the game was re-scored - side is who serves now and score is (left, right)
+ScoreCorrected = namedtuple('ScoreCorrected', ['time', 'side', 'score'])
+
+EVENT_TYPES = (PointScored, StateChanged, SecondServe, ServeCrossed, ScoreCorrected)
+
+# Binary log records - event type index, time, side, from state, to state and score, with -1 for None
+BINARY_RECORD = struct.Struct('<BdbbbHH')
+
+
+class EventStream:
+    """
+    Carries GameState's events to sinks, away from the scoring loop.
+    emit only appends to a deque, which needs no lock. flush hands everything emitted so far to every sink in
+    order, and start does that on a thread of its own every FLUSH_INTERVAL seconds.
+    A sink is anything with write(event), flush() and close().
+    """
+
+    FLUSH_INTERVAL = 0.1
+
+    def __init__(self, sinks: Iterable=(), clock: Callable[[], float]=time.time):
+        self.sinks = list(sinks)
+        self.clock = clock
+        self._events = deque()
+        self._stopEvent = threading.Event()
+        self._thread = None
+
+    def addSink(self, sink) -> None:
+        self.sinks.append(sink)
+
+    def emit(self, event) -> None:
+        self._events.append(event)
+
+    def flush(self) -> None:
+        events = self._events
+        while events:
+            event = events.popleft()
+            for sink in self.sinks:
+                sink.write(event)
+        for sink in self.sinks:
+            sink.flush()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='events', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopEvent.wait(self.FLUSH_INTERVAL):
+            self.flush()
+
+    def close(self) -> None:
+        """Stops the flushing thread, hands the sinks what is left and closes them."""
+        self._stopEvent.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        for sink in self.sinks:
+            sink.close()
+
+
+class ConsoleSink:
+    """
+    Prints a GameState's events as they come out of its EventStream, with the game clock - the time since the
+    serve crossed the net, or [STOP] between rallies.
+    """
+
+    def __init__(self, output: Callable[[str], None]=print):
+        # Game emits through this module, so its state names are only imported once both are loaded
+        from Game import GameState
+        self.states = GameState
+        self.output = output  # Where event messages go
+        self.roundStart = 0.0
+        self.gameClockOn = False
+
+    def printWithTime(self, eventTime: float, message: str):
+        timeMsg = ('[%04d]' % int(eventTime - self.roundStart)) if self.gameClockOn else '[STOP]'
+        self.output('%s %s' % (timeMsg, message))
+
+    def write(self, event):
+        if isinstance(event, PointScored):
+            self.printWithTime(event.time, '%s has scored! Score is now: %s' %
+                               (('Left' if event.side == LEFT else 'Right'), list(event.score)))
+        elif isinstance(event, StateChanged):
+            GameState = self.states
+            stateMsg = ", "
+            if event.toState == GameState.STATE_AMBIGUOUS_BOUNCE:
+                stateMsg += 'on the %s' % display(event.side)
+            elif event.toState == GameState.STATE_FREE_BALL:
+                stateMsg += 'from the %s' % display(event.side)
+            elif event.toState == GameState.STATE_EXPECTING_RESPONSE:
+                stateMsg += 'expecting %s to respond' % display(event.side)
+            elif event.toState == GameState.STATE_AWAITING_SIGNAL:
+                stateMsg += 'waiting for a paddle signal'
+            elif event.toState == GameState.STATE_PRE_SERVE:
+                if event.fromState == GameState.STATE_AWAITING_SIGNAL:
+                    stateMsg += 'got a paddle signal, '
+                stateMsg += '%s is serving' % display(event.side)
+                self.gameClockOn = False
+            self.printWithTime(event.time, 'State is now %s%s' % (GameState.STATE_TO_NAME[event.toState], stateMsg))
+        elif isinstance(event, SecondServe):
+            self.printWithTime(event.time, 'Giving server second try')
+        elif isinstance(event, ServeCrossed):
+            self.gameClockOn = True
+            self.roundStart = event.time
+            self.printWithTime(event.time, 'Serve crossed net to the %s side, round has started' % display(event.side))
+        elif isinstance(event, ScoreCorrected):
+            self.gameClockOn = False
+            self.printWithTime(event.time, 'Score corrected to %s, %s is serving' % (list(event.score),
+                                                                                    display(event.side)))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonlSink:
+    """Appends every event to a file as a line of JSON, e.g. {"event": "PointScored", "time": ..., ...}."""
+
+    def __init__(self, path: str):
+        self.file = open(path, 'a')
+
+    def write(self, event) -> None:
+        record = {'event': type(event).__name__}
+        record.update(event._asdict())
+        self.file.write(json.dumps(record) + '\n')
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def _encode(value: Optional[int]) -> int:
+    return -1 if value is None else value
+
+
+def _decode(value: int) -> Optional[int]:
+    return None if value == -1 else value
+
+
+class BinarySink:
+    """Appends every event to a file as a fixed size BINARY_RECORD, read back with loadBinaryLog."""
+
+    def __init__(self, path: str):
+        self.file = open(path, 'ab')
+
+    def write(self, event) -> None:
+        fields = event._asdict()
+        score = fields.get('score', (0, 0))
+        self.file.write(BINARY_RECORD.pack(EVENT_TYPES.index(type(event)), event.time, _encode(fields['side']),
+                                           _encode(fields.get('fromState')), _encode(fields.get('toState')), *score))
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def loadBinaryLog(path: str) -> List[tuple]:
+    """The events a BinarySink wrote, in order."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    events = []
+    for typeIndex, eventTime, side, fromState, toState, left, right in BINARY_RECORD.iter_unpack(data):
+        eventType = EVENT_TYPES[typeIndex]
+        if eventType is PointScored:
+            events.append(PointScored(eventTime, side, (left, right)))
+        elif eventType is ScoreCorrected:
+            events.append(ScoreCorrected(eventTime, _decode(side), (left, right)))
+        elif eventType is StateChanged:
+            events.append(StateChanged(eventTime, _decode(fromState), _decode(toState), _decode(side)))
+        else:
+            events.append(eventType(eventTime, _decode(side)))
+    return events
+
+
+def openEventLog(path: str):
+    """A JSONL sink for .jsonl paths, a binary one for anything else."""
+    return JsonlSink(path) if path.endswith('.jsonl') else BinarySink(path)
@@ -0,0 +1,98 @@
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+from typing import Optional
+import numpy as np
+
+
+class FrameRing:
+    """
+    A fixed number of frame slots in shared memory, so frames go between processes as slot indices instead of
+    pickled arrays. Every holder of a slot has a reference on it - a slot is only handed out again once the
+    last one is released, so a frame can't be overwritten while a stage still reads it.
+    The ring is passed to worker processes when they are started, which attach to the same memory.
+    """
+
+    def __init__(self, res: tuple, slots: int):
+        if slots < 1:
+            raise ValueError('A frame ring needs at least one slot.')
+        width, height = res
+        self.res = res
+        self.slots = slots
+        self.shape = (height, width, 3)
+        frameBytes = height * width * 3
+        self._memory = shared_memory.SharedMemory(create=True, size=slots * frameBytes + slots * 4)
+        self._ownerPid = os.getpid()  # Forked workers inherit the ring as it is, so only this process frees it
+        self._condition = multiprocessing.Condition()  # Guards the reference counts
+        self._attach()
+        self.refs[:] = 0
+        self._next = 0  # Where the search for a free slot starts, so slots are reused round robin
+
+    def _attach(self):
+        count, frameBytes = self.slots, int(np.prod(self.shape))
+        buffer = self._memory.buf
+        self.frames = np.ndarray((count,) + self.shape, dtype=np.uint8, buffer=buffer)
+        self.refs = np.ndarray(count, dtype=np.int32, buffer=buffer, offset=count * frameBytes)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('_memory', 'frames', 'refs'):
+            del state[name]
+        state['name'] = self._memory.name
+        return state
+
+    def __setstate__(self, state):
+        name = state.pop('name')
+        self.__dict__.update(state)
+        self._memory = shared_memory.SharedMemory(name=name)
+        self._attach()
+
+    def acquire(self, timeout: Optional[float]=None) -> Optional[int]:
+        """A free slot with one reference on it, None if none was released within the timeout."""
+        with self._condition:
+            while True:
+                for i in range(self.slots):
+                    slot = (self._next + i) % self.slots
+                    if self.refs[slot] == 0:
+                        self.refs[slot] = 1
+                        self._next = (slot + 1) % self.slots
+                        return slot
+                if not self._condition.wait(timeout):
+                    return None
+
+    def retain(self, slot: int) -> None:
+        with self._condition:
+            if self.refs[slot] <= 0:
+                raise RuntimeError('Slot %d was retained after it was released.' % slot)
+            self.refs[slot] += 1
+
+    def release(self, slot: int) -> None:
+        if self.refs is None:
+            return  # Closed - there is nothing left to hold on to
+        with self._condition:
+            if self.refs[slot] <= 0:
+                raise RuntimeError('Slot %d was released more times than it was referenced.' % slot)
+            self.refs[slot] -= 1
+            if self.refs[slot] == 0:
+                self._condition.notify_all()
+
+    def frame(self, slot: int) -> np.ndarray:
+        """The slot's frame - only valid while a reference on the slot is held."""
+        return self.frames[slot]
+
+    def pinned(self) -> int:
+        """Slots somebody holds a reference on."""
+        with self._condition:
+            return int(np.count_nonzero(self.refs))
+
+    def close(self) -> None:
+        """Detaches this process from the ring, and frees it if this is the process that made it."""
+        if self.refs is None:
+            return
+        self.frames = self.refs = None
+        try:
+            self._memory.close()
+        except BufferError:
+            pass  # Frames handed out are still referenced, the mapping goes with them
+        if self._ownerPid == os.getpid():
+            self._memory.unlink()
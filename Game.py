@@ -1,8 +1,32 @@
 
+from collections import namedtuple
 from copy import deepcopy
+from typing import Callable, List, Optional
+import numpy as np
 
 # Import from main file
-from Setup import LEFT, NET_VIEW_BUFFER, TABLE_END_BUFFER, display, getDisplay, getSideSignal, other, GameViewSource
+from Setup import (LEFT, RIGHT, DEFAULT_GEOMETRY, display, Scoreboard, other, GameViewSource, SceneGeometry,
+                   SideSignalDetector)
+from Events import EventStream, PointScored, SecondServe, ServeCrossed, StateChanged
+
+# A transition rule of a state. guard(game, ball) decides whether action(game, ball) runs, nextState is where it
+# leads - None for rules that only take note of the ball crossing the net. crossed is whether the rule needs the
+# serve or free ball to have crossed the net already (True), to not have yet (False), or either (None).
+Rule = namedtuple('Rule', ['state', 'crossed', 'name', 'guard', 'action', 'nextState'])
+
+# One GameState snapshot - everything in GameState.summary(), with -1 for sides that are None
+GAME_RECORD_DTYPE = np.dtype([('state', 'i1'), ('leftScore', '<u2'), ('rightScore', '<u2'), ('servingSide', 'i1'),
+                              ('givenSecondTry', '?'), ('serveCrossedNet', '?'), ('expectingResponseFrom', 'i1'),
+                              ('freeBallFrom', 'i1'), ('freeBallCrossedNet', '?'), ('ambiguousBounceSide', 'i1')])
+
+
+def _encodeSide(side: Optional[int]) -> int:
+    return -1 if side is None else side
+
+
+def _decodeSide(side: int) -> Optional[int]:
+    return None if side == -1 else side
+
 
 # High level logic for the ping pong game
 class GameState:
@@ -12,21 +36,39 @@ class GameState:
     STATE_EXPECTING_RESPONSE = 2
     STATE_SERVE_ATTEMPT = 3
     STATE_AMBIGUOUS_BOUNCE = 4
+    STATE_AWAITING_SIGNAL = 5
 
     STATE_TO_NAME = {STATE_PRE_SERVE: 'Pre-Serve',
                      STATE_FREE_BALL: 'Free Ball',
                      STATE_EXPECTING_RESPONSE: 'Expecting Response',
-                     STATE_AMBIGUOUS_BOUNCE: 'Ambiguous Bounce'}
+                     STATE_AMBIGUOUS_BOUNCE: 'Ambiguous Bounce',
+                     STATE_AWAITING_SIGNAL: 'Awaiting Signal'}
 
     TIMEOUT_FRAMES_FOR_LONG_HIT = 20
     TIMEOUT_FRAMES_FOR_NO_HIT = 25
 
-    def __init__(self, view: GameViewSource):
+    __slots__ = ('state', 'netX', 'geometry', 'view', 'headless', 'events', 'sideSignal', 'signalDetector',
+                 'servingSide', 'givenSecondTry', 'serveCrossedNet', 'expectingResponseFrom', 'freeBallFrom',
+                 'freeBallCrossedNet', 'ambiguousBounceSide', 'score', 'currentDisplay', 'dispatch', 'rules')
+
+    def __init__(self, view: Optional[GameViewSource], headless: bool=False,
+                 sideSignal: Optional[Callable[['GameState'], Optional[int]]]=None,
+                 geometry: Optional[SceneGeometry]=None, events: Optional[EventStream]=None):
         self.state = self.STATE_PRE_SERVE
         # Constants
         self.netX = None
+        if geometry is None:
+            geometry = view.geometry if view is not None else DEFAULT_GEOMETRY
+        self.geometry = geometry
         # For display
         self.view = view
+        self.headless = headless  # Never open windows or render the scoreboard, e.g. when scoring offline
+        # Where points, state changes and serves are reported as they happen
+        self.events = events
+        # Answers who is serving after an ambiguous bounce right away, e.g. offline. Without it the game waits
+        # for a paddle signal in the frames given to updateSignal
+        self.sideSignal = sideSignal
+        self.signalDetector = None
         # For pre-serve
         self.servingSide = None
         self.givenSecondTry = False
@@ -40,69 +82,314 @@ class GameState:
         self.ambiguousBounceSide = None
         # Score keeping
         self.score = [0, 0]
-        # Display
+        # Display - the Scoreboard to show, rendered by whoever shows it
         self.currentDisplay = None
+        # The rules compiled for this game once netX is known, and the ones of the current state
+        self.dispatch = {}
+        self.rules = ()
 
     def __copy__(self):
-        obj = type(self)(self.view)
-        obj.__dict__ = self.__dict__.copy()
-        obj.__dict__['score'] = obj.__dict__['score'].copy()
+        obj = type(self).__new__(type(self))
+        for name in GameState.__slots__:
+            setattr(obj, name, getattr(self, name))
+        obj.score = self.score.copy()
         return obj
 
+    def newRecords(self, count: int) -> np.ndarray:
+        """Preallocated records for count snapshots of a game."""
+        return np.zeros(count, dtype=GAME_RECORD_DTYPE)
+
+    def snapshot(self, records: np.ndarray, index: int) -> None:
+        """Writes the game into records[index] of newRecords, one fixed size row."""
+        records[index] = (self.state, self.score[LEFT], self.score[RIGHT], _encodeSide(self.servingSide),
+                          self.givenSecondTry, self.serveCrossedNet, _encodeSide(self.expectingResponseFrom),
+                          _encodeSide(self.freeBallFrom), self.freeBallCrossedNet,
+                          _encodeSide(self.ambiguousBounceSide))
+
+    def restore(self, records: np.ndarray, index: int) -> None:
+        """Puts the game back the way snapshot found it, without reporting any events."""
+        (state, leftScore, rightScore, servingSide, self.givenSecondTry, self.serveCrossedNet, expectingResponseFrom,
+         freeBallFrom, self.freeBallCrossedNet, ambiguousBounceSide) = records[index].item()
+        self.state = state
+        self.score[LEFT], self.score[RIGHT] = leftScore, rightScore
+        self.servingSide = _decodeSide(servingSide)
+        self.expectingResponseFrom = _decodeSide(expectingResponseFrom)
+        self.freeBallFrom = _decodeSide(freeBallFrom)
+        self.ambiguousBounceSide = _decodeSide(ambiguousBounceSide)
+        self.selectRules()
+        if not self.headless:
+            servingSide = None if state == self.STATE_AWAITING_SIGNAL else self.servingSide
+            self.currentDisplay = Scoreboard(tuple(self.score), servingSide)
+        if state == self.STATE_AWAITING_SIGNAL and self.signalDetector is not None:
+            self.signalDetector.reset()
+
+    def summary(self) -> tuple:
+        """Everything about the game its future depends on - the state, score and the sides involved."""
+        return (self.state, tuple(self.score), self.servingSide, self.givenSecondTry, self.serveCrossedNet,
+                self.expectingResponseFrom, self.freeBallFrom, self.freeBallCrossedNet, self.ambiguousBounceSide)
+
     def begin(self, netX, servingSide=None):
+        """Starts the game, waiting for a paddle signal first if the serving side isn't known."""
         self.state = self.STATE_PRE_SERVE
         self.netX = netX
         self.servingSide = servingSide
         self.givenSecondTry = False
+        self.dispatch = self.compileRules()
+        self.selectRules()
+        self.signalDetector = SideSignalDetector(self.geometry, netX)
+        if servingSide is None:
+            self.transitionAwaitingSignal()
+
+    def _emit(self, eventType, *fields):
+        if self.events is not None:
+            self.events.emit(eventType(self.events.clock(), *fields))
 
     def transitionPreServe(self, servingSide):
         # Scoring
         if self.servingSide == servingSide:
-            # print('%s HAS SCORED!' % display(servingSide))
             self.score[servingSide] += 1
+            self._emit(PointScored, servingSide, tuple(self.score))
 
         # Display
-        self.currentDisplay = getDisplay(self.score, servingSide)
-
-        # print('GAME: %s -> %s, serving from %s side' %
-        #       (self.STATE_TO_NAME[self.state], self.STATE_TO_NAME[self.STATE_PRE_SERVE],
-        #        display(servingSide)))
+        if not self.headless:
+            self.currentDisplay = Scoreboard(tuple(self.score), servingSide)
 
+        self._emit(StateChanged, self.state, self.STATE_PRE_SERVE, servingSide)
         self.state = self.STATE_PRE_SERVE
         self.servingSide = servingSide
         self.givenSecondTry = False
         self.serveCrossedNet = False
+        self.selectRules()
 
     def transitionExpectingResponse(self, expectingFrom):
-        print('GAME: %s -> %s, expecting hit from %s side' %
-              (self.STATE_TO_NAME[self.state], self.STATE_TO_NAME[self.STATE_EXPECTING_RESPONSE],
-               display(expectingFrom)))
-
+        self._emit(StateChanged, self.state, self.STATE_EXPECTING_RESPONSE, expectingFrom)
         self.state = self.STATE_EXPECTING_RESPONSE
         self.expectingResponseFrom = expectingFrom
+        self.selectRules()
 
     def transitionFreeBall(self, freeBallFrom):
-        print('GAME: %s -> %s, ball hit from %s side' %
-              (self.STATE_TO_NAME[self.state], self.STATE_TO_NAME[self.STATE_FREE_BALL],
-               display(freeBallFrom)))
-
+        self._emit(StateChanged, self.state, self.STATE_FREE_BALL, freeBallFrom)
         self.state = self.STATE_FREE_BALL
         self.freeBallFrom = freeBallFrom
         self.freeBallCrossedNet = False
+        self.selectRules()
 
     def transitionAmbiguousBounce(self, ambiguousBounceSide):
         """An intermediate state that functions as either ER or FB."""
-        print('GAME: %s -> %s, ambiguous bounce on the %s side' %
-              (self.STATE_TO_NAME[self.state], self.STATE_TO_NAME[self.STATE_FREE_BALL],
-               display(ambiguousBounceSide)))
-
+        self._emit(StateChanged, self.state, self.STATE_AMBIGUOUS_BOUNCE, ambiguousBounceSide)
         self.state = self.STATE_AMBIGUOUS_BOUNCE
         self.ambiguousBounceSide = ambiguousBounceSide
+        self.selectRules()
+
+    def transitionAwaitingSignal(self):
+        # Display
+        if not self.headless:
+            self.currentDisplay = Scoreboard(tuple(self.score), None)
+
+        self._emit(StateChanged, self.state, self.STATE_AWAITING_SIGNAL, None)
+        self.state = self.STATE_AWAITING_SIGNAL
+        self.selectRules()
+        if self.signalDetector is not None:
+            self.signalDetector.reset()
+
+    def updateSignal(self, frame) -> Optional[int]:
+        """
+        Looks for the paddle signal in a frame while the game waits for one, and serves from its side once seen.
+        Returns the serving side when the signal was seen in this frame.
+        """
+        if self.state != self.STATE_AWAITING_SIGNAL or frame is None:
+            return None
+        servingSide = self.signalDetector.feed(frame)
+        if servingSide is not None:
+            self.transitionPreServe(servingSide)
+        return servingSide
 
     def updateState(self, ball, output=False):
         if output:
             self.printCurrentState()
 
+        # The first rule whose guard holds makes the transition
+        for guard, rule in self.rules:
+            if guard(self, ball):
+                self._fire(rule, ball, output)
+                break
+
+    def _fire(self, rule, ball, output):
+        if output: print(rule.name)
+        rule.action(self, ball)
+        if rule.nextState is None:
+            # Taking note of the ball crossing the net switched to the rules for after it has, checked right away
+            for guard, nextRule in self.rules:
+                if guard(self, ball):
+                    self._fire(nextRule, ball, output)
+                    break
+
+    def transitionRules(self, side: int) -> List[Rule]:
+        """
+        The transition rules of every state for when side is the one the state is about - the server, the free
+        ball's hitter, the side expected to respond or the side of an ambiguous bounce. Each state's rules are
+        checked in order. netX, the table's bounds, the timeouts and the other side are bound into the guards,
+        which only read what changes from frame to frame. Subclasses can add to or replace the rules here.
+        """
+        opp = other(side)
+        tableLeft, tableRight = self.netX - self.geometry.tableEndBuffer, self.netX + self.geometry.tableEndBuffer
+        netLeft, netRight = self.netX - self.geometry.netViewBuffer, self.netX + self.geometry.netViewBuffer
+        longHit, noHit = self.TIMEOUT_FRAMES_FOR_LONG_HIT, self.TIMEOUT_FRAMES_FOR_NO_HIT
+        PS, FB, ER, AB = (self.STATE_PRE_SERVE, self.STATE_FREE_BALL, self.STATE_EXPECTING_RESPONSE,
+                          self.STATE_AMBIGUOUS_BOUNCE)
+        toPreServe = lambda game, ball: game.transitionPreServe(opp)
+        toExpectingResponse = lambda game, ball: game.transitionExpectingResponse(opp)
+        hitLong = lambda game, ball: ball.hasHitNet or ball.framesOnSide > longHit
+        if self.sideSignal is not None:
+            ambiguousTimeout = (lambda game, ball: game.transitionPreServe(game.sideSignal(game)), PS)
+        else:
+            ambiguousTimeout = (lambda game, ball: game.transitionAwaitingSignal(), self.STATE_AWAITING_SIGNAL)
+        return [
+            # Pre Serve - table bounce, hit net and hit long require the serve to have crossed the net
+            Rule(PS, False, 'Serve crossed net', lambda game, ball: ball.ballCrossedTo == opp,
+                 lambda game, ball: game._serveCrossed(opp), None),
+            Rule(PS, True, 'Table bounce', lambda game, ball: ball.bounceSide == opp, toExpectingResponse, ER),
+            # Hitting the net or long the second time changes serving side but not the score
+            Rule(PS, True, 'No more tries for you', lambda game, ball: game.givenSecondTry and hitLong(game, ball),
+                 toPreServe, PS),
+            Rule(PS, True, 'Giving a second try', hitLong, lambda game, ball: game._giveSecondTry(), PS),
+
+            # Free Ball - bouncing on the other side and going long need the ball to have crossed the net
+            Rule(FB, False, 'Free ball crossed net', lambda game, ball: ball.ballCrossedTo == opp,
+                 lambda game, ball: game._freeBallCrossed(), None),
+            Rule(FB, None, 'Ball has hit the net', lambda game, ball: ball.hasHitNet, toPreServe, PS),
+            # Bounce early - restricted to near the net because that is almost always where it happens
+            Rule(FB, None, 'Ball has bounced early',
+                 lambda game, ball: ball.pos is not None and ball.pos[0] < netRight and ball.bounceSide == side,
+                 toPreServe, PS),
+            # A bounce within our confidence interval, or one near the edge of view that is treated as ambiguous
+            Rule(FB, True, 'Ball has bounced on the other side',
+                 lambda game, ball: ball.bounceSide == opp and tableLeft < ball.lastPos[0] < tableRight,
+                 toExpectingResponse, ER),
+            Rule(FB, True, 'Ambiguous bounce', lambda game, ball: ball.bounceSide == opp,
+                 lambda game, ball: game.transitionAmbiguousBounce(opp), AB),
+            Rule(FB, True, 'Ball has been hit long', lambda game, ball: ball.framesOnSide > longHit, toPreServe, PS),
+            Rule(FB, False, 'Ball has not been hit', lambda game, ball: ball.framesOnSide > noHit, toPreServe, PS),
+            Rule(FB, False, 'Air hit', lambda game, ball: ball.netSide == opp and ball.hitDirection == side,
+                 toExpectingResponse, ER),
+
+            # Expecting Response - implied in this state is that the ball is on the returning player's side
+            Rule(ER, None, 'Hit by player',
+                 lambda game, ball: ball.currentDir == opp and tableLeft < ball.lastPos[0] < tableRight,
+                 lambda game, ball: game.transitionFreeBall(side), FB),
+            Rule(ER, None, 'Double bounce',
+                 lambda game, ball: (ball.bounceSide == side and tableLeft < ball.lastPos[0] < tableRight and
+                                     ball.timeSinceBounce > 1), toPreServe, PS),
+            Rule(ER, None, 'Timeout hitting back the ball', lambda game, ball: ball.framesOnSide > noHit,
+                 toPreServe, PS),
+
+            # Ambiguous Bounce - a hit removes the ambiguity and instantly changes state to free ball
+            Rule(AB, None, 'Ambiguous bounce timeout - need to know who is serving',
+                 lambda game, ball: ball.framesOnSide > longHit, *ambiguousTimeout),
+            Rule(AB, None, 'Ambiguous bounce has been hit - now FB',
+                 lambda game, ball: netLeft < ball.lastPos[0] < netRight,
+                 lambda game, ball: game.transitionFreeBall(side), FB),
+        ]
+
+    def compileRules(self) -> dict:
+        """
+        Every state's rules for each side and whether the ball has crossed the net, as the (guard, rule) pairs
+        updateState checks in order. Whether the ball crossed is part of the key instead of every guard.
+        """
+        dispatch = {}
+        for side in (LEFT, RIGHT):
+            for rule in self.transitionRules(side):
+                for crossed in ((False, True) if rule.crossed is None else (rule.crossed,)):
+                    dispatch.setdefault((rule.state, side, crossed), []).append((rule.guard, rule))
+        return {key: tuple(rules) for key, rules in dispatch.items()}
+
+    def selectRules(self):
+        """Picks the compiled rules for the current state, the side it is about and whether the ball crossed."""
+        if self.state == self.STATE_PRE_SERVE:
+            key = (self.state, self.servingSide, self.serveCrossedNet)
+        elif self.state == self.STATE_FREE_BALL:
+            key = (self.state, self.freeBallFrom, self.freeBallCrossedNet)
+        elif self.state == self.STATE_EXPECTING_RESPONSE:
+            key = (self.state, self.expectingResponseFrom, False)
+        elif self.state == self.STATE_AMBIGUOUS_BOUNCE:
+            key = (self.state, self.ambiguousBounceSide, False)
+        else:
+            key = None
+        rules = self.dispatch.get(key)
+        if rules is None:
+            # A state that is about neither side can't go anywhere - only waiting for a signal has no rules
+            rules = _UNKNOWN_SIDE_RULES if key is not None and key[1] is None and self.dispatch else ()
+        self.rules = rules
+
+    def _serveCrossed(self, toSide):
+        self.serveCrossedNet = True
+        self._emit(ServeCrossed, toSide)
+        self.selectRules()
+
+    def _giveSecondTry(self):
+        self.givenSecondTry = True
+        self.serveCrossedNet = False
+        self._emit(SecondServe, self.servingSide)
+        self.selectRules()
+
+    def _freeBallCrossed(self):
+        self.freeBallCrossedNet = True
+        self.selectRules()
+
+    def _hasGoneLong(self, ball, hasCrossed):
+        """For shortening code."""
+        return hasCrossed and ball.framesOnSide > self.TIMEOUT_FRAMES_FOR_LONG_HIT
+
+    def printCurrentState(self):
+        if self.state == self.STATE_PRE_SERVE:
+            print('PS from the %s' % display(self.servingSide))
+        elif self.state == self.STATE_FREE_BALL:
+            print('FB from the %s' % display(self.freeBallFrom))
+        elif self.state == self.STATE_EXPECTING_RESPONSE:
+            print('ER from the %s' % display(self.expectingResponseFrom))
+        elif self.state == self.STATE_AMBIGUOUS_BOUNCE:
+            print('AB on the %s' % display(self.ambiguousBounceSide))
+        elif self.state == self.STATE_AWAITING_SIGNAL:
+            print('Waiting for a paddle signal')
+
+
+def _unknownSide(game, ball):
+    raise RuntimeError('Need to know which side the %s state is about' % game.STATE_TO_NAME[game.state])
+
+
+# The rules of a state that is about neither side - it can't go anywhere
+_UNKNOWN_SIDE_RULES = ((_unknownSide, None),)
+
+
+class LegacyGameState(GameState):
+    """
+    The if/elif updateState the rule table replaced, kept as the reference to check the rules against - see
+    Trajectory.checkConformance. _legacyUpdateState is the original's transition logic, and updateState only wraps
+    it to report the serve crossing the net and second serves, which the original had no events for. Where it
+    differs from the original:
+    - The net and table end buffers come from the game's geometry rather than the module constants, which equal
+      the default geometry's.
+    - The ambiguous bounce timeout serves from sideSignal's side, or waits for the paddle signal, where the original
+      blocked in getSideSignal, which is gone.
+    - The transitions are GameState's, which report events instead of printing the state change, and skip the
+      scoreboard when headless.
+    """
+
+    __slots__ = ()
+
+    def updateState(self, ball, output=False):
+        state, servingSide, givenSecondTry = self.state, self.servingSide, self.givenSecondTry
+        # The original takes note of the serve crossing on every frame it does - only the first is reported
+        if state == self.STATE_PRE_SERVE and not self.serveCrossedNet and ball.ballCrossedTo == other(servingSide):
+            self._emit(ServeCrossed, other(servingSide))
+        self._legacyUpdateState(ball, output)
+        if state == self.STATE_PRE_SERVE and self.givenSecondTry and not givenSecondTry:
+            self._emit(SecondServe, servingSide)
+
+    def _legacyUpdateState(self, ball, output=False):
+        if output:
+            self.printCurrentState()
+
         # Pre Serve
         if self.state == self.STATE_PRE_SERVE:
             # Take note of instantaneous variables related to this state and store them
@@ -144,7 +431,7 @@ class GameState:
                 if output: print('Ball has hit the net')
                 self.transitionPreServe(other(self.freeBallFrom))
             # Bounce early - I restricted the position of an early bounce because it almost always happens near the net
-            elif ball.pos is not None and ball.pos[0] < self.netX + NET_VIEW_BUFFER and ball.bounceSide == self.freeBallFrom:
+            elif ball.pos is not None and ball.pos[0] < self.netX + self.geometry.netViewBuffer and ball.bounceSide == self.freeBallFrom:
                 print('Ball has bounced early')
                 self.transitionPreServe(other(self.freeBallFrom))
             # Free ball has crossed the net - prerequisite for other side table bounce and hit long
@@ -152,7 +439,7 @@ class GameState:
                 # Table bounce on
                 if ball.bounceSide == other(self.freeBallFrom):
                     # If the table bounce was within our confidence interval
-                    if self.netX - TABLE_END_BUFFER < ball.lastPos[0] < self.netX + TABLE_END_BUFFER:
+                    if self.netX - self.geometry.tableEndBuffer < ball.lastPos[0] < self.netX + self.geometry.tableEndBuffer:
                         if output: print('Ball has bounced on the other side')
                         self.transitionExpectingResponse(other(self.freeBallFrom))
                     # If the bounce is near the edge of view it is treated as ambiguous
@@ -176,7 +463,7 @@ class GameState:
         elif self.state == self.STATE_EXPECTING_RESPONSE:
             # Hit
             # if ball.hitDirection == other(self.expectingResponseFrom):
-            isWithinReasonableBounds = self.netX - TABLE_END_BUFFER < ball.lastPos[0] < self.netX + TABLE_END_BUFFER
+            isWithinReasonableBounds = self.netX - self.geometry.tableEndBuffer < ball.lastPos[0] < self.netX + self.geometry.tableEndBuffer
             isComingBack = ball.currentDir == other(self.expectingResponseFrom)
             if isComingBack and isWithinReasonableBounds:
                 if output: print('Hit by player')
@@ -195,24 +482,11 @@ class GameState:
             # Timeout
             if ball.framesOnSide > self.TIMEOUT_FRAMES_FOR_LONG_HIT:
                 print('Ambiguous bounce timeout - need to know who is serving')
-                servingSide = getSideSignal(self.view, self.netX, self.score)
-                self.transitionPreServe(servingSide)
+                if self.sideSignal is not None:
+                    self.transitionPreServe(self.sideSignal(self))
+                else:
+                    self.transitionAwaitingSignal()
             # Hit - removes the ambiguity and instantly changes state to free ball
-            elif self.netX - NET_VIEW_BUFFER < ball.lastPos[0] < self.netX + NET_VIEW_BUFFER:
+            elif self.netX - self.geometry.netViewBuffer < ball.lastPos[0] < self.netX + self.geometry.netViewBuffer:
                 print('Ambiguous bounce has been hit - now FB')
                 self.transitionFreeBall(self.ambiguousBounceSide)
-
-    def _hasGoneLong(self, ball, hasCrossed):
-        """For shortening code."""
-        return hasCrossed and ball.framesOnSide > self.TIMEOUT_FRAMES_FOR_LONG_HIT
-
-    def printCurrentState(self):
-        if self.state == self.STATE_PRE_SERVE:
-            print('PS from the %s' % display(self.servingSide))
-        elif self.state == self.STATE_FREE_BALL:
-            print('FB from the %s' % display(self.freeBallFrom))
-        elif self.state == self.STATE_EXPECTING_RESPONSE:
-            print('ER from the %s' % display(self.expectingResponseFrom))
-        elif self.state == self.STATE_AMBIGUOUS_BOUNCE:
-            print('AB on the %s' % display(self.ambiguousBounceSide))
-
@@ -0,0 +1,165 @@
+from copy import copy
+from typing import List, Optional
+from Game import GameState
+
+
+class _EventBuffer:
+    """Holds a hypothesis' events until it is the one left, so the stream only gets the events that happened."""
+
+    __slots__ = ('clock', 'events')
+
+    def __init__(self, clock, events=()):
+        self.clock = clock
+        self.events = list(events)
+
+    def emit(self, event) -> None:
+        self.events.append(event)
+
+
+class Hypothesis:
+    """One reading of the game and how likely it is."""
+
+    __slots__ = ('game', 'weight', 'preServeFrames')
+
+    def __init__(self, game: GameState, weight: float):
+        self.game = game
+        self.weight = weight
+        self.preServeFrames = 0  # Frames the game has been waiting for a serve
+
+
+class HypothesisTracker:
+    """
+    Follows both readings of an ambiguous bounce - it was in, or it was out - instead of waiting for the players
+    to signal who serves. Every hypothesis is advanced on each ball observation and weighed by how well it
+    explains where the ball went: a ball crossing the net towards the side a hypothesis has serving contradicts
+    it, and a serve right after a point is more likely a return. Unlikely hypotheses are pruned and the ambiguity
+    is resolved once one is left, which then reports the events it went through.
+    The ball observation is shared by all hypotheses, and the evidence is only taken from it once per frame.
+    Used in place of the game it is given - updateState, updateSignal, state, score and the display follow the
+    most likely hypothesis.
+    """
+
+    PRIOR_IN = 0.5  # Likelihood of an ambiguous bounce being in
+    CONTRADICTED = 0.02  # Of the ball crossing the net towards the server
+    QUICK_SERVE = 0.05  # Of a serve crossing the net within QUICK_SERVE_FRAMES of the point
+    QUICK_SERVE_FRAMES = 30
+    PRUNE_WEIGHT = 0.1
+    MAX_HYPOTHESES = 4
+
+    def __init__(self, game: GameState):
+        self.events = game.events
+        self.hypotheses = [Hypothesis(game, 1.0)]
+
+    @property
+    def game(self) -> GameState:
+        """The most likely hypothesis' game."""
+        if len(self.hypotheses) == 1:
+            return self.hypotheses[0].game
+        return max(self.hypotheses, key=lambda hypothesis: hypothesis.weight).game
+
+    @property
+    def state(self) -> int:
+        return self.game.state
+
+    @property
+    def score(self) -> List[int]:
+        return self.game.score
+
+    @property
+    def servingSide(self) -> Optional[int]:
+        return self.game.servingSide
+
+    @property
+    def currentDisplay(self):
+        return self.game.currentDisplay
+
+    def updateSignal(self, frame) -> Optional[int]:
+        return self.game.updateSignal(frame)
+
+    def updateState(self, ball, output=False):
+        hypotheses = self.hypotheses
+        if len(hypotheses) == 1:
+            game = hypotheses[0].game
+            game.updateState(ball, output)
+            if game.state == GameState.STATE_AMBIGUOUS_BOUNCE:
+                self._branch(hypotheses[0])
+            return
+
+        crossedTo = ball.ballCrossedTo
+        if crossedTo is not None:
+            self._weigh(crossedTo)
+        for hypothesis in list(hypotheses):
+            game = hypothesis.game
+            game.updateState(ball, output)
+            if game.state == GameState.STATE_PRE_SERVE:
+                hypothesis.preServeFrames += 1
+            else:
+                hypothesis.preServeFrames = 0
+                if game.state == GameState.STATE_AMBIGUOUS_BOUNCE:
+                    self._branch(hypothesis)
+        self._prune()
+
+    def _weigh(self, crossedTo: int):
+        """Weighs every hypothesis by how likely the ball crossing the net to crossedTo is in its game."""
+        for hypothesis in self.hypotheses:
+            game = hypothesis.game
+            if game.state != GameState.STATE_PRE_SERVE:
+                continue
+            if crossedTo == game.servingSide:
+                hypothesis.weight *= self.CONTRADICTED
+            elif hypothesis.preServeFrames < self.QUICK_SERVE_FRAMES:
+                hypothesis.weight *= self.QUICK_SERVE
+
+    def _clone(self, hypothesis: Hypothesis, weight: float) -> Hypothesis:
+        game = copy(hypothesis.game)
+        if self.events is not None:
+            # A branch of a branch starts with the events its parent is holding
+            parentEvents = hypothesis.game.events
+            game.events = _EventBuffer(self.events.clock, () if parentEvents is self.events else parentEvents.events)
+        return Hypothesis(game, weight)
+
+    def _branch(self, hypothesis: Hypothesis):
+        """Replaces a hypothesis that is in an ambiguous bounce with one where the bounce was in and one where not."""
+        side = hypothesis.game.ambiguousBounceSide
+        bounceIn = self._clone(hypothesis, hypothesis.weight * self.PRIOR_IN)
+        bounceOut = self._clone(hypothesis, hypothesis.weight * (1 - self.PRIOR_IN))
+        # In, the side it bounced on has to return it. Out, that side wins the rally
+        bounceIn.game.transitionExpectingResponse(side)
+        bounceOut.game.transitionPreServe(side)
+        index = self.hypotheses.index(hypothesis)
+        self.hypotheses[index:index + 1] = [bounceIn, bounceOut]
+
+    def _prune(self):
+        # Hypotheses that came to the same game go on the same from here, so they are merged
+        merged = {}
+        for hypothesis in self.hypotheses:
+            key = hypothesis.game.summary()
+            kept = merged.get(key)
+            if kept is None:
+                merged[key] = hypothesis
+            elif hypothesis.weight > kept.weight:
+                hypothesis.weight += kept.weight
+                merged[key] = hypothesis
+            else:
+                kept.weight += hypothesis.weight
+
+        hypotheses = sorted(merged.values(), key=lambda hypothesis: hypothesis.weight, reverse=True)
+        total = sum(hypothesis.weight for hypothesis in hypotheses)
+        hypotheses = [hypothesis for hypothesis in hypotheses[:self.MAX_HYPOTHESES]
+                      if hypothesis.weight >= self.PRUNE_WEIGHT * total]
+        total = sum(hypothesis.weight for hypothesis in hypotheses)
+        for hypothesis in hypotheses:
+            hypothesis.weight /= total
+        self.hypotheses = hypotheses
+        if len(hypotheses) == 1:
+            self._resolve(hypotheses[0])
+
+    def _resolve(self, hypothesis: Hypothesis):
+        """Makes the hypothesis left the game, reporting what happened in it."""
+        buffer = hypothesis.game.events
+        if self.events is not None and buffer is not self.events:
+            for event in buffer.events:
+                self.events.emit(event)
+            hypothesis.game.events = self.events
+        hypothesis.weight = 1.0
+        hypothesis.preServeFrames = 0
@@ -0,0 +1,177 @@
+from typing import List, Optional
+import cv2
+import numpy as np
+
+# Both models write their masks into a Ball's FrameBuffers and return None when nothing changed since the
+# previous frame, which Ball takes as a duplicate frame.
+# region is the (x0, y0, x1, y1) part of a frame of frameShape the two frames were cut from - the whole frame
+# when the ball is lost, the search window otherwise.
+
+
+class FrameDifference:
+    """The original motion mask - whatever changed since the previous frame by more than THRESHOLD."""
+
+    THRESHOLD = 15
+    batched = True  # The mask only depends on the two frames, so a stack of frames can be done at once
+
+    def mask(self, prevFrame: np.ndarray, currentFrame: np.ndarray, region: tuple, frameShape: tuple,
+             buffers) -> Optional[np.ndarray]:
+        shape = currentFrame.shape[:2]
+        diffFrame = cv2.absdiff(currentFrame, prevFrame, dst=buffers.get('diff', currentFrame.shape))
+        grayDiffFrame = cv2.cvtColor(diffFrame, cv2.COLOR_BGR2GRAY, dst=buffers.get('gray', shape))
+        if cv2.countNonZero(grayDiffFrame) == 0:
+            return None
+        ret, motionMask = cv2.threshold(grayDiffFrame, self.THRESHOLD, 255, cv2.THRESH_BINARY,
+                                        dst=buffers.get('motion', shape))
+        return motionMask
+
+    def reset(self) -> None:
+        pass
+
+
+class RunningBackground:
+    """
+    Motion against a running average of the scene instead of the previous frame, so a player standing still or
+    the blur a ball leaves behind is not motion. Each pixel also keeps the average gray deviation from its
+    background, and has to change by DEVIATIONS times that (and at least MIN_THRESHOLD) to count as moving -
+    flickering lights, screens and camera noise need more change than the steady table does.
+    The background is learned at RATE where nothing moves and at the slower FOREGROUND_RATE where something
+    does, so the ball barely leaves a trace but whatever stops moving still fades in. Deviations are learned
+    at RATE everywhere, or flicker would take forever to be learned. Only the region searched is updated.
+    Pixels start from the first frame they are searched in, or from learn on frames of the empty scene.
+    """
+
+    MIN_THRESHOLD = 15
+    DEVIATIONS = 4.0
+    RATE = 0.05
+    FOREGROUND_RATE = 0.005
+    batched = False  # Each frame's mask depends on the ones before it
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.mean = None  # float32 (height, width, 3) background color
+        self.background = None  # uint8 copy of mean to take differences against
+        self.deviation = None  # float32 (height, width) average gray deviation from the background
+        self.threshold = None  # uint8 (height, width) change each pixel needs to count as motion
+        self.seen = None  # uint8 (height, width), 255 where the background has been started
+        self.complete = False  # Whether every pixel has been seen
+
+    def learn(self, frames: List[np.ndarray]) -> None:
+        """Starts the background and its deviations from frames of the scene without a rally in it."""
+        frames = np.stack(frames)
+        self._allocate(frames.shape[1:])
+        self.mean[:] = frames.mean(axis=0)
+        self.background[:] = np.round(self.mean)
+        grayFrames = np.stack([cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]).astype(np.float32)
+        grayBackground = cv2.cvtColor(self.mean, cv2.COLOR_BGR2GRAY)
+        self.deviation[:] = np.abs(grayFrames - grayBackground).mean(axis=0)
+        self._updateThreshold((slice(None), slice(None)))
+        self.seen[:] = 255
+        self.complete = True
+
+    def _rescale(self, frameShape: tuple) -> None:
+        """Scales what has been learned to frames of another shape, e.g. a pyramid's search level."""
+        size = (frameShape[1], frameShape[0])
+        mean, deviation, seen = self.mean, self.deviation, self.seen
+        self._allocate(frameShape)
+        self.mean[:] = cv2.resize(mean, size, interpolation=cv2.INTER_AREA)
+        self.background[:] = np.round(self.mean)
+        self.deviation[:] = cv2.resize(deviation, size, interpolation=cv2.INTER_AREA)
+        self._updateThreshold((slice(None), slice(None)))
+        self.seen[:] = cv2.resize(seen, size, interpolation=cv2.INTER_NEAREST)
+        self.complete = cv2.countNonZero(self.seen) == self.seen.size
+
+    def _allocate(self, frameShape: tuple) -> None:
+        height, width = frameShape[:2]
+        self.mean = np.zeros((height, width, 3), dtype=np.float32)
+        self.background = np.zeros((height, width, 3), dtype=np.uint8)
+        self.deviation = np.zeros((height, width), dtype=np.float32)
+        self.threshold = np.full((height, width), self.MIN_THRESHOLD, dtype=np.uint8)
+        self.seen = np.zeros((height, width), dtype=np.uint8)
+        self.complete = False
+
+    def _updateThreshold(self, area: tuple) -> None:
+        threshold = self.threshold[area]
+        cv2.convertScaleAbs(self.deviation[area], dst=threshold, alpha=self.DEVIATIONS)
+        cv2.max(threshold, self.MIN_THRESHOLD, dst=threshold)
+
+    def _start(self, currentFrame: np.ndarray, area: tuple) -> None:
+        """Starts the background of the area's pixels that have not been seen yet from the current frame."""
+        seen = self.seen[area]
+        if cv2.countNonZero(seen) == seen.size:
+            return
+        unseen = seen == 0
+        self.background[area][unseen] = currentFrame[unseen]
+        self.mean[area][unseen] = currentFrame[unseen]
+        seen[:] = 255
+        self.complete = cv2.countNonZero(self.seen) == self.seen.size
+
+    def mask(self, prevFrame: np.ndarray, currentFrame: np.ndarray, region: tuple, frameShape: tuple,
+             buffers) -> Optional[np.ndarray]:
+        if cv2.norm(currentFrame, prevFrame, cv2.NORM_INF) == 0:
+            return None
+        if self.mean is None:
+            self._allocate(frameShape)
+        elif self.mean.shape[:2] != tuple(frameShape[:2]):
+            self._rescale(frameShape)
+        x0, y0, x1, y1 = region
+        area = (slice(y0, y1), slice(x0, x1))
+        if not self.complete:
+            self._start(currentFrame, area)
+
+        shape = currentFrame.shape[:2]
+        diffFrame = cv2.absdiff(currentFrame, self.background[area], dst=buffers.get('diff', currentFrame.shape))
+        grayDiffFrame = cv2.cvtColor(diffFrame, cv2.COLOR_BGR2GRAY, dst=buffers.get('gray', shape))
+        motionMask = cv2.compare(grayDiffFrame, self.threshold[area], cv2.CMP_GT, dst=buffers.get('motion', shape))
+
+        # Learn the background and how much it varies, slower where something is moving
+        stillMask = cv2.bitwise_not(motionMask, dst=buffers.get('mask', shape))
+        mean, deviation = self.mean[area], self.deviation[area]
+        for rate, rateMask in ((self.RATE, stillMask), (self.FOREGROUND_RATE, motionMask)):
+            cv2.accumulateWeighted(currentFrame, mean, rate, mask=rateMask)
+        cv2.accumulateWeighted(grayDiffFrame, deviation, self.RATE)
+        cv2.convertScaleAbs(mean, dst=self.background[area])
+        self._updateThreshold(area)
+        return motionMask
+
+
+class ChangeDetector:
+    """
+    Cheap checks on a sparse grid of pixels of two frames, before any full frame work. The grid is finer than
+    the ball, so wherever the ball is it covers one of the grid's pixels. Only frames that are the same on the
+    whole grid count as unchanged - camera noise alone is enough to change a real new frame.
+    """
+
+    SPACING = 6  # Pixels between grid pixels at CAP_RESOLUTION
+    THRESHOLD = FrameDifference.THRESHOLD
+
+    def __init__(self, scale: float=1.0):
+        self.spacing = max(int(self.SPACING * scale), 1)
+        self.prevSample = None
+        self.currentSample = None
+
+    def _sample(self, frame: np.ndarray, dst: Optional[np.ndarray]) -> np.ndarray:
+        height, width = frame.shape[:2]
+        size = (-(-width // self.spacing), -(-height // self.spacing))
+        if dst is None or dst.shape[:2] != (size[1], size[0]):
+            dst = np.empty((size[1], size[0]) + frame.shape[2:], dtype=frame.dtype)
+        return cv2.resize(frame, size, dst=dst, interpolation=cv2.INTER_NEAREST)
+
+    def changed(self, prevFrame: np.ndarray, currentFrame: np.ndarray) -> bool:
+        """Whether any grid pixel differs. The grids are kept for moved."""
+        self.prevSample = self._sample(prevFrame, self.prevSample)
+        self.currentSample = self._sample(currentFrame, self.currentSample)
+        return cv2.norm(self.prevSample, self.currentSample, cv2.NORM_INF) > 0
+
+    def moved(self, y0: int, y1: int) -> bool:
+        """Whether any grid pixel between frame rows y0 and y1 of the last frames checked moved like motion does."""
+        rows = slice(y0 // self.spacing, -(-y1 // self.spacing))
+        diff = cv2.absdiff(self.prevSample[rows], self.currentSample[rows])
+        if diff.ndim == 3:
+            diff = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
+        return int(diff.max(initial=0)) > self.THRESHOLD
+
+
+MOTION_MODELS = {'difference': FrameDifference, 'background': RunningBackground}
@@ -0,0 +1,211 @@
+import json
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
+from typing import Dict, List, Optional, Tuple
+from Setup import LEFT, RIGHT, openStream
+from Ball import Ball, FrameBuffers, pyramidLevelsFor
+from Game import GameState
+from Events import ConsoleSink, EventStream
+
+SIDES = {'left': LEFT, 'right': RIGHT}
+
+# One table to score - source is a camera index or a video path
+TableConfig = namedtuple('TableConfig', ['name', 'source', 'netX', 'servingSide'])
+
+# What the scorer reports about a table besides its game's events - scoring failed with error, or the stream
+# ended with score as (left, right)
+TableStopped = namedtuple('TableStopped', ['time', 'error'])
+StreamEnded = namedtuple('StreamEnded', ['time', 'score'])
+
+
+def loadConfig(path: str) -> List[TableConfig]:
+    """
+    Reads a JSON list of tables, e.g.
+        [{"name": "Table 1", "source": 0, "netX": 320, "server": "left"},
+         {"name": "Table 2", "source": "table2.mp4", "netX": 300, "server": "right"}]
+    """
+    with open(path) as f:
+        entries = json.load(f)
+    configs = []
+    for i, entry in enumerate(entries):
+        configs.append(TableConfig(entry.get('name', 'Table %d' % (i + 1)), entry['source'], int(entry['netX']),
+                                   SIDES[entry['server'].lower()]))
+    if len({config.name for config in configs}) != len(configs):
+        raise ValueError('Table names in %s must be unique.' % path)
+    return configs
+
+
+class _QueueSink:
+    """Hands a table's events to the scorer's queue as (table name, event), to be formatted by whoever reads it."""
+
+    def __init__(self, name: str, events: Queue):
+        self.name = name
+        self.events = events
+
+    def write(self, event) -> None:
+        self.events.put((self.name, event))
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class Table:
+    """
+    The view, Ball and GameState of one table. Only one task works on a table at a time.
+    With idle, frames before a serve are searched in the Ball's idle mode.
+    """
+
+    def __init__(self, config: TableConfig, events: Queue, idle: bool=False):
+        self.name = config.name
+        if isinstance(config.source, int):
+            self.view = openStream(camera=config.source)
+        else:
+            self.view = openStream(loadVideo=config.source)
+        self.view.setNetPos(config.netX)
+        self.ball = Ball(config.netX, servingSide=config.servingSide, buffers=FrameBuffers(self.view.res),
+                         geometry=self.view.geometry, pyramidLevels=pyramidLevelsFor(self.view.res))
+        # Events are handed to the shared queue once per step, not per frame
+        self.gameEvents = EventStream([_QueueSink(self.name, events)])
+        self.game = GameState(self.view, headless=True, events=self.gameEvents)
+        self.game.begin(config.netX, config.servingSide)
+        self.idle = idle
+        self.prevFrame = None
+        self.framesRead = 0
+        self.finished = False
+
+    def step(self, maxFrames: int) -> bool:
+        """Scores up to maxFrames frames, returns False once the stream has ended."""
+        try:
+            return self._step(maxFrames)
+        finally:
+            self.gameEvents.flush()
+
+    def _step(self, maxFrames: int) -> bool:
+        for _ in range(maxFrames):
+            frame = self.view.read()
+            if frame is None:
+                return False
+            self.framesRead += 1
+            # The ball isn't searched for while the game waits for a paddle signal
+            if self.game.state == GameState.STATE_AWAITING_SIGNAL:
+                servingSide = self.game.updateSignal(frame)
+                if servingSide is not None:
+                    self.ball.netSide = servingSide
+                self.prevFrame = frame
+                continue
+            idle = self.idle and self.game.state == GameState.STATE_PRE_SERVE
+            if self.ball.updatePosFromFrame(self.prevFrame, frame, showProcessedFrame=False, showMaskFrame=False,
+                                            idle=idle):
+                self.ball.updateProcessedData(output=False)
+                self.game.updateState(self.ball, output=False)
+            self.prevFrame = frame
+        return True
+
+
+class MultiTableScorer:
+    """
+    Scores several tables in one process. Each table's frames are processed in order by one task at a time,
+    while the tasks of all tables share one thread pool - OpenCV releases the GIL, so this scales with cores.
+    """
+
+    def __init__(self, configs: List[TableConfig], workers: Optional[int]=None, framesPerTask: int=4,
+                 idle: bool=False):
+        self.events = Queue()  # (table name, event) from every table
+        self.tables = [Table(config, self.events, idle) for config in configs]
+        self.framesPerTask = framesPerTask
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='table')
+        self.stopEvent = threading.Event()
+        self.doneEvent = threading.Event()
+        self._lock = threading.Lock()
+        self._running = 0
+
+    def start(self):
+        with self._lock:
+            self._running = len(self.tables)
+        for table in self.tables:
+            self._schedule(table)
+
+    def wait(self, timeout: Optional[float]=None) -> bool:
+        """Blocks until every table's stream has ended (or the scorer was stopped)."""
+        return self.doneEvent.wait(timeout)
+
+    def stop(self):
+        self.stopEvent.set()
+        self.wait()
+        self.pool.shutdown()
+
+    def scores(self) -> Dict[str, List[int]]:
+        return {table.name: list(table.game.score) for table in self.tables}
+
+    def servingSides(self) -> Dict[str, Optional[int]]:
+        return {table.name: table.game.servingSide for table in self.tables}
+
+    def pollEvents(self) -> List[Tuple[str, tuple]]:
+        """
+        Every (table name, event) since the last poll, in the order they happened - the tables' game events and
+        TableStopped or StreamEnded when a table is done.
+        """
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except Empty:
+                return events
+
+    def _schedule(self, table: Table):
+        if self.stopEvent.is_set():
+            self._finish(table)
+            return
+        self.pool.submit(self._run, table)
+
+    def _run(self, table: Table):
+        try:
+            hasMore = table.step(self.framesPerTask)
+        except Exception as e:
+            self.events.put((table.name, TableStopped(time.time(), e)))
+            self._finish(table)
+            return
+        if hasMore:
+            self._schedule(table)
+        else:
+            self.events.put((table.name, StreamEnded(time.time(), tuple(table.game.score))))
+            self._finish(table)
+
+    def _finish(self, table: Table):
+        table.finished = True
+        with self._lock:
+            self._running -= 1
+            if self._running == 0:
+                self.doneEvent.set()
+
+
+def scoreTables(configPath: str, workers: Optional[int]=None, idle: bool=False):
+    """Scores every table in the config, printing their events as they come in."""
+    scorer = MultiTableScorer(loadConfig(configPath), workers, idle=idle)
+    # Each table's game clock is kept by a console of its own
+    consoles = {table.name: ConsoleSink(output=lambda message, name=table.name: print('%s: %s' % (name, message)))
+                for table in scorer.tables}
+
+    def printEvents():
+        for name, event in scorer.pollEvents():
+            if isinstance(event, TableStopped):
+                print('%s: Stopped scoring: %r' % (name, event.error))
+            elif isinstance(event, StreamEnded):
+                print('%s: Stream ended, final score %s' % (name, list(event.score)))
+            else:
+                consoles[name].write(event)
+
+    scorer.start()
+    try:
+        while not scorer.wait(0.2):
+            printEvents()
+    finally:
+        scorer.stop()
+    printEvents()
+    print('Final scores: %s' % scorer.scores())
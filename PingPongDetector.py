@@ -1,14 +1,20 @@
 import cv2
-from imutils.video import VideoStream
 import argparse
 import time
 from queue import Queue
-from typing import Optional, Union
-from Setup import NET_HIT_BUFFER, NET_VIEW_BUFFER, TABLE_END_BUFFER, \
-    display, getSideSignal, getDisplay, GameViewSource, other
-from Ball import Ball
+from typing import Optional
+from Setup import Scoreboard, GameViewSource, LEFT, RIGHT, openStream
+from Ball import Ball, FrameBuffers, pyramidLevelsFor
 from Game import GameState
-from copy import copy
+from Hypotheses import HypothesisTracker
+from Events import ConsoleSink, EventStream, openEventLog
+from Pipeline import ScoringPipeline, DROP_OLDEST, DROP_POLICIES
+from Motion import MOTION_MODELS, RunningBackground
+from Trajectory import TrajectoryWriter
+from Rewind import RewindBuffer
+from time import perf_counter
+from Profiling import PROFILER
+from Display import DisplayThread
 import numpy as np
 
 
@@ -18,10 +24,68 @@ def setupArguments():
     ap.add_argument("-f", "--writeFrame", default=False, action='store_true', help="Write masked image to output.avi")
     ap.add_argument("-m", "--writeMasked", default=False, action='store_true')
     ap.add_argument("-s", "--speed", default=1.0, type=float, help="Adjust the speed of playback")
+    ap.add_argument("-q", "--queueSize", default=8, type=int, help="Frames buffered between pipeline stages")
+    ap.add_argument("-d", "--dropPolicy", default='drop-oldest', choices=sorted(DROP_POLICIES),
+                    help="What to do with new frames when the vision stage falls behind")
+    ap.add_argument("-t", "--trajectory", default=None, help="Save the ball trajectory to this .npy file")
+    ap.add_argument("-p", "--profile", default=False, action='store_true', help="Time every stage of the hot path")
+    ap.add_argument("-y", "--pyramid", default=None, type=int,
+                    help="Times to halve frames before searching them (default: down to about 640 wide)")
+    ap.add_argument("-w", "--visionProcess", default=False, action='store_true',
+                    help="Run the vision stage in its own process, passing frames through shared memory")
+    ap.add_argument("-b", "--motion", default='difference', choices=sorted(MOTION_MODELS),
+                    help="Motion against the previous frame or against a background learned from the scene")
+    ap.add_argument("-e", "--events", default=None,
+                    help="Log game events to this file - JSON lines for .jsonl paths, binary records otherwise")
+    ap.add_argument("-a", "--hypotheses", default=False, action='store_true',
+                    help="Follow both readings of an ambiguous bounce until the rally decides it")
+    ap.add_argument("-r", "--rewind", default=180.0, type=float,
+                    help="Seconds of the game kept for correcting calls from the scoreboard (0 to keep none, "
+                         "not used with --hypotheses)")
+    ap.add_argument("-i", "--idle", default=False, action='store_true',
+                    help="Before a serve, only search frames where something moved near the table")
+    commands = ap.add_subparsers(dest="command")
+    scoreFileArgs = commands.add_parser("score-file", help="Score a recorded match without any windows")
+    scoreFileArgs.add_argument("path", help="Recorded video to score")
+    scoreFileArgs.add_argument("--netX", required=True, type=int, help="X position of the net in the video")
+    scoreFileArgs.add_argument("--server", required=True, choices=('left', 'right'), help="Side serving first")
+    scoreFileArgs.add_argument("--workers", default=None, type=int, help="Vision processes (default: all cores)")
+    scoreFileArgs.add_argument("--chunkSeconds", default=30.0, type=float, help="Video handed to a worker at once")
+    scoreFileArgs.add_argument("--keyframeInterval", default=0, type=int,
+                               help="GOP length of the recording, chunks start on multiples of it")
+    scoreFileArgs.add_argument("--trajectory", default=None, help="Save the ball trajectory to this .npy file")
+    scoreFileArgs.add_argument("--hypotheses", default=False, action='store_true',
+                               help="Resolve ambiguous bounces from the rally instead of paddle signals")
+    scoreFileArgs.add_argument("--batchFrames", default=0, type=int,
+                               help="Compute the masks of this many frames at once (default: frame by frame)")
+    multiTableArgs = commands.add_parser("multi-table", help="Score several tables from one process")
+    multiTableArgs.add_argument("config", help="JSON list of tables with their source, netX and server")
+    multiTableArgs.add_argument("--workers", default=None, type=int, help="Vision threads shared by all tables")
     return vars(ap.parse_args())
 
 
-def userSetupScene(view: GameViewSource) -> int:
+def learnScene(view: GameViewSource, firstFrame: np.ndarray, frames: int=30) -> RunningBackground:
+    """
+    Learns the background of the empty scene from the frame the net is placed on and the ones after it.
+    Recordings are rewound afterwards, so scoring still starts right after the first frame.
+    """
+    if view.isVideo:
+        startPos = view.stream.get(cv2.CAP_PROP_POS_FRAMES)
+    sceneFrames = [firstFrame.copy()]
+    while len(sceneFrames) < frames:
+        frame = view.read()
+        if frame is None:
+            break
+        sceneFrames.append(frame)
+    if view.isVideo:
+        view.stream.set(cv2.CAP_PROP_POS_FRAMES, startPos)
+    background = RunningBackground()
+    background.learn(sceneFrames)
+    return background
+
+
+def userSetupScene(view: GameViewSource, learnBackground: bool=False) -> int:
+    """Asks the user where the net is. With learnBackground, the empty scene is learned from the frames after it."""
     WINDOW_NAME = 'Setup Scene'
     BLUE = (255, 0, 0)
     WHITE = (255, 255, 255)
@@ -33,13 +97,16 @@ def userSetupScene(view: GameViewSource) -> int:
 
     # Read scene img from stream
     frame = view.read()
-    height, width = frame.shape[:2]
-    print("Detected image is %d high" % height)
 
     # End of video
     if frame is None:
         print("Stream ended.")
         exit(-1)
+    height, width = frame.shape[:2]
+    print("Detected image is %d high" % height)
+    geometry = view.geometry
+    if learnBackground:
+        view.background = learnScene(view, frame)
 
     cv2.namedWindow(WINDOW_NAME)
 
@@ -59,16 +126,16 @@ def userSetupScene(view: GameViewSource) -> int:
             # Show net boundary
             cv2.line(frame, (netX, height), (netX, 0), BLUE, 2)
             # Show net hit buffer
-            cv2.line(frame, (netX + NET_HIT_BUFFER, height), (netX + NET_HIT_BUFFER, 0), WHITE, 2)
-            cv2.line(frame, (netX - NET_HIT_BUFFER, height), (netX - NET_HIT_BUFFER, 0), WHITE, 2)
+            cv2.line(frame, (netX + geometry.netHitBuffer, height), (netX + geometry.netHitBuffer, 0), WHITE, 2)
+            cv2.line(frame, (netX - geometry.netHitBuffer, height), (netX - geometry.netHitBuffer, 0), WHITE, 2)
             # Show net view buffer
-            cv2.line(frame, (netX + NET_VIEW_BUFFER, height), (netX + NET_VIEW_BUFFER, 0), RED, 2)
-            cv2.line(frame, (netX - NET_VIEW_BUFFER, height), (netX - NET_VIEW_BUFFER, 0), RED, 2)
+            cv2.line(frame, (netX + geometry.netViewBuffer, height), (netX + geometry.netViewBuffer, 0), RED, 2)
+            cv2.line(frame, (netX - geometry.netViewBuffer, height), (netX - geometry.netViewBuffer, 0), RED, 2)
             # Show table end buffer
-            cv2.line(frame, (netX + TABLE_END_BUFFER, height), (netX + TABLE_END_BUFFER, 0), BLACK, 2)
-            cv2.line(frame, (netX - TABLE_END_BUFFER, height), (netX - TABLE_END_BUFFER, 0), BLACK, 2)
+            cv2.line(frame, (netX + geometry.tableEndBuffer, height), (netX + geometry.tableEndBuffer, 0), BLACK, 2)
+            cv2.line(frame, (netX - geometry.tableEndBuffer, height), (netX - geometry.tableEndBuffer, 0), BLACK, 2)
             # Show signal line
-            cv2.line(frame, (0, 3*height//5), (width, 3*height//5), (255, 255, 0), 2)
+            cv2.line(frame, (0, geometry.signalLine), (width, geometry.signalLine), (255, 255, 0), 2)
 
             print("The X position of the net has been set to: %d" % netX)
             startEnd = time.time()
@@ -81,134 +148,130 @@ def userSetupScene(view: GameViewSource) -> int:
                 return netX
 
 
-class GameMonitor:
-
-    def __init__(self, oldGameState: GameState):
-        self.oldGameState = copy(oldGameState)
-        self.currentGame = oldGameState
-        self.timeSinceRoundChange = time.time()
-        self.gameClockOn = False
-
-    def printWithTime(self, *args):
-        timeMsg = ('[%04d]' % int(time.time() - self.timeSinceRoundChange)) if self.gameClockOn else '[STOP]'
-        print(timeMsg, *args)
-
-    def printNewEvents(self):
-        # If new score
-        if self.oldGameState.score != self.currentGame.score:
-            self.printWithTime('%s has scored! Score is now: %s' %
-                               (('Left' if self.currentGame.score[0] != self.oldGameState.score[0] else 'Right'),
-                                str(self.currentGame.score)))
-
-        # If the game has changed states
-        if self.oldGameState.state != self.currentGame.state:
-            stateMsg = ", "
-            if self.currentGame.state == GameState.STATE_AMBIGUOUS_BOUNCE:
-                stateMsg += 'on the %s' % display(self.currentGame.ambiguousBounceSide)
-            elif self.currentGame.state == GameState.STATE_FREE_BALL:
-                stateMsg += 'from the %s' % display(self.currentGame.freeBallFrom)
-            elif self.currentGame.state == GameState.STATE_EXPECTING_RESPONSE:
-                stateMsg += 'expecting %s to respond' % display(self.currentGame.expectingResponseFrom)
-            elif self.currentGame.state == GameState.STATE_PRE_SERVE:
-                if self.oldGameState.state == GameState.STATE_AMBIGUOUS_BOUNCE:
-                    stateMsg += 'ambiguity resolved, ' % display(self.currentGame.servingSide)
-                stateMsg += '%s is serving' % display(self.currentGame.servingSide)
-                if not self.currentGame.serveCrossedNet:
-                    # print('Game clock off')
-                    self.gameClockOn = False
-            self.printWithTime('State is now %s%s' % (self.currentGame.STATE_TO_NAME[self.currentGame.state], stateMsg))
-        # If the game is giving the server an extra try
-        elif self.oldGameState.givenSecondTry != self.currentGame.givenSecondTry:
-            self.printWithTime('Giving server second try')
-        # Serve crossed net
-        elif self.oldGameState.serveCrossedNet != self.currentGame.serveCrossedNet:
-            if self.currentGame.serveCrossedNet:
-                self.gameClockOn = True
-                self.timeSinceRoundChange = time.time()
-                self.printWithTime('Serve crossed net to the %s side, round has started' % display(other(self.currentGame.servingSide)))
-
-        self.oldGameState = copy(self.currentGame)
-
-    def getGameDisplay(self) -> Optional[np.ndarray]:
-        if self.currentGame.currentDisplay is not None:
-            return self.currentGame.currentDisplay
-        return None
-
-
-def scoreGame(view: GameViewSource, showDisplay: bool=False, showFullDisplay: bool=False, slowDown: int=1):
-    """The main game function."""
-
-    prevFrame = None
-
-    if showFullDisplay:
-        cv2.namedWindow("window", cv2.WND_PROP_FULLSCREEN)
-        cv2.setWindowProperty("window", cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
-
-    servingSide = getSideSignal(view, [0, 0], showFullDisplay)
-    if servingSide is None:
-        print('Quiting...')
-        exit(-1)
-
-    ball = Ball(view.netX, servingSide=servingSide)
-    game = GameState(view)
-    game.begin(view.netX, servingSide)
-    CURRENT_DISPLAY = getDisplay(game.score, servingSide)
-    print('Got serving side')
-
-    gameMonitor = GameMonitor(game)
-
-    while True:
-        frame = view.read()
-
-        # End of video
-        if frame is None:
-            print("Stream ended.")
-            break
-
-        if ball.updatePosFromFrame(prevFrame, frame, showProcessedFrame=False, showMaskFrame=False):
-            ball.updateProcessedData(output=False)
-            game.updateState(ball, output=False)
-
-            gameMonitor.printNewEvents()
-
-            if showDisplay:
-                key = cv2.waitKey(int(1000 / view.fps * (slowDown if slowDown != -1 else 1.0)))
+def scoreGame(view: GameViewSource, showDisplay: bool=False, showFullDisplay: bool=False, slowDown: int=1,
+              queueSize: int=8, dropPolicy: int=DROP_OLDEST, trajectoryPath: Optional[str]=None,
+              pyramidLevels: Optional[int]=None, visionProcess: bool=False, motion: str='difference',
+              idle: bool=False, eventLogPath: Optional[str]=None, hypotheses: bool=False, rewindSeconds: float=0.0):
+    """
+    The main game function. The game starts by waiting for a paddle signal of who serves, which is looked for
+    in the frames coming out of the pipeline like any other wait for one.
+    With idle, frames before a serve are searched in the Ball's idle mode. With hypotheses, ambiguous bounces are
+    resolved by what the ball does next instead of by a paddle signal.
+    Game events are printed, and logged to eventLogPath if given, from a thread of their own.
+    With rewindSeconds, that much of the game is kept so calls can be corrected from the scoreboard window:
+    l or r gives the rally to the left or right side, u gives the last point to the other side.
+    """
+
+    # From here on the display thread owns every window
+    displayThread = None
+    if showDisplay or showFullDisplay:
+        cv2.destroyAllWindows()
+        displayThread = DisplayThread(showScoreboard=showFullDisplay, showDebug=showDisplay)
+        displayThread.showScoreboard(Scoreboard((0, 0), None))
+        displayThread.start()
+
+    motionModel = MOTION_MODELS[motion]()
+    if motion == 'background' and view.background is not None:
+        motionModel = view.background  # Learned from the empty scene during setup
+    ball = Ball(view.netX, buffers=FrameBuffers(view.res), geometry=view.geometry,
+                pyramidLevels=pyramidLevels if pyramidLevels is not None else pyramidLevelsFor(view.res),
+                motionModel=motionModel)
+    events = EventStream([ConsoleSink()])
+    if eventLogPath:
+        events.addSink(openEventLog(eventLogPath))
+    events.start()
+    game = GameState(view, events=events)
+    game.begin(view.netX)
+    rewind = None
+    if hypotheses:
+        game = HypothesisTracker(game)
+    elif rewindSeconds > 0:
+        rewind = RewindBuffer(game, int(rewindSeconds * (view.fps or 30)))
+
+    trajectory = TrajectoryWriter() if trajectoryPath else None
+    lastDisplay = None
+
+    # Capture and vision run on their own threads (or vision in its own process), the game stage runs here
+    pipeline = ScoringPipeline(view, ball, queueSize=queueSize, dropPolicy=dropPolicy, visionProcess=visionProcess)
+    pipeline.start()
+    nextFrameTime = time.perf_counter()
+
+    try:
+        for frameIndex, frame, ballObservation in pipeline.results():
+            prof = PROFILER if PROFILER.enabled else None
+            if trajectory is not None:
+                trajectory.write(frameIndex, ballObservation)
+            if prof: t = perf_counter()
+            # Observations are ignored while waiting for a signal - the ball isn't in play
+            servingSide = None
+            if game.state == GameState.STATE_AWAITING_SIGNAL:
+                servingSide = game.updateSignal(frame)
+                if servingSide is not None:
+                    pipeline.setServingSide(servingSide)
+            else:
+                game.updateState(ballObservation, output=False)
+            if rewind is not None and rewind.record(frameIndex, ballObservation, servingSide):
+                if game.state == GameState.STATE_PRE_SERVE:
+                    pipeline.setServingSide(game.servingSide)
+            if idle:
+                pipeline.setIdle(game.state in (GameState.STATE_PRE_SERVE, GameState.STATE_AWAITING_SIGNAL))
+            if prof: prof.lap('state', t)
+
+            if displayThread is not None:
+                if prof: t = perf_counter()
+                newDisplay = game.currentDisplay
+                if newDisplay is not None and newDisplay != lastDisplay:
+                    displayThread.showScoreboard(newDisplay)
+                    lastDisplay = newDisplay
+                if pipeline.ring is not None and displayThread.showDebugWindow:
+                    # A ring slot is reused as soon as the next result is asked for, so the display gets a copy
+                    frame = frame.copy()
+                displayThread.showDebugFrame(frame, ballObservation)
+                if prof: prof.lap('display', t)
+                key = displayThread.pollKey()
                 if key == ord('q'):
                     print('Quiting.')
-                    exit(0)
+                    break
+                if rewind is not None and key in (ord('l'), ord('r'), ord('u')):
+                    try:
+                        if key == ord('u'):
+                            rewind.overturnLastPoint()
+                        else:
+                            rewind.awardPoint(LEFT if key == ord('l') else RIGHT)
+                    except ValueError as e:
+                        print('Can\'t correct the score: %s' % e)
+
+            # Play back at the stream's frame rate (or slowed down) while debugging
+            if showDisplay:
                 if slowDown == -1:
                     input('>')
-
-            if showFullDisplay:
-                newDisplay = gameMonitor.getGameDisplay()
-                if newDisplay is not None:
-                    CURRENT_DISPLAY = newDisplay
-                cv2.imshow('window', CURRENT_DISPLAY)
-                if cv2.waitKey(1) == ord('q'):
-                    break
-
-        prevFrame = frame
-
-
-def loadStream(res: tuple=(640,480), fps: int=30, loadVideo: Optional[str]=None, startFrame: Optional[int]=None) -> GameViewSource:
-    # Load from video or from webcam
-    if not loadVideo:
-        stream = VideoStream(src=0, resolution=res, framerate=fps).start()
-        time.sleep(2)
-        fps = stream.stream.get(cv2.CAP_PROP_FPS)
-        res = (int(stream.stream.get(cv2.CAP_PROP_FRAME_WIDTH)), int(stream.stream.get(cv2.CAP_PROP_FRAME_HEIGHT)))
-        gameViewSource = GameViewSource(stream, False, res)
-    else:
-        stream = cv2.VideoCapture(loadVideo)
-        fps = stream.get(cv2.CAP_PROP_FPS)
-        if startFrame:
-            stream.set(cv2.CAP_PROP_POS_FRAMES, startFrame)
-        res = (int(stream.get(cv2.CAP_PROP_FRAME_WIDTH)), int(stream.get(cv2.CAP_PROP_FRAME_HEIGHT)))
-        gameViewSource = GameViewSource(stream, True, res)
-    print("Stream:\n\tFPS - %d\n\tResolution: (%d, %d)" % (fps, res[0], res[1]))
+                else:
+                    nextFrameTime += slowDown / view.fps
+                    time.sleep(max(0.0, nextFrameTime - time.perf_counter()))
+        else:
+            print("Stream ended.")
+    finally:
+        pipeline.stop()
+        if rewind is not None:
+            rewind.close()
+        events.close()
+        if displayThread is not None:
+            displayThread.stop()
+        if trajectory is not None:
+            trajectory.save(trajectoryPath)
+
+    if pipeline.droppedFrames():
+        print('Dropped %d frames while the vision stage was behind' % pipeline.droppedFrames())
+    if PROFILER.enabled:
+        PROFILER.printSummary()
+
+
+def loadStream(res: tuple=(640,480), fps: int=30, loadVideo: Optional[str]=None, startFrame: Optional[int]=None,
+               learnBackground: bool=False) -> GameViewSource:
+    gameViewSource = openStream(res, fps, loadVideo, startFrame)
 
     # Setup net
-    netX = userSetupScene(gameViewSource)
+    netX = userSetupScene(gameViewSource, learnBackground)
     gameViewSource.setNetPos(netX)
     print("Got net x: %d" % netX)
 
@@ -218,6 +281,20 @@ def loadStream(res: tuple=(640,480), fps: int=30, loadVideo: Optional[str]=None,
 
 if __name__ == '__main__':
     trackingArgs = setupArguments()
+    if trackingArgs['profile']:
+        PROFILER.enable()
+    if trackingArgs['command'] == 'score-file':
+        from BatchScoring import scoreFile
+        scoreFile(trackingArgs['path'], trackingArgs['netX'], LEFT if trackingArgs['server'] == 'left' else RIGHT,
+                  workers=trackingArgs['workers'], chunkSeconds=trackingArgs['chunkSeconds'],
+                  keyframeInterval=trackingArgs['keyframeInterval'], trajectoryPath=trackingArgs['trajectory'],
+                  batchFrames=trackingArgs['batchFrames'], pyramidLevels=trackingArgs['pyramid'],
+                  hypotheses=trackingArgs['hypotheses'])
+        exit(0)
+    if trackingArgs['command'] == 'multi-table':
+        from MultiTable import scoreTables
+        scoreTables(trackingArgs['config'], workers=trackingArgs['workers'], idle=trackingArgs['idle'])
+        exit(0)
     trackingArgs['video'] = None
     trackingArgs['startFrame'] = 0
     trackingArgs['writeFrame'] = False
@@ -230,5 +307,10 @@ if __name__ == '__main__':
     trackingArgs['debugWrite'] = False
     trackingArgs['slowDown'] = 1.0
     trackingArgs['fullDisplay'] = False
-    view = loadStream()
-    scoreGame(view, showFullDisplay=True)
+    # Only the background motion model uses the empty scene, which takes frames to learn
+    view = loadStream(learnBackground=trackingArgs['motion'] == 'background')
+    scoreGame(view, showFullDisplay=True, queueSize=trackingArgs['queueSize'],
+              dropPolicy=DROP_POLICIES[trackingArgs['dropPolicy']], trajectoryPath=trackingArgs['trajectory'],
+              pyramidLevels=trackingArgs['pyramid'], visionProcess=trackingArgs['visionProcess'],
+              motion=trackingArgs['motion'], idle=trackingArgs['idle'], eventLogPath=trackingArgs['events'],
+              hypotheses=trackingArgs['hypotheses'], rewindSeconds=trackingArgs['rewind'])
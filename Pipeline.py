@@ -0,0 +1,272 @@
+import multiprocessing
+import threading
+from queue import Queue, Full, Empty
+from typing import Callable, Iterator, Optional, Tuple
+import numpy as np
+from Setup import GameViewSource
+from Ball import Ball, BallObservation
+from FrameRing import FrameRing
+
+# What to do when a stage produces faster than the next one consumes
+DROP_OLDEST = 0
+BLOCK = 1
+DROP_POLICIES = {'drop-oldest': DROP_OLDEST, 'block': BLOCK}
+
+# Marks the end of the stream in a queue
+END_OF_STREAM = None
+# No serving side waiting to be handed to the vision stage
+NO_SIDE = -1
+
+
+class FrameQueue:
+    """Bounded queue joining two pipeline stages."""
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, maxsize: int, dropPolicy: int=DROP_OLDEST, processes: bool=False,
+                 onDrop: Optional[Callable[[object], None]]=None):
+        if maxsize < 1:
+            raise ValueError('A frame queue needs room for at least one item.')
+        # A process queue joins stages in different processes
+        self.queue = multiprocessing.Queue(maxsize) if processes else Queue(maxsize)
+        self.dropPolicy = dropPolicy
+        self.onDrop = onDrop  # Called with every dropped item, e.g. to free what it holds
+        self.dropped = 0
+
+    def put(self, item, stopEvent: threading.Event) -> bool:
+        """Returns False if the pipeline was stopped before the item could be queued."""
+        if self.dropPolicy == BLOCK:
+            while not stopEvent.is_set():
+                try:
+                    self.queue.put(item, timeout=self.POLL_INTERVAL)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        # Drop oldest - make room by throwing away whatever has waited the longest
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return True
+            except Full:
+                try:
+                    dropped = self.queue.get_nowait()
+                    self.dropped += 1
+                    if self.onDrop is not None:
+                        self.onDrop(dropped)
+                except Empty:
+                    pass
+
+    def get(self, stopEvent: threading.Event):
+        while not stopEvent.is_set():
+            try:
+                return self.queue.get(timeout=self.POLL_INTERVAL)
+            except Empty:
+                pass
+        return END_OF_STREAM
+
+    def __getstate__(self):
+        # Only the producer drops items, so a consumer in another process has no use for onDrop
+        state = self.__dict__.copy()
+        state['onDrop'] = None
+        return state
+
+    def depth(self) -> int:
+        try:
+            return self.queue.qsize()
+        except NotImplementedError:  # Process queues on macOS
+            return -1
+
+    def drain(self) -> list:
+        """Takes every item left in the queue."""
+        items = []
+        while True:
+            try:
+                items.append(self.queue.get_nowait())
+            except Empty:
+                return items
+
+
+class ScoringPipeline:
+    """
+    Splits scoring into a capture thread, a vision thread and the game/display stage on the caller's thread.
+    Frames may be dropped between capture and vision, but the vision thread is the only owner of the Ball
+    and hands results on in frame order, so GameState always sees observations in order.
+
+    With visionProcess the vision stage runs in its own process instead, on a copy of the Ball. Frames are
+    then decoded straight into the slots of a shared FrameRing and only slot indices go through the queues.
+    Each stage holds a reference on the slots it still reads: the queues on what they carry, the vision stage
+    on its previous and current frames and the game stage on the frame of its current result.
+    The game stage can put the vision stage into the Ball's idle mode with setIdle, e.g. before a serve, and
+    tell it which side serves next with setServingSide.
+    """
+
+    JOIN_TIMEOUT = 5.0
+
+    def __init__(self, view: GameViewSource, ball: Ball, queueSize: int=8, dropPolicy: int=DROP_OLDEST,
+                 visionProcess: bool=False):
+        self.view = view
+        self.ball = ball
+        self.ring = None
+        if visionProcess:
+            # Every slot that can be referenced at once - both queues, one being captured,
+            # the vision stage's two and the game stage's one
+            self.ring = FrameRing(view.res, 2 * queueSize + 4)
+            self.frames = FrameQueue(queueSize, dropPolicy, processes=True,
+                                     onDrop=self._releaseDropped)
+            self.observations = FrameQueue(queueSize, BLOCK, processes=True)
+            self.stopEvent = multiprocessing.Event()
+            self.idleEvent = multiprocessing.Event()
+            self.servingSide = multiprocessing.Value('i', NO_SIDE)
+            self.visionThread = multiprocessing.Process(target=_visionProcess, name='vision', daemon=True,
+                                                        args=(ball, self.ring, self.frames, self.observations,
+                                                              self.stopEvent, self.idleEvent, self.servingSide))
+        else:
+            self.frames = FrameQueue(queueSize, dropPolicy)
+            self.observations = FrameQueue(queueSize, BLOCK)
+            self.stopEvent = threading.Event()
+            self.idleEvent = threading.Event()
+            self.servingSide = multiprocessing.Value('i', NO_SIDE)
+            self.visionThread = threading.Thread(target=self._vision, name='vision', daemon=True)
+        self.captureThread = threading.Thread(target=self._capture, name='capture', daemon=True)
+
+    def start(self):
+        self.captureThread.start()
+        self.visionThread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.captureThread.is_alive() and self.captureThread is not threading.current_thread():
+            self.captureThread.join()
+        if self.ring is None:
+            if self.visionThread.is_alive() and self.visionThread is not threading.current_thread():
+                self.visionThread.join()
+            return
+        # The vision process can't exit while what it queued is unread
+        self.frames.drain()
+        self.observations.drain()
+        self.visionThread.join(self.JOIN_TIMEOUT)
+        if self.visionThread.is_alive():
+            self.visionThread.terminate()
+        self.ring.close()
+
+    def setIdle(self, idle: bool) -> None:
+        """Whether frames from now on are searched in idle mode, see Ball.updatePosFromFrame."""
+        if idle:
+            self.idleEvent.set()
+        else:
+            self.idleEvent.clear()
+
+    def setServingSide(self, side: int) -> None:
+        """The Ball takes the ball to be on this side from the next frame it searches, as for a new serve."""
+        self.servingSide.value = side
+
+    def queueDepths(self) -> dict:
+        return {'capture': self.frames.depth(), 'vision': self.observations.depth()}
+
+    def droppedFrames(self) -> int:
+        return self.frames.dropped
+
+    def results(self) -> Iterator[Tuple[int, np.ndarray, BallObservation]]:
+        """
+        Yields (frame index, frame, ball observation) for every processed frame until the stream ends.
+        With a vision process the frame is a ring slot, only valid until the next result is asked for.
+        """
+        lastIndex = -1
+        while True:
+            item = self.observations.get(self.stopEvent)
+            if item is END_OF_STREAM:
+                return
+            if item[0] <= lastIndex:
+                raise RuntimeError('Frame %d reached the game stage after frame %d.' % (item[0], lastIndex))
+            lastIndex = item[0]
+            if self.ring is None:
+                yield item
+                continue
+            frameIndex, slot, ballObservation = item
+            try:
+                yield frameIndex, self.ring.frame(slot), ballObservation
+            finally:
+                self.ring.release(slot)
+
+    def _releaseDropped(self, item):
+        if item is not END_OF_STREAM:
+            self.ring.release(item[1])
+
+    def _capture(self):
+        frameIndex = 0
+        while not self.stopEvent.is_set():
+            if self.ring is None:
+                frame = self.view.read()
+                if frame is None:
+                    break
+                item = (frameIndex, frame)
+            else:
+                slot = self.ring.acquire(timeout=FrameQueue.POLL_INTERVAL)
+                if slot is None:
+                    continue  # Every slot is still in use downstream
+                if self.view.read(self.ring.frame(slot)) is None:
+                    self.ring.release(slot)
+                    break
+                item = (frameIndex, slot)
+            if not self.frames.put(item, self.stopEvent):
+                return
+            frameIndex += 1
+        self.frames.put(END_OF_STREAM, self.stopEvent)
+
+    def _vision(self):
+        prevFrame = None
+        while True:
+            item = self.frames.get(self.stopEvent)
+            if item is END_OF_STREAM:
+                break
+            frameIndex, frame = item
+            _takeServingSide(self.ball, self.servingSide)
+            if self.ball.updatePosFromFrame(prevFrame, frame, showProcessedFrame=False, showMaskFrame=False,
+                                            idle=self.idleEvent.is_set()):
+                self.ball.updateProcessedData(output=False)
+                if not self.observations.put((frameIndex, frame, self.ball.observe()), self.stopEvent):
+                    return
+            prevFrame = frame
+        self.observations.put(END_OF_STREAM, self.stopEvent)
+
+
+def _takeServingSide(ball: Ball, servingSide: multiprocessing.Value):
+    """Hands a serving side set by the game stage on to the Ball, once."""
+    if servingSide.value == NO_SIDE:
+        return
+    with servingSide.get_lock():
+        ball.netSide, servingSide.value = servingSide.value, NO_SIDE
+
+
+def _visionProcess(ball: Ball, ring: FrameRing, frames: FrameQueue, observations: FrameQueue,
+                   stopEvent: multiprocessing.Event, idleEvent: multiprocessing.Event,
+                   servingSide: multiprocessing.Value):
+    """The vision stage of a ScoringPipeline in its own process, reading frames from the ring's slots."""
+    Ball.COLORS.table  # Build the lookup table before the first frame arrives
+    prevSlot = None
+    stopped = False
+    while not stopped:
+        item = frames.get(stopEvent)
+        if item is END_OF_STREAM:
+            break
+        frameIndex, slot = item
+        prevFrame = ring.frame(prevSlot) if prevSlot is not None else None
+        _takeServingSide(ball, servingSide)
+        if ball.updatePosFromFrame(prevFrame, ring.frame(slot), showProcessedFrame=False, showMaskFrame=False,
+                                   idle=idleEvent.is_set()):
+            ball.updateProcessedData(output=False)
+            # The game stage gets a reference of its own, the vision stage keeps this one for the next frame
+            ring.retain(slot)
+            if not observations.put((frameIndex, slot, ball.observe()), stopEvent):
+                ring.release(slot)  # The game stage's, which it never got
+                stopped = True
+        # Still rotated when stopping, so the vision stage's own reference is released below
+        if prevSlot is not None:
+            ring.release(prevSlot)
+        prevSlot = slot
+    if prevSlot is not None:
+        ring.release(prevSlot)
+    observations.put(END_OF_STREAM, stopEvent)
+    ring.close()
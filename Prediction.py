@@ -0,0 +1,228 @@
+from collections import namedtuple
+from typing import Optional, Tuple
+import cv2
+import numpy as np
+from Setup import CAP_RESOLUTION
+
+# Where the ball should be in the next frame.
+# sigma is the (x, y) standard deviation of the guess and reach how far from it (x, y) the ball may be found,
+# both in pixels - None for predictors that have no idea of their uncertainty.
+Prediction = namedtuple('Prediction', ['pos', 'sigma', 'reach'])
+
+# (x0, y0, x1, y1) search window in frame coordinates
+Window = Tuple[int, int, int, int]
+
+# Stand-in for a missing point in snapshot records
+NO_POINT = np.iinfo(np.int32).min
+
+
+def encodePoint(point: Optional[tuple]) -> tuple:
+    return (NO_POINT, NO_POINT) if point is None else point
+
+
+def decodePoint(field: np.ndarray) -> Optional[tuple]:
+    x, y = field.tolist()
+    return None if x == NO_POINT else (x, y)
+
+
+def _clipWindow(x0: int, y0: int, x1: int, y1: int, frameShape: tuple) -> Window:
+    height, width = frameShape[:2]
+    return min(max(x0, 0), width), min(max(y0, 0), height), min(max(x1, 0), width), min(max(y1, 0), height)
+
+
+class DisplacementPredictor:
+    """
+    The original search window - the ball is expected one displacement ahead of its last position, inside a box
+    padded by its speed. Only predicts while the ball is being found every frame.
+    """
+
+    RECORD_DTYPE = np.dtype([('pos', '<i4', 2), ('lastPos', '<i4', 2), ('lastDisp', '<i4', 2)])
+
+    def __init__(self):
+        self.pos = None
+        self.lastPos = None
+        self.lastDisp = None
+
+    def reset(self) -> None:
+        self.__init__()
+
+    def predict(self) -> Optional[Prediction]:
+        if self.lastDisp is None or self.pos is None:
+            return None
+        return Prediction((self.lastPos[0] + self.lastDisp[0], self.lastPos[1] + self.lastDisp[1]), None, None)
+
+    def searchWindow(self, prediction: Prediction, frameShape: tuple, output: bool=False) -> Optional[Window]:
+        width = frameShape[1]
+        scale = width / CAP_RESOLUTION[0]
+        VERTICAL_BUFFER = 2 * abs(self.lastDisp[1]) + int(50 * scale)
+        HORIZONTAL_BUFFER = 2 * abs(self.lastDisp[0]) + int(40 * scale)
+        SHIFT_X = ((width - 2 * self.lastPos[0]) / (2 * width)) * 2.5
+        if output: print('Shift X: %f' % SHIFT_X)
+        POINT = (int(prediction.pos[0] + SHIFT_X * HORIZONTAL_BUFFER), prediction.pos[1])
+        return _clipWindow(POINT[0] - HORIZONTAL_BUFFER, POINT[1] - VERTICAL_BUFFER,
+                           POINT[0] + HORIZONTAL_BUFFER, POINT[1] + VERTICAL_BUFFER, frameShape)
+
+    def update(self, center: Optional[Tuple[int, int]]) -> None:
+        self.pos = center
+        if center is not None:
+            if self.lastPos is not None:
+                self.lastDisp = (center[0] - self.lastPos[0], center[1] - self.lastPos[1])
+            self.lastPos = center
+
+    def referencePos(self, lastPos: Optional[Tuple[int, int]]) -> Optional[Tuple[int, int]]:
+        """Where candidates of a full frame search should be near - wherever the ball was last seen."""
+        return lastPos
+
+    def state(self) -> tuple:
+        return self.pos, self.lastPos, self.lastDisp
+
+    def snapshot(self, record: np.void) -> None:
+        """Writes the predictor's state into a record of RECORD_DTYPE."""
+        record['pos'] = encodePoint(self.pos)
+        record['lastPos'] = encodePoint(self.lastPos)
+        record['lastDisp'] = encodePoint(self.lastDisp)
+
+    def restore(self, record: np.void) -> None:
+        self.pos = decodePoint(record['pos'])
+        self.lastPos = decodePoint(record['lastPos'])
+        self.lastDisp = decodePoint(record['lastDisp'])
+
+    def draw(self, frame: np.ndarray, prediction: Prediction) -> None:
+        cv2.circle(frame, prediction.pos, 3, (255, 0, 0), -1)
+
+
+class KalmanPredictor:
+    """
+    Constant acceleration Kalman filter of the ball's position, one per axis since the ball moves independently
+    along x and y. Each frame predicts where the ball will be and how sure it is of that, which sizes the search
+    window and scores the candidate contours. Missed detections only grow the uncertainty, so the window keeps
+    following the ball's path until it has been missing for MAX_MISSES frames.
+    A detection outside the gate (a bounce, a hit or a jump after missed frames) restarts the filter from the
+    ball's last two positions rather than bending the old path towards it.
+    """
+
+    GATE = 3.0  # Standard deviations from the prediction the ball may be
+    MARGIN = (30, 50)  # Pixels added to the reach for the ball's size and sudden bounces or hits (x, y)
+    # Pixel sizes are at CAP_RESOLUTION and scaled to the stream
+    MAX_MISSES = 8  # Missed frames before the ball is considered lost
+
+    MEASUREMENT_VAR = 4.0  # Pixels^2 of contour center noise
+    JERK_VAR = (4.0, 9.0)  # Process noise of each axis - bounces make y less predictable
+    INITIAL_VAR = (MEASUREMENT_VAR, 400.0, 25.0)  # Position, velocity and acceleration when first detected
+    RESTART_VAR = (MEASUREMENT_VAR, 25.0, 25.0)  # The same when restarted with a velocity from two positions
+
+    # State transition over one frame for [position, velocity, acceleration]
+    F = np.array([[1.0, 1.0, 0.5],
+                  [0.0, 1.0, 1.0],
+                  [0.0, 0.0, 1.0]])
+
+    RECORD_DTYPE = np.dtype([('started', '?'), ('x', '<f8', (2, 3)), ('P', '<f8', (2, 3, 3)),
+                             ('lastCenter', '<i4', 2), ('misses', '<i4')])
+
+    def __init__(self, scale: float=1.0):
+        self.scale = scale  # Stream pixels per pixel at CAP_RESOLUTION
+        self.margin = np.array(self.MARGIN) * scale
+        self.measurementVar = self.MEASUREMENT_VAR * scale ** 2
+        self.initialVar = np.array(self.INITIAL_VAR) * scale ** 2
+        self.restartVar = np.array(self.RESTART_VAR) * scale ** 2
+        # Piecewise constant jerk process noise of each axis, shape (2, 3, 3)
+        G = np.array([1 / 6, 1 / 2, 1.0])
+        self.Q = np.array(self.JERK_VAR)[:, None, None] * np.outer(G, G) * scale ** 2
+        self.reset()
+
+    def reset(self) -> None:
+        self.x = None  # (axis, [position, velocity, acceleration]), None until the ball is found
+        self.P = None  # (axis, 3, 3) covariance of x
+        self.lastCenter = None  # Last detection, for the velocity on a restart
+        self.misses = 0
+
+    def _predictState(self) -> Tuple[np.ndarray, np.ndarray]:
+        F = self.F
+        return self.x @ F.T, F @ self.P @ F.T + self.Q
+
+    def predict(self) -> Optional[Prediction]:
+        """The next frame's prediction, without advancing the filter."""
+        if self.x is None:
+            return None
+        x, P = self._predictState()
+        sigma = np.sqrt(P[:, 0, 0] + self.measurementVar)
+        reach = self.GATE * sigma + self.margin
+        return Prediction((int(round(x[0, 0])), int(round(x[1, 0]))), (float(sigma[0]), float(sigma[1])),
+                          (int(reach[0]), int(reach[1])))
+
+    def searchWindow(self, prediction: Prediction, frameShape: tuple, output: bool=False) -> Optional[Window]:
+        (x, y), (reachX, reachY) = prediction.pos, prediction.reach
+        if output: print('Predicted (%d, %d) +- (%d, %d)' % (x, y, reachX, reachY))
+        window = _clipWindow(x - reachX, y - reachY, x + reachX + 1, y + reachY + 1, frameShape)
+        if window[0] >= window[2] or window[1] >= window[3]:
+            return None  # Predicted out of view
+        return window
+
+    def update(self, center: Optional[Tuple[int, int]]) -> None:
+        """Advances the filter by a frame, correcting it with the ball's position if it was found."""
+        if self.x is None:
+            if center is not None:
+                self._start(center, (0, 0), self.initialVar)
+            return
+
+        x, P = self._predictState()
+        if center is None:
+            self.misses += 1
+            if self.misses > self.MAX_MISSES:
+                self.reset()
+            else:
+                self.x, self.P = x, P
+            return
+
+        # Only the position is measured, so the gain is the first column of P over the innovation variance
+        S = P[:, 0, 0] + self.measurementVar
+        innovation = np.array(center, dtype=float) - x[:, 0]
+        if (innovation ** 2 / S).sum() > self.GATE ** 2:
+            frames = self.misses + 1
+            velocity = ((center[0] - self.lastCenter[0]) / frames, (center[1] - self.lastCenter[1]) / frames)
+            self._start(center, velocity, self.restartVar)
+            return
+        K = P[:, :, 0] / S[:, None]
+        self.x = x + K * innovation[:, None]
+        self.P = P - K[:, :, None] * P[:, None, 0, :]
+        self.lastCenter = center
+        self.misses = 0
+
+    def _start(self, center: Tuple[int, int], velocity: Tuple[float, float], variances: tuple) -> None:
+        self.x = np.zeros((2, 3))
+        self.x[:, 0] = center
+        self.x[:, 1] = velocity
+        self.P = np.zeros((2, 3, 3))
+        self.P[:, range(3), range(3)] = variances
+        self.lastCenter = center
+        self.misses = 0
+
+    def referencePos(self, lastPos: Optional[Tuple[int, int]]) -> Optional[Tuple[int, int]]:
+        """Once the ball is lost, where it was last seen says nothing about where it comes back into view."""
+        return lastPos if self.x is not None else None
+
+    def state(self) -> tuple:
+        if self.x is None:
+            return None, None, None, 0
+        return tuple(self.x.ravel().tolist()), tuple(self.P.ravel().tolist()), self.lastCenter, self.misses
+
+    def snapshot(self, record: np.void) -> None:
+        """Writes the filter's state into a record of RECORD_DTYPE."""
+        record['started'] = self.x is not None
+        if self.x is not None:
+            record['x'] = self.x
+            record['P'] = self.P
+            record['lastCenter'] = self.lastCenter
+        record['misses'] = self.misses
+
+    def restore(self, record: np.void) -> None:
+        if not record['started']:
+            self.reset()
+            return
+        self.x = record['x'].copy()
+        self.P = record['P'].copy()
+        self.lastCenter = decodePoint(record['lastCenter'])
+        self.misses = int(record['misses'])
+
+    def draw(self, frame: np.ndarray, prediction: Prediction) -> None:
+        cv2.ellipse(frame, prediction.pos, prediction.reach, 0, 0, 360, (255, 0, 0), 1)
@@ -0,0 +1,88 @@
+from collections import deque
+from time import perf_counter
+from typing import Dict, Optional, Tuple
+import cv2
+import numpy as np
+
+
+class StageProfiler:
+    """
+    Rolling per-stage timings of the scoring hot path.
+    Instrumented code checks `enabled` once and only then calls perf_counter, so a disabled profiler costs an
+    attribute lookup per frame:
+
+        prof = PROFILER if PROFILER.enabled else None
+        if prof: t = perf_counter()
+        ...
+        if prof: t = prof.lap('stage', t)
+    """
+
+    def __init__(self, window: int=600):
+        self.enabled = False
+        self.window = window
+        self.samples = {}  # Stage name -> most recent durations in seconds
+
+    def enable(self, window: Optional[int]=None):
+        if window is not None and window != self.window:
+            self.window = window
+            self.samples = {}
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.samples = {}
+
+    def lap(self, stage: str, start: float) -> float:
+        """Records the time since start for the stage and returns now, the start of the next stage."""
+        now = perf_counter()
+        samples = self.samples.get(stage)
+        if samples is None:
+            samples = self.samples[stage] = deque(maxlen=self.window)
+        samples.append(now - start)
+        return now
+
+    def histogram(self, stage: str, bins: int=20) -> Tuple[np.ndarray, np.ndarray]:
+        """Counts and millisecond bin edges of the stage's recent durations."""
+        return np.histogram(np.array(self.samples.get(stage, ())) * 1000, bins=bins)
+
+    def summary(self) -> Dict[str, dict]:
+        """
+        Mean, p50, p99 and max milliseconds of every stage over the rolling window.
+        Safe to call while other threads time stages - each window is copied before it is read.
+        """
+        stats = {}
+        for stage, samples in list(self.samples.items()):
+            durations = np.array(samples.copy()) * 1000
+            if len(durations):
+                p50, p99 = np.percentile(durations, (50, 99))
+                stats[stage] = {'calls': len(durations), 'meanMs': float(durations.mean()), 'p50Ms': float(p50),
+                                'p99Ms': float(p99), 'maxMs': float(durations.max())}
+        return stats
+
+    def printSummary(self):
+        print('%-14s %8s %8s %8s %8s' % ('Stage', 'mean ms', 'p50 ms', 'p99 ms', 'max ms'))
+        for stage, stats in self.summary().items():
+            print('%-14s %8.3f %8.3f %8.3f %8.3f' % (stage, stats['meanMs'], stats['p50Ms'], stats['p99Ms'],
+                                                     stats['maxMs']))
+
+    def drawOverlay(self, frame: np.ndarray, origin: Tuple[int, int]=(5, 60)) -> None:
+        """Draws a bar per stage (length = p50, tick = p99) onto a debug frame."""
+        WHITE = (255, 255, 255)
+        YELLOW = (0, 255, 255)
+        MS_TO_PX = 40  # Bar pixels per millisecond
+
+        x, y = origin
+        for stage, stats in self.summary().items():
+            cv2.putText(frame, '%s %.2f/%.2f' % (stage, stats['p50Ms'], stats['p99Ms']), (x, y),
+                        cv2.FONT_HERSHEY_PLAIN, 1, WHITE, 1)
+            barX = x + 190
+            cv2.rectangle(frame, (barX, y - 9), (barX + int(stats['p50Ms'] * MS_TO_PX), y - 1), WHITE, -1)
+            tickX = barX + int(stats['p99Ms'] * MS_TO_PX)
+            cv2.line(frame, (tickX, y - 11), (tickX, y + 1), YELLOW, 2)
+            y += 16
+
+
+# Shared by every instrumented stage
+PROFILER = StageProfiler()
@@ -0,0 +1,202 @@
+from bisect import bisect_left
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from typing import Dict, List, Optional
+import numpy as np
+from Setup import LEFT, RIGHT, other
+from Ball import BallObservation
+from Game import GameState
+from Events import ScoreCorrected
+
+# What the game stage got in one frame - the ball observation, and the serving side if a paddle signal was seen
+Entry = namedtuple('Entry', ['frameIndex', 'observation', 'signalSide'])
+# An operator's call - side wins the rally at frameIndex, in place of whatever the game made of that frame
+Correction = namedtuple('Correction', ['frameIndex', 'side'])
+# A point the game scored, and the frame it was scored in
+ScoredPoint = namedtuple('ScoredPoint', ['frameIndex', 'side'])
+# What the worker hands back - the re-scored game after the entries [startSeq, endSeq), the corrections it
+# applied, the points it scored and its checkpoints with their seqs
+Replay = namedtuple('Replay', ['game', 'startSeq', 'endSeq', 'corrected', 'points', 'records', 'seqs'])
+
+
+class RewindBuffer:
+    """
+    Keeps the last few minutes of a live game so an operator can correct its calls without restarting.
+    The game stage calls record after every frame, which keeps what the frame gave the game - its ball observation
+    and any paddle signal - and a GameState snapshot every checkpointInterval frames.
+    Corrections can be asked for from any thread. The game stage hands them to a worker thread, which restores the
+    checkpoint before the corrected frame and re-scores the recorded frames from there with every correction
+    applied, so no video is decoded again and the live game goes on meanwhile. Once the worker is done, the game
+    stage re-scores the few frames recorded since and restores the live game from the result.
+    The Ball isn't checkpointed - it belongs to the vision stage, and the game only sees its observations.
+    """
+
+    CHECKPOINT_INTERVAL = 30
+
+    def __init__(self, game: GameState, frames: int, checkpointInterval: int=CHECKPOINT_INTERVAL):
+        self.game = game
+        self.interval = checkpointInterval
+        self.entries = deque(maxlen=frames)
+        self.recorded = 0  # Entries recorded so far, the sequence number of the next one
+        # Checkpoint of the game before entry seq, for seqs that are multiples of the interval, in a ring
+        slots = frames // checkpointInterval + 2
+        self.checkpoints = game.newRecords(slots)
+        self.checkpointSeqs = np.full(slots, -1, dtype=np.int64)
+        self._checkpoint(game, 0)
+        self.transfer = game.newRecords(1)  # Carries an installed replay over to the live game
+        self.points = deque()
+        self.lastScore = tuple(game.score)
+        self.pending = deque()  # Corrections asked for but not handed to the worker yet
+        self.corrections = []  # Every correction still in the buffer, re-applied by every replay
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rewind')
+        self.job = None  # The replay the worker is running
+
+    def _checkpoint(self, game: GameState, seq: int) -> None:
+        slot = (seq // self.interval) % len(self.checkpointSeqs)
+        game.snapshot(self.checkpoints, slot)
+        self.checkpointSeqs[slot] = seq
+
+    def awardPoint(self, side: int, frameIndex: Optional[int]=None) -> Correction:
+        """
+        Has side win the rally at frameIndex, the last recorded frame by default, and re-scores the game from there.
+        Safe to call from any thread - the live game is corrected a few frames later.
+        """
+        if side not in (LEFT, RIGHT):
+            raise ValueError('Points go to LEFT or RIGHT, not %r.' % side)
+        entries = self.entries
+        if not entries:
+            raise ValueError('No frames have been recorded yet.')
+        if frameIndex is None:
+            frameIndex = entries[-1].frameIndex
+        elif frameIndex < entries[0].frameIndex:
+            raise ValueError('Frame %d is no longer in the rewind buffer.' % frameIndex)
+        correction = Correction(frameIndex, side)
+        self.pending.append(correction)
+        return correction
+
+    def overturnLastPoint(self) -> Correction:
+        """Gives the last point the game scored to the other side instead."""
+        if not self.points:
+            raise ValueError('No point has been scored yet.')
+        point = self.points[-1]
+        return self.awardPoint(other(point.side), point.frameIndex)
+
+    def record(self, frameIndex: int, observation: BallObservation, signalSide: Optional[int]=None) -> bool:
+        """
+        Keeps what the live game was given in a frame, after it has been given it.
+        Returns True when the live game was corrected in this call.
+        """
+        self.entries.append(Entry(frameIndex, observation, signalSide))
+        self.recorded += 1
+        game = self.game
+        score = tuple(game.score)
+        if score != self.lastScore:
+            self.points.append(ScoredPoint(frameIndex, LEFT if score[LEFT] > self.lastScore[LEFT] else RIGHT))
+            self.lastScore = score
+        if self.recorded % self.interval == 0:
+            self._checkpoint(game, self.recorded)
+
+        corrected = False
+        if self.job is not None and self.job.done():
+            corrected = self._install()
+        if self.job is None and self.pending:
+            self._startReplay()
+        return corrected
+
+    def _startReplay(self):
+        while self.pending:
+            self.corrections.append(self.pending.popleft())
+        entries = list(self.entries)
+        first = self.recorded - len(entries)  # Seq of the oldest entry
+        frames = [entry.frameIndex for entry in entries]
+        # Dropped frames were never recorded, a correction for one goes to the next frame that was
+        self.corrections = [correction._replace(frameIndex=frames[bisect_left(frames, correction.frameIndex)])
+                            for correction in self.corrections
+                            if frames[0] <= correction.frameIndex <= frames[-1]]
+        if not self.corrections:
+            return
+
+        # The latest checkpoint before the earliest corrected frame that the buffer still has every entry after
+        earliest = min(correction.frameIndex for correction in self.corrections)
+        target = first + bisect_left(frames, earliest)
+        seq = target - target % self.interval
+        while seq >= first and self.checkpointSeqs[(seq // self.interval) % len(self.checkpointSeqs)] != seq:
+            seq -= self.interval
+        if seq < first:
+            print('Frame %d is too old to correct, no checkpoint before it is left' % earliest)
+            self.corrections = [correction for correction in self.corrections if correction.frameIndex > earliest]
+            return
+
+        replay = copy(self.game)
+        # The replay reports nothing, renders nothing and never waits on the live game's paddle signal detector
+        replay.events = None
+        replay.headless = True
+        replay.signalDetector = None
+        replay.restore(self.checkpoints, (seq // self.interval) % len(self.checkpointSeqs))
+        corrected = {correction.frameIndex: correction.side for correction in self.corrections}
+        self.job = self.pool.submit(self._replay, replay, entries[seq - first:], seq, corrected)
+
+    def _replay(self, game: GameState, entries: List[Entry], startSeq: int, corrected: Dict[int, int]) -> Replay:
+        """Worker - re-scores the entries from startSeq on, keeping checkpoints and points on the way."""
+        points = []
+        records = game.newRecords(len(entries) // self.interval + 1)
+        seqs = []
+        seq = startSeq
+        for entry in entries:
+            self._step(game, entry, corrected, points)
+            seq += 1
+            if seq % self.interval == 0:
+                game.snapshot(records, len(seqs))
+                seqs.append(seq)
+        return Replay(game, startSeq, seq, corrected, points, records, seqs)
+
+    @staticmethod
+    def _step(game: GameState, entry: Entry, corrected: Dict[int, int], points: list) -> None:
+        """Gives the game an entry the way the live game stage did, or the operator's call for its frame."""
+        before = tuple(game.score)
+        side = corrected.get(entry.frameIndex)
+        if side is not None:
+            game.transitionPreServe(side)
+        elif game.state == GameState.STATE_AWAITING_SIGNAL:
+            # Paddle signals are only known for frames the live game was waiting for one in
+            if entry.signalSide is not None:
+                game.transitionPreServe(entry.signalSide)
+        else:
+            game.updateState(entry.observation, output=False)
+        if game.score[LEFT] != before[LEFT]:
+            points.append(ScoredPoint(entry.frameIndex, LEFT))
+        elif game.score[RIGHT] != before[RIGHT]:
+            points.append(ScoredPoint(entry.frameIndex, RIGHT))
+
+    def _install(self) -> bool:
+        """Catches the worker's replay up with the frames recorded since and makes it the live game."""
+        replay = self.job.result()
+        self.job = None
+        first = self.recorded - len(self.entries)
+        if replay.endSeq < first:
+            return False  # The buffer moved past the replay before it was done
+        for i, seq in enumerate(replay.seqs):
+            slot = (seq // self.interval) % len(self.checkpointSeqs)
+            if self.checkpointSeqs[slot] == seq:
+                self.checkpoints[slot] = replay.records[i]
+        points = replay.points
+        for i in range(replay.endSeq - first, len(self.entries)):
+            self._step(replay.game, self.entries[i], replay.corrected, points)
+            if (first + i + 1) % self.interval == 0:
+                self._checkpoint(replay.game, first + i + 1)
+
+        game = self.game
+        replay.game.snapshot(self.transfer, 0)
+        game.restore(self.transfer, 0)
+        startFrame = self.entries[replay.startSeq - first].frameIndex if replay.startSeq >= first else -1
+        while self.points and self.points[-1].frameIndex >= startFrame:
+            self.points.pop()
+        self.points.extend(points)
+        self.lastScore = tuple(game.score)
+        if game.events is not None:
+            game.events.emit(ScoreCorrected(game.events.clock(), game.servingSide, self.lastScore))
+        return True
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=True, cancel_futures=True)
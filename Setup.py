@@ -1,9 +1,13 @@
-from typing import Union, List, Optional
+import time
+from collections import namedtuple
+from functools import lru_cache
+from typing import Union, Optional, Tuple
 from PIL import Image, ImageFont, ImageDraw
 import cv2
 import numpy as np
 import imutils
 from imutils import video
+from ColorClassifier import ColorClassifier
 
 # Shared constants needed for Game and Ball
 
@@ -34,6 +38,34 @@ class Convert:
         return tuple([float(argv[i] * conversionFactors[i]) for i in range(len(argv))])
 
 
+CAP_RESOLUTION = (640, 480)  # Resolution every pixel constant was tuned at
+CAP_FRAMERATE = 30
+
+
+class SceneGeometry:
+    """
+    Pixel sizes of the scene at a stream resolution. Everything was tuned at CAP_RESOLUTION and scales with the
+    frame width, so the same table framed by a 1080p camera gets the same buffers in table units.
+    """
+
+    def __init__(self, res: tuple=CAP_RESOLUTION):
+        width, height = res
+        self.res = (width, height)
+        self.scale = width / CAP_RESOLUTION[0]
+        self.netHitBuffer = self.pixels(35)  # Buffer to confirm the ball has fully crossed the net barrier
+        self.netViewBuffer = self.pixels(110)  # Buffer to crop out moving players on the other side of the table
+        self.tableEndBuffer = self.pixels(200)  # Buffer that places a confidence interval on bounces
+        self.netTop = height - (height // 3)  # Lowest the top of the net can be
+        self.signalLine = 3 * height // 5  # Paddle signals are only looked for above this line
+
+    def pixels(self, length: float) -> int:
+        """A length tuned at CAP_RESOLUTION, in pixels at this resolution."""
+        return int(length * self.scale)
+
+    def __repr__(self):
+        return 'SceneGeometry(%dx%d)' % self.res
+
+
 class GameViewSource:
 
     def __init__(self, stream: Union[cv2.VideoCapture, video.webcamvideostream.WebcamVideoStream], isVideo: bool, res: tuple,
@@ -41,8 +73,10 @@ class GameViewSource:
         self.stream = stream
         self.isVideo = isVideo
         self.res = res
+        self.geometry = SceneGeometry(res)
         self.fps = self._getProp(cv2.CAP_PROP_FPS)
         self.netX = netX
+        self.background = None  # RunningBackground of the empty scene, learned during setup
 
     def setNetPos(self, netX: int):
         self.netX = netX
@@ -53,15 +87,39 @@ class GameViewSource:
         else:
             return self.stream.stream.get(prop)
 
-    def read(self) -> np.ndarray:
+    def read(self, dst: Optional[np.ndarray]=None) -> np.ndarray:
+        """The next frame, None at the end of the stream. Video is decoded straight into dst if it is given."""
         if self.isVideo:
-            return self.stream.read()[1]
+            frame = self.stream.read(dst)[1]
         else:
-            return self.stream.read()
-
+            # The webcam thread keeps its own latest frame
+            frame = self.stream.read()
+        if dst is None or frame is None or np.shares_memory(frame, dst):
+            return frame
+        np.copyto(dst, frame)
+        return dst
+
+
+def openStream(res: tuple=(640,480), fps: int=30, loadVideo: Optional[str]=None, startFrame: Optional[int]=None,
+               camera: int=0) -> GameViewSource:
+    """Opens a camera, or a video file from startFrame on, as a GameViewSource."""
+    # Load from video or from webcam
+    if not loadVideo:
+        stream = video.VideoStream(src=camera, resolution=res, framerate=fps).start()
+        time.sleep(2)
+        fps = stream.stream.get(cv2.CAP_PROP_FPS)
+        res = (int(stream.stream.get(cv2.CAP_PROP_FRAME_WIDTH)), int(stream.stream.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        gameViewSource = GameViewSource(stream, False, res)
+    else:
+        stream = cv2.VideoCapture(loadVideo)
+        fps = stream.get(cv2.CAP_PROP_FPS)
+        if startFrame:
+            stream.set(cv2.CAP_PROP_POS_FRAMES, startFrame)
+        res = (int(stream.get(cv2.CAP_PROP_FRAME_WIDTH)), int(stream.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        gameViewSource = GameViewSource(stream, True, res)
+    print("Stream:\n\tFPS - %d\n\tResolution: (%d, %d)" % (fps, res[0], res[1]))
+    return gameViewSource
 
-CAP_RESOLUTION = (640, 480)
-CAP_FRAMERATE = 30
 
 LEFT = 0
 RIGHT = 1
@@ -77,12 +135,12 @@ def display(var):
     return 'NONE' if var is None else ('LEFT' if var == LEFT else 'RIGHT')
 
 # GUI Display
-IMG_DISPLAY = Image.open('templates/display.png').convert('RGBA')
-IMG_UNDERSCORE = Image.open('templates/white_underscore.jpg')
-IMG_QUESTION_MARK = Image.open('templates/question_mark_full.png').convert('RGBA')
+# What the scoreboard shows - the score as a tuple and the serving side, None when it is asked for
+Scoreboard = namedtuple('Scoreboard', ['score', 'serving'])
+
+# Renders the scoreboard from pre-rendered backgrounds and cached score tiles, keeping the finished boards
+class ScoreboardRenderer:
 
-# Get OpenCV image for display
-def getDisplay(score: list, serving: Union[int, None]) -> cv2.UMat:
     # QUESTION_MARK = (882, 49)
     LEFT_UNDERSCORE = (200, 313)
     RIGHT_UNDERSCORE = (1187, 313)
@@ -91,91 +149,144 @@ def getDisplay(score: list, serving: Union[int, None]) -> cv2.UMat:
     DOUBLE_DIGIT_RIGHT = (1225, 500)
     DOUBLE_DIGIT_LEFT = (240, 500)
 
-    display = IMG_DISPLAY.copy()
-
-    if serving == LEFT:
-        display.paste(IMG_UNDERSCORE, RIGHT_UNDERSCORE)
-    elif serving == RIGHT:
-        display.paste(IMG_UNDERSCORE, LEFT_UNDERSCORE)
-    else:
-        # Unknown side - ask the user
-        display = Image.alpha_composite(display, IMG_QUESTION_MARK)
-
-    font = ImageFont.truetype("font/Roboto-Regular.ttf", 160)  # 150
-    draw = ImageDraw.Draw(display)
-
-    if score[0] > 9:
-        draw.text(DOUBLE_DIGIT_RIGHT, str(score[0]), font=font, fill=(255, 255, 255))
-    else:
-        draw.text(SINGLE_DIGIT_RIGHT, str(score[0]), font=font, fill=(255, 255, 255))
+    TEXT_COLOR = 255  # White
+
+    def __init__(self, fontPath: str="font/Roboto-Regular.ttf", fontSize: int=160, cacheSize: int=128):
+        self.font = ImageFont.truetype(fontPath, fontSize)  # 150
+        background = Image.open('templates/display.png').convert('RGBA')
+        underscore = Image.open('templates/white_underscore.jpg')
+        questionMark = Image.open('templates/question_mark_full.png').convert('RGBA')
+        self.backgrounds = {serving: self._renderBackground(background, underscore, questionMark, serving)
+                            for serving in (LEFT, RIGHT, None)}
+        self.tiles = {}  # Score text -> (alpha mask, offset from the text position)
+        # Finished boards, keyed on (score0, score1, serving) - a game only ever shows a few dozen of them
+        self.render = lru_cache(maxsize=cacheSize)(self._render)
+
+    @classmethod
+    def _renderBackground(cls, background: Image.Image, underscore: Image.Image, questionMark: Image.Image,
+                          serving: Optional[int]) -> np.ndarray:
+        display = background.copy()
+        if serving == LEFT:
+            display.paste(underscore, cls.RIGHT_UNDERSCORE)
+        elif serving == RIGHT:
+            display.paste(underscore, cls.LEFT_UNDERSCORE)
+        else:
+            # Unknown side - ask the user
+            display = Image.alpha_composite(display, questionMark)
+        return cv2.cvtColor(np.asarray(display), cv2.COLOR_RGBA2BGR)
+
+    def _tile(self, text: str) -> Tuple[np.ndarray, Tuple[int, int]]:
+        tile = self.tiles.get(text)
+        if tile is None:
+            left, top, right, bottom = self.font.getbbox(text)
+            mask = Image.new('L', (right - left, bottom - top), 0)
+            ImageDraw.Draw(mask).text((-left, -top), text, font=self.font, fill=255)
+            alpha = np.asarray(mask, dtype=np.float32)[:, :, np.newaxis] / 255.0
+            tile = self.tiles[text] = (alpha, (left, top))
+        return tile
+
+    def _blit(self, canvas: np.ndarray, text: str, position: Tuple[int, int]) -> None:
+        alpha, (dx, dy) = self._tile(text)
+        x0, y0 = position[0] + dx, position[1] + dy
+        # Clip the tile to the canvas
+        height, width = canvas.shape[:2]
+        tx0, ty0 = max(-x0, 0), max(-y0, 0)
+        tx1, ty1 = min(alpha.shape[1], width - x0), min(alpha.shape[0], height - y0)
+        if tx0 >= tx1 or ty0 >= ty1:
+            return
+        alpha = alpha[ty0:ty1, tx0:tx1]
+        region = canvas[y0 + ty0:y0 + ty1, x0 + tx0:x0 + tx1]
+        region[:] = region * (1.0 - alpha) + self.TEXT_COLOR * alpha + 0.5
+
+    def _render(self, score0: int, score1: int, serving: Optional[int]) -> np.ndarray:
+        """A finished scoreboard. It is cached and shared between callers, so it is read-only."""
+        canvas = self.backgrounds[serving].copy()
+        self._blit(canvas, str(score0), self.DOUBLE_DIGIT_RIGHT if score0 > 9 else self.SINGLE_DIGIT_RIGHT)
+        self._blit(canvas, str(score1), self.DOUBLE_DIGIT_LEFT if score1 > 9 else self.SINGLE_DIGIT_LEFT)
+        canvas.flags.writeable = False
+        return canvas
+
+
+# Built on first use, so processes that never show a scoreboard don't load its fonts and templates
+@lru_cache(maxsize=None)
+def scoreboardRenderer() -> ScoreboardRenderer:
+    return ScoreboardRenderer()
 
-    if score[1] > 9:
-        draw.text(DOUBLE_DIGIT_LEFT, str(score[1]), font=font, fill=(255, 255, 255))
-    else:
-        draw.text(SINGLE_DIGIT_LEFT, str(score[1]), font=font, fill=(255, 255, 255))
-
-    cvImg = cv2.cvtColor(np.asarray(display), cv2.COLOR_RGB2BGR)
-    return cvImg
-
-# Wait for a user to hold out their paddle for a signal
-def getSideSignal(view: GameViewSource, score: List[int], displayFull=True) -> Optional[int]:
-    # Color constants
-    PADDLE_LOWER_1 = Convert.blenderToCV2(.00, .49, .70)
-    PADDLE_HIGHER_1 = Convert.blenderToCV2(.04, .62, 1.0)
-
-    PADDLE_LOWER_2 = Convert.blenderToCV2(.97, .49, .70)
-    PADDLE_HIGHER_2 = Convert.blenderToCV2(1.0, .62, 1.0)
-
-    # Look for signal until found
-    screenImg = getDisplay(score, None)
-    frameN = 0
-    while True:
-        frameN += 1
-        frame = view.read()
-
-        if frame is None:
-            print('End of stream.')
-            exit(-1)
-
-        # Crop out the paddles on the table
-        height, width = frame.shape[:2]
-        frame = frame[:3*height//5]
-
-        # Color detection
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        mask1 = cv2.inRange(hsv, PADDLE_LOWER_1, PADDLE_HIGHER_1)
-        mask2 = cv2.inRange(hsv, PADDLE_LOWER_2, PADDLE_HIGHER_2)
-        mask = cv2.bitwise_or(mask1, mask2)
-
-        kernel = np.ones((5, 5), np.uint8)
-        redAreaImg = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-        redAreaImg = cv2.morphologyEx(redAreaImg, cv2.MORPH_CLOSE, kernel)
-
-        cnts = cv2.findContours(redAreaImg.copy(), cv2.RETR_EXTERNAL,
-                                cv2.CHAIN_APPROX_SIMPLE)
-        cnts = imutils.grab_contours(cnts)
-
-        if len(cnts) > 0:
+# Get OpenCV image for display
+def getDisplay(score: list, serving: Union[int, None]) -> np.ndarray:
+    return scoreboardRenderer().render(score[0], score[1], serving)
+
+# Paddle colors - red wraps around the hue circle, so it takes two ranges
+PADDLE_LOWER_1 = Convert.blenderToCV2(.00, .49, .70)
+PADDLE_HIGHER_1 = Convert.blenderToCV2(.04, .62, 1.0)
+
+PADDLE_LOWER_2 = Convert.blenderToCV2(.97, .49, .70)
+PADDLE_HIGHER_2 = Convert.blenderToCV2(1.0, .62, 1.0)
+
+PADDLE_COLORS = ColorClassifier({'paddle': [(PADDLE_LOWER_1, PADDLE_HIGHER_1), (PADDLE_LOWER_2, PADDLE_HIGHER_2)]})
+
+
+class SideSignalDetector:
+    """
+    Looks for a player holding out their paddle to signal who serves, in frames fed to it one at a time, so
+    whatever feeds it never waits on it. Only every INTERVAL-th frame is looked at, at 1/SHRINK resolution and
+    only in the player zones above the signal line - left and right of the net, outside its view buffer.
+    """
+
+    INTERVAL = 3  # Frames fed for every frame looked at
+    SHRINK = 2  # Zones are looked at with every SHRINK-th pixel of every SHRINK-th row
+    MIN_RADIUS = 12  # Pixels at CAP_RESOLUTION a paddle has to reach
+
+    def __init__(self, geometry: SceneGeometry, netX: int):
+        self.geometry = geometry
+        kernelSize = max(geometry.pixels(5) // self.SHRINK, 1)
+        self.kernel = np.ones((kernelSize, kernelSize), np.uint8)
+        self.minRadius = geometry.pixels(self.MIN_RADIUS) / self.SHRINK
+        width = geometry.res[0]
+        self.zones = ((LEFT, 0, max(netX - geometry.netViewBuffer, 0)),
+                      (RIGHT, min(netX + geometry.netViewBuffer, width), width))
+        self.framesFed = 0
+
+    def reset(self) -> None:
+        self.framesFed = 0
+
+    def feed(self, frame: np.ndarray) -> Optional[int]:
+        """The serving side once a paddle signal is seen, None until then."""
+        self.framesFed += 1
+        if (self.framesFed - 1) % self.INTERVAL:
+            return None
+        side, bestArea = None, 0
+        for zoneSide, x0, x1 in self.zones:
+            zone = frame[:self.geometry.signalLine, x0:x1]
+            size = (zone.shape[1] // self.SHRINK, zone.shape[0] // self.SHRINK)
+            if size[0] == 0 or size[1] == 0:
+                continue
+            zone = cv2.resize(zone, size, interpolation=cv2.INTER_NEAREST)
+
+            # Color detection - both red ranges in one lookup
+            mask = PADDLE_COLORS.mask(zone, 'paddle')
+            cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.kernel, dst=mask)
+            cv2.morphologyEx(mask, cv2.MORPH_CLOSE, self.kernel, dst=mask)
+
+            # The biggest red contour, if it is big enough to be a paddle held out
+            cnts = imutils.grab_contours(cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE))
+            if len(cnts) == 0:
+                continue
             c = max(cnts, key=cv2.contourArea)
-            ((x, y), radius) = cv2.minEnclosingCircle(c)
-            if radius > 12:
-                side = LEFT if x < view.netX else RIGHT
-                print('\tDetected %s paddle signal after %d frames' % (display(side), frameN))
-                return side  # Return side of table that is serving
-
-        if displayFull:
-            cv2.imshow('window', screenImg)
-            # cv2.imshow('window', frame)
-            if cv2.waitKey(1) == ord('q'):
-                return None
+            area = cv2.contourArea(c)
+            if cv2.minEnclosingCircle(c)[1] > self.minRadius and area > bestArea:
+                side, bestArea = zoneSide, area
+        return side
 
 
 # These must be 0 and 1 because they correspond to indices
 HORIZONTAL = 0
 VERTICAL = 1
 
-SCALING_FACTOR = (CAP_RESOLUTION[0]/640.0)
-NET_HIT_BUFFER = int(35 * SCALING_FACTOR)  # Buffer to confirm the ball has fully crossed the net barrier
-NET_VIEW_BUFFER = int(110 * SCALING_FACTOR)  # Buffer to crop out moving players on the other side of the table
-TABLE_END_BUFFER = int(200 * SCALING_FACTOR)  # Buffer that places a confidence interval on bounces
+# The buffers at CAP_RESOLUTION - streams use their own view.geometry
+DEFAULT_GEOMETRY = SceneGeometry(CAP_RESOLUTION)
+SCALING_FACTOR = DEFAULT_GEOMETRY.scale
+NET_HIT_BUFFER = DEFAULT_GEOMETRY.netHitBuffer
+NET_VIEW_BUFFER = DEFAULT_GEOMETRY.netViewBuffer
+TABLE_END_BUFFER = DEFAULT_GEOMETRY.tableEndBuffer
 
@@ -0,0 +1,46 @@
+from typing import List
+import cv2
+import numpy as np
+
+# Colors of the synthetic scene (BGR)
+FLOOR_COLOR = (70, 60, 50)
+TABLE_COLOR = (110, 60, 20)
+NET_COLOR = (230, 230, 230)
+BALL_COLOR = (60, 230, 230)
+
+
+def syntheticTable(res: tuple=(640, 480)) -> np.ndarray:
+    """A static side view of a table, netted in the middle."""
+    width, height = res
+    table = np.empty((height, width, 3), dtype=np.uint8)
+    table[:] = FLOOR_COLOR
+    tableTop = 2 * height // 3
+    cv2.rectangle(table, (width // 10, tableTop), (9 * width // 10, tableTop + height // 40), TABLE_COLOR, -1)
+    cv2.line(table, (width // 2, tableTop), (width // 2, tableTop - height // 12), NET_COLOR, 3)
+    return table
+
+
+def syntheticFrames(count: int, res: tuple=(640, 480), noise: int=0, seed: int=0) -> List[np.ndarray]:
+    """
+    A rally over the synthetic table - the ball goes back and forth across the net bouncing once on each side,
+    with optional per-pixel camera noise.
+    """
+    width, height = res
+    rng = np.random.default_rng(seed)
+    table = syntheticTable(res)
+    tableTop = 2 * height // 3
+    radius = max(3, width // 90)
+    framesPerShot = 45
+    frames = []
+    for i in range(count):
+        t = (i % framesPerShot) / (framesPerShot - 1)
+        leftToRight = (i // framesPerShot) % 2 == 0
+        x = width // 10 + (0.8 * width) * (t if leftToRight else 1 - t)
+        # Two arcs per shot - one before and one after the bounce on the far side
+        y = tableTop - radius - abs(np.sin(t * 1.5 * np.pi)) * height / 3
+        frame = table.copy()
+        cv2.circle(frame, (int(x), int(y)), radius, BALL_COLOR, -1)
+        if noise:
+            frame = cv2.add(frame, rng.integers(0, noise, frame.shape, dtype=np.uint8))
+        frames.append(frame)
+    return frames
@@ -0,0 +1,152 @@
+from typing import Callable, Iterable, List, Optional, Tuple
+import numpy as np
+from Setup import SceneGeometry, other
+from Ball import BallObservation
+from Game import GameState, LegacyGameState
+
+# Stand-ins for None in the fixed-width record
+NO_SIDE = -1
+NO_POS = -32768
+
+# One record per processed frame - everything GameState reads from the Ball
+TRAJECTORY_DTYPE = np.dtype([
+    ('frame', '<u4'),
+    ('pos', '<i2', 2),
+    ('lastPos', '<i2', 2),
+    ('netSide', 'i1'),
+    ('bounceSide', 'i1'),
+    ('hitDirection', 'i1'),
+    ('ballCrossedTo', 'i1'),
+    ('currentDir', 'i1'),
+    ('hasHitNet', '?'),
+    ('framesOnSide', '<u4'),
+    ('timeSinceBounce', '<i4'),
+])
+
+SIDE_FIELDS = ('netSide', 'bounceSide', 'hitDirection', 'ballCrossedTo', 'currentDir')
+
+
+def _encodeSide(side: Optional[int]) -> int:
+    return NO_SIDE if side is None else side
+
+
+def _encodePos(pos: Optional[tuple]) -> tuple:
+    return (NO_POS, NO_POS) if pos is None else pos
+
+
+class TrajectoryWriter:
+    """Records the Ball's outputs frame by frame, growing its buffer as needed."""
+
+    def __init__(self, capacity: int=4096):
+        self.records = np.zeros(capacity, dtype=TRAJECTORY_DTYPE)
+        self.length = 0
+
+    def write(self, frameIndex: int, ballObservation: BallObservation) -> None:
+        if self.length == len(self.records):
+            self.records = np.resize(self.records, 2 * len(self.records))
+        self.records[self.length] = (frameIndex, _encodePos(ballObservation.pos),
+                                     _encodePos(ballObservation.lastPos),
+                                     _encodeSide(ballObservation.netSide), _encodeSide(ballObservation.bounceSide),
+                                     _encodeSide(ballObservation.hitDirection),
+                                     _encodeSide(ballObservation.ballCrossedTo),
+                                     _encodeSide(ballObservation.currentDir), ballObservation.hasHitNet,
+                                     ballObservation.framesOnSide, ballObservation.timeSinceBounce)
+        self.length += 1
+
+    def trajectory(self) -> np.ndarray:
+        return self.records[:self.length]
+
+    def save(self, path: str) -> None:
+        saveTrajectory(path, self.trajectory())
+
+
+def toTrajectory(observations: Iterable[Tuple[int, BallObservation]]) -> np.ndarray:
+    writer = TrajectoryWriter()
+    for frameIndex, ballObservation in observations:
+        writer.write(frameIndex, ballObservation)
+    return writer.trajectory()
+
+
+def saveTrajectory(path: str, trajectory: np.ndarray) -> None:
+    np.save(path, trajectory, allow_pickle=False)
+
+
+def loadTrajectory(path: str, mmap: bool=True) -> np.ndarray:
+    """Memory-maps the file by default, so only the frames that get replayed are read from disk."""
+    trajectory = np.load(path, mmap_mode='r' if mmap else None, allow_pickle=False)
+    if trajectory.dtype != TRAJECTORY_DTYPE:
+        raise ValueError('%s is not a ball trajectory.' % path)
+    return trajectory
+
+
+def toObservations(trajectory: np.ndarray) -> List[Tuple[int, BallObservation]]:
+    """Decodes the records back into (frame index, ball observation) pairs in one pass per column."""
+    columns = {}
+    for field in SIDE_FIELDS:
+        column = trajectory[field].tolist()
+        columns[field] = [None if side == NO_SIDE else side for side in column]
+    for field in ('pos', 'lastPos'):
+        column = trajectory[field].tolist()
+        columns[field] = [None if pos[0] == NO_POS else tuple(pos) for pos in column]
+    for field in ('hasHitNet', 'framesOnSide', 'timeSinceBounce'):
+        columns[field] = trajectory[field].tolist()
+
+    ballObservations = map(BallObservation, *[columns[field] for field in BallObservation._fields])
+    return list(zip(trajectory['frame'].tolist(), ballObservations))
+
+
+def assumeBounceWasIn(game: GameState) -> int:
+    """Resolves an ambiguous bounce without video - the ball was not returned, so the hitter serves next."""
+    return other(game.ambiguousBounceSide)
+
+
+class TrajectoryReplay:
+    """
+    Drives GameState from a recorded trajectory instead of video.
+    The trajectory is decoded once, so the same one can be replayed many times while tuning GameState.
+    """
+
+    def __init__(self, trajectory: np.ndarray, netX: int, servingSide: int,
+                 sideSignal: Callable[[GameState], Optional[int]]=assumeBounceWasIn,
+                 geometry: Optional[SceneGeometry]=None):
+        self.observations = toObservations(trajectory)
+        self.netX = netX
+        self.geometry = geometry  # Of the recording the trajectory came from, 640x480 if not given
+        self.servingSide = servingSide
+        self.sideSignal = sideSignal
+
+    def newGame(self, gameType: type=GameState) -> GameState:
+        """A headless game ready to replay from the first frame - gameType lets tuned subclasses be replayed."""
+        game = gameType(None, headless=True, sideSignal=self.sideSignal, geometry=self.geometry)
+        game.begin(self.netX, self.servingSide)
+        return game
+
+    def run(self, game: Optional[GameState]=None, onFrame: Optional[Callable[[int, GameState], None]]=None) -> GameState:
+        if game is None:
+            game = self.newGame()
+        updateState = game.updateState
+        if onFrame is None:
+            for frameIndex, ballObservation in self.observations:
+                updateState(ballObservation)
+        else:
+            for frameIndex, ballObservation in self.observations:
+                updateState(ballObservation)
+                onFrame(frameIndex, game)
+        return game
+
+
+def checkConformance(trajectory: np.ndarray, netX: int, servingSide: int, geometry: Optional[SceneGeometry]=None,
+                     gameType: type=GameState, referenceType: type=LegacyGameState) -> Optional[int]:
+    """
+    Replays the trajectory through gameType and the reference state machine side by side, returning the first
+    frame after which they disagree about the game - its state, score or the sides involved - or None if they
+    never do.
+    """
+    replay = TrajectoryReplay(trajectory, netX, servingSide, geometry=geometry)
+    game, reference = replay.newGame(gameType), replay.newGame(referenceType)
+    for frameIndex, ballObservation in replay.observations:
+        game.updateState(ballObservation)
+        reference.updateState(ballObservation)
+        if game.summary() != reference.summary():
+            return frameIndex
+    return None
@@ -0,0 +1,33 @@
+import contextlib
+import io
+import os
+from Setup import LEFT
+from Game import GameState, LegacyGameState
+from Trajectory import TrajectoryReplay, loadTrajectory
+
+# Ball observations tracked from a synthetic match video - rallies, missed returns, long serves given a second
+# try and a bounce at the far edge of the table
+TRAJECTORY = os.path.join(os.path.dirname(__file__), 'trajectories', 'synthetic_match.npy')
+NET_X = 320  # Of the 640x480 video
+SERVING_SIDE = LEFT
+
+
+def stateSequence(gameType: type) -> list:
+    """The game's summary after every frame of the trajectory."""
+    replay = TrajectoryReplay(loadTrajectory(TRAJECTORY), NET_X, SERVING_SIDE)
+    summaries = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        replay.run(replay.newGame(gameType), lambda frameIndex, game: summaries.append((frameIndex, game.summary())))
+    return summaries
+
+
+def test_rule_table_matches_legacy_state_machine():
+    states = stateSequence(GameState)
+    reference = stateSequence(LegacyGameState)
+
+    visited = {summary[0] for frameIndex, summary in states}
+    for state in (GameState.STATE_EXPECTING_RESPONSE, GameState.STATE_FREE_BALL, GameState.STATE_AMBIGUOUS_BOUNCE):
+        assert state in visited, 'The trajectory never reaches %s' % GameState.STATE_TO_NAME[state]
+    for (frameIndex, summary), (_, expected) in zip(states, reference):
+        assert summary == expected, 'GameState differs from LegacyGameState after frame %d' % frameIndex
+    assert len(states) == len(reference)
@@ -0,0 +1,43 @@
+import tracemalloc
+from Synthetic import syntheticFrames
+from Ball import Ball, FrameBuffers
+
+RES = (320, 240)
+FRAMES = 10000
+PERIOD = 90  # The synthetic rally repeats every two shots, so cycling through one period never jumps
+MAX_GROWTH = 64 * 1024  # Bytes still held after all the frames
+MAX_FRAME_PEAK = 8 * 1024  # Bytes allocated at once during a frame, on average - small Python objects only
+
+
+def test_memory_stays_flat_over_10k_frames():
+    rally = syntheticFrames(PERIOD, res=RES, noise=8)
+    ball = Ball(RES[0] // 2, servingSide=0, buffers=FrameBuffers(RES))
+    Ball.COLORS.table  # Built once on first use, not per frame
+
+    def track(i: int) -> bool:
+        found = ball.updatePosFromFrame(rally[(i - 1) % PERIOD], rally[i % PERIOD], showProcessedFrame=False,
+                                        showMaskFrame=False)
+        if found:
+            ball.updateProcessedData(output=False)
+        return found
+
+    for i in range(2 * PERIOD):
+        track(i)
+
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        peaks = 0
+        tracked = 0
+        for i in range(FRAMES):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            tracked += track(i)
+            peaks += tracemalloc.get_traced_memory()[1] - before
+        growth = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+
+    assert tracked > FRAMES // 2, 'The ball was only tracked in %d frames' % tracked
+    assert growth < MAX_GROWTH, 'Memory grew by %d bytes over %d frames' % (growth, FRAMES)
+    assert peaks / FRAMES < MAX_FRAME_PEAK, 'Frames allocated %d bytes at once on average' % (peaks / FRAMES)